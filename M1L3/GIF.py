@@ -2,7 +2,11 @@ from PIL import Image, ImageEnhance, ImageFilter, ImageStat
 from typing import Callable, Dict, Optional, Tuple, Any, List
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from aiogram.types import Message
+from aiogram.types import Message, PhotoSize
+from inference_pool import PoolBusyError, inference_pools
+from admission import AdmissionRejected, admission, queue_status
+from photo_ingest import decode_photo, fetch_photo
+from log_sink import log_message
 from dotenv import load_dotenv
 from datetime import datetime
 import random
@@ -30,12 +34,8 @@ class GIF:
         }
         self.is_running = True
 
-    def log_message(self, text: str) -> None:
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - {text}"
-        print(message)
-        with open('bot.log', 'a', encoding='utf-8') as f:
-            f.write(message + '\n')
+    def log_message(self, text: str, level: str = "INFO") -> None:
+        log_message(text, level=level)
 
     def format_processing_time(self, seconds: float) -> str:
         if seconds < 0.1:
@@ -111,19 +111,14 @@ class GIF:
             image = image.resize(new_size, Image.Resampling.LANCZOS)
         return image
 
-    async def download_and_optimize_photo(self, file_id: str) -> Optional[Image.Image]:
+    async def download_and_optimize_photo(self, photos: List[PhotoSize]) -> Optional[Image.Image]:
         try:
             if not self.bot:
                 return
-            file = await self.bot.get_file(file_id)
-            if file.file_path:
-                photo_data = await self.bot.download_file(file.file_path)
-                if photo_data:
-                    image = Image.open(io.BytesIO(photo_data.read()))
-                    if image.mode != 'RGB':
-                        image = image.convert('RGB')
-                    image = self.optimize_image_size(image)
-                    return image
+            max_size = self.optimization_settings['max_size']
+            photo_data = await fetch_photo(self.bot, photos, max_side=max_size)
+            image = decode_photo(photo_data, (max_size, max_size))
+            return self.optimize_image_size(image)
         except Exception as e:
             print(f"Ошибка загрузки фото: {e}")
         return None
@@ -330,9 +325,8 @@ class GIF:
                     await message.answer("Не удалось получить фото")
                     self.session_stats['failed_gifs'] += 1
                     return
-                photo = photo_list[-1]
                 start_time = time.time()
-                image = await self.download_and_optimize_photo(photo.file_id)
+                image = await self.download_and_optimize_photo(photo_list)
                 if not image:
                     await message.answer("Ошибка загрузки фото")
                     self.session_stats['failed_gifs'] += 1
@@ -359,11 +353,10 @@ class GIF:
                     f"Создаю 64 кадра...\n"
                     f"{reason}"
                 )
-                start_process_time = time.time()
-                gif_bytes = await asyncio.get_event_loop().run_in_executor(
-                    None, gif_creator, image
-                )
-                process_time = time.time() - start_process_time
+                async with admission.admit('gif', user_id, queue_status(processing_msg, "GIF")):
+                    start_process_time = time.time()
+                    gif_bytes = await inference_pools.run('gif', gif_creator, image)
+                    process_time = time.time() - start_process_time
                 formatted_process_time = self.format_processing_time(process_time)
                 print(f"GIF создан за {formatted_process_time}")
                 await processing_msg.edit_text("Отправляю результат...")
@@ -386,6 +379,20 @@ class GIF:
                 self.session_stats['successful_gifs'] += 1
                 print(f"Успешно создан GIF в стиле {style_name} для {request_id}")
 
+        except AdmissionRejected as e:
+            try:
+                await message.answer(str(e))
+            except Exception as send_error:
+                print(f"Ошибка отправки сообщения об отказе: {send_error}")
+            self.session_stats['failed_gifs'] += 1
+            print(f"Запрос {request_id} не принят в очередь GIF: {e}")
+        except PoolBusyError:
+            try:
+                await message.answer("Сейчас создаётся много GIF. Попробуйте через минуту.")
+            except Exception as send_error:
+                print(f"Ошибка отправки сообщения о перегрузке: {send_error}")
+            self.session_stats['failed_gifs'] += 1
+            print(f"Пул GIF перегружен, запрос {request_id} отклонён")
         except asyncio.TimeoutError:
             error_text = "Время обработки истекло. Попробуйте с меньшим изображением."
             try:
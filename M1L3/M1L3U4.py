@@ -1,5 +1,6 @@
 from aiogram import Dispatcher, types
 from dotenv import load_dotenv
+from log_sink import log_message as write_log
 from ai_model import AIModel
 from typing import Any
 from gtts import gTTS
@@ -12,13 +13,9 @@ load_dotenv()
 dp = Dispatcher()
 ai_model = AIModel()
 
-def log_message(text: str) -> None:
+def log_message(text: str, level: str = "INFO") -> None:
     """Логирование сообщений"""
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    message = f"{timestamp} - TEXT_TO_SPEECH - {text}"
-    print(message)
-    with open('bot.log', 'a', encoding='utf-8') as f:
-        f.write(message + '\n')
+    write_log(text, prefix="TEXT_TO_SPEECH", level=level)
 
 def get_user_info(message: types.Message) -> str:
     """Получает информацию о пользователе для логов"""
@@ -73,11 +70,11 @@ async def text_to_audio(message: types.Message):
         log_message(f"Аудио успешно отправлено {user_info} за {processing_time} секунд")
     except Exception as e:
         error_msg = f"Ошибка создания аудио для {user_info}: {e}"
-        log_message(error_msg)
+        log_message(error_msg, level="ERROR")
         if temp_path and os.path.exists(temp_path):
             try:
                 os.unlink(temp_path)
-                log_message("Временный файл удален после ошибки")
+                log_message("Временный файл удален после ошибки", level="WARNING")
             except Exception as cleanup_error:
-                log_message(f"Ошибка удаления временного файла: {cleanup_error}")
+                log_message(f"Ошибка удаления временного файла: {cleanup_error}", level="ERROR")
         await message.answer("Произошла ошибка при создании аудио. Попробуйте позже.")
\ No newline at end of file
@@ -1,15 +1,23 @@
 from typing import Any, Dict, List, Callable, Optional, Tuple
+from response_cache import kitsu_cache
+from pokedex import POKEDEX_MAX_ID, normalize_name, pokedex
+from http_client import http_client
 import urllib.parse
-import requests
+import aiohttp
+import asyncio
 import logging
-import random
 
 logger = logging.getLogger(__name__)
 
 # ========== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ==========
 
-def search_kitsu(category: str, query: str) -> Dict[str, Any]:
+async def search_kitsu(category: str, query: str) -> Dict[str, Any]:
     """Расширенный поиск с несколькими попытками"""
+    cached = await kitsu_cache.aget(category, query)
+    if cached is not None:
+        logger.info(f"Ответ Kitsu из кеша: {category} '{query}'")
+        return cached
+
     attempts: List[Callable[[], Optional[str]]] = [
         lambda: f'filter[name]={urllib.parse.quote(query)}',
         lambda: f'filter[text]={urllib.parse.quote(query)}',
@@ -30,16 +38,14 @@ def search_kitsu(category: str, query: str) -> Dict[str, Any]:
                 'Content-Type': 'application/vnd.api+json'
             }
             
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
+            data = await http_client.get_json(url, headers=headers, timeout=10)
             
             if data.get('data'):
                 logger.info(f"Успешный запрос с фильтром: {filter_param}")
+                await kitsu_cache.aset(category, query, data)
                 return data
                 
-        except requests.exceptions.HTTPError as e:
+        except aiohttp.ClientResponseError as e:
             logger.warning(f"Неудачная попытка с фильтром: {filter_param}")
             continue
         except Exception as e:
@@ -48,7 +54,7 @@ def search_kitsu(category: str, query: str) -> Dict[str, Any]:
     
     return {'data': []}
 
-def search_kitsu_alternative(category: str, query: str) -> Dict[str, Any]:
+async def search_kitsu_alternative(category: str, query: str) -> Dict[str, Any]:
     """Альтернативный метод поиска через общий поиск"""
     try:
         # Используем другой endpoint для поиска
@@ -62,10 +68,7 @@ def search_kitsu_alternative(category: str, query: str) -> Dict[str, Any]:
             'Content-Type': 'application/vnd.api+json'
         }
         
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
+        data = await http_client.get_json(url, headers=headers, timeout=10)
         return data
         
     except Exception as e:
@@ -128,8 +131,45 @@ def format_person_result(attributes: Dict[str, Any]) -> str:
     return (f"👤 <b>Имя:</b> {name}\n"
             f"🎂 <b>День рождения:</b> {birthday}")
     
-def search_anime_advanced(query: str) -> Dict[str, Any]:
-    """Продвинутый поиск аниме с несколькими стратегиями"""
+async def _fetch_anime_strategy(url: str) -> List[Dict[str, Any]]:
+    """Выполняет одну стратегию поиска аниме"""
+    try:
+        logger.info(f"Попытка поиска: {url}")
+        headers = {
+            'Accept': 'application/vnd.api+json',
+            'Content-Type': 'application/vnd.api+json'
+        }
+        
+        data = await http_client.get_json(url, headers=headers, timeout=10)
+        return data.get('data') or []
+            
+    except Exception as e:
+        logger.warning(f"Ошибка в стратегии поиска: {e}")
+        return []
+
+def is_exact_anime_match(item: Dict[str, Any], query: str) -> bool:
+    """Проверяет точное совпадение названия с запросом"""
+    query_lower = query.lower()
+    attributes = item.get('attributes', {})
+    titles = attributes.get('titles', {})
+    return query_lower in (
+        (titles.get('en') or '').lower(),
+        (titles.get('ja_jp') or '').lower(),
+        (attributes.get('canonicalTitle') or '').lower(),
+    )
+
+async def search_anime_advanced(query: str, stop_on_exact: bool = False) -> Dict[str, Any]:
+    """Продвинутый поиск аниме с несколькими стратегиями.
+
+    Стратегии выполняются параллельно. С stop_on_exact=True оставшиеся
+    запросы отменяются, как только найдено точное совпадение названия.
+    """
+    cache_category = 'anime_advanced_exact' if stop_on_exact else 'anime_advanced'
+    cached = await kitsu_cache.aget(cache_category, query)
+    if cached is not None:
+        logger.info(f"Результаты поиска аниме из кеша: '{query}'")
+        return cached
+
     encoded_query = urllib.parse.quote(query)
     
     strategies: List[Optional[str]] = [
@@ -138,37 +178,41 @@ def search_anime_advanced(query: str) -> Dict[str, Any]:
         f'https://kitsu.io/api/edge/anime?filter[text]={encoded_query}&sort=popularityRank' if len(query) > 3 else None
     ]
     
-    all_results: List[Dict[str, Any]] = []
+    tasks: Dict[asyncio.Task[List[Dict[str, Any]]], int] = {
+        asyncio.create_task(_fetch_anime_strategy(url)): index
+        for index, url in enumerate(strategies)
+        if url
+    }
+    results_by_strategy: Dict[int, List[Dict[str, Any]]] = {}
+    pending = set(tasks)
     
-    for url in strategies:
-        if not url:
-            continue
-            
-        try:
-            logger.info(f"Попытка поиска: {url}")
-            headers = {
-                'Accept': 'application/vnd.api+json',
-                'Content-Type': 'application/vnd.api+json'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=10)
-            response.raise_for_status()
-            
-            data = response.json()
-            if data.get('data'):
-                all_results.extend(data['data'])
-                
-        except Exception as e:
-            logger.warning(f"Ошибка в стратегии поиска: {e}")
-            continue
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                results_by_strategy[tasks[task]] = task.result()
+            if stop_on_exact and any(
+                is_exact_anime_match(item, query)
+                for task in done
+                for item in results_by_strategy[tasks[task]]
+            ):
+                logger.info(f"Точное совпадение для '{query}', отменяю {len(pending)} запросов")
+                break
+    finally:
+        for task in pending:
+            task.cancel()
     
     unique_results: Dict[str, Any] = {}
-    for item in all_results:
-        item_id = item['id']
-        if item_id not in unique_results:
-            unique_results[item_id] = item
+    for index in sorted(results_by_strategy):
+        for item in results_by_strategy[index]:
+            item_id = item['id']
+            if item_id not in unique_results:
+                unique_results[item_id] = item
     
-    return {'data': list(unique_results.values())}
+    merged = {'data': list(unique_results.values())}
+    if merged['data']:
+        await kitsu_cache.aset(cache_category, query, merged)
+    return merged
 
 def find_best_anime_match(results: List[Dict[str, Any]], query: str) -> Optional[Dict[str, Any]]:
     """Находит наиболее релевантный результат для запроса"""
@@ -209,49 +253,65 @@ def find_best_anime_match(results: List[Dict[str, Any]], query: str) -> Optional
     
     return scored_results[0][1] if scored_results else results[0] 
 
-def get_dog_image() -> str:
+async def get_dog_image() -> str:
     """Получает случайное изображение собаки"""
     try:
         url = 'https://random.dog/woof.json'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = await http_client.get_json(url, timeout=10)
         return data.get('url', '')
     except Exception as e:
         logger.error(f"Error getting dog image: {e}")
         return ''
 
-def get_fox_image() -> str:
+async def get_fox_image() -> str:
     """Получает случайное изображение лисы"""
     try:
         url = 'https://randomfox.ca/floof/'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = await http_client.get_json(url, timeout=10)
         return data.get('image', '')
     except Exception as e:
         logger.error(f"Error getting fox image: {e}")
         return ''
 
-def get_pokemon_info(pokemon_name: str) -> Dict[str, Any]:
-    """Получает информацию о покемоне"""
+async def _remember_pokemon(data: Dict[str, Any]) -> None:
+    """Дописывает ответ PokeAPI в локальный Pokédex"""
     try:
-        url = f'https://pokeapi.co/api/v2/pokemon/{pokemon_name.lower()}'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
+        await asyncio.to_thread(pokedex.add, data)
     except Exception as e:
+        logger.warning(f"Не удалось сохранить покемона в Pokédex: {e}")
+
+async def get_pokemon_info(pokemon_name: str) -> Dict[str, Any]:
+    """Получает информацию о покемоне: сначала из локального Pokédex, затем из сети.
+
+    Опечатки исправляются по снимку, только если он полный или сеть не нашла точное имя.
+    """
+    await pokedex.aensure_loaded()
+    local = pokedex.lookup(pokemon_name, fuzzy=pokedex.is_complete())
+    if local is not None:
+        return local
+    try:
+        url = f'https://pokeapi.co/api/v2/pokemon/{normalize_name(pokemon_name)}'
+        data = await http_client.get_json(url, timeout=10)
+        await _remember_pokemon(data)
+        return data
+    except Exception as e:
+        corrected = pokedex.lookup(pokemon_name)
+        if corrected is not None:
+            return corrected
         logger.error(f"Error getting pokemon info: {e}")
         raise
 
-def get_random_pokemon() -> Dict[str, Any]:
-    """Получает случайного покемона"""
+async def get_random_pokemon() -> Dict[str, Any]:
+    """Получает случайного покемона: номер случайный, данные из Pokédex или из сети"""
+    await pokedex.aensure_loaded()
+    pokemon_id, local = pokedex.random(POKEDEX_MAX_ID)
+    if local is not None:
+        return local
     try:
-        pokemon_id = random.randint(1, 1010) 
         url = f'https://pokeapi.co/api/v2/pokemon/{pokemon_id}'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        return response.json()
+        data = await http_client.get_json(url, timeout=10)
+        await _remember_pokemon(data)
+        return data
     except Exception as e:
         logger.error(f"Error getting random pokemon: {e}")
         raise
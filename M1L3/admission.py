@@ -0,0 +1,255 @@
+"""Допуск тяжёлых задач: лимит одновременных запусков, ограниченная очередь
+и честная очередь между пользователями.
+
+У каждой возможности (GIF, детекция, классификация) своя очередь; генерация
+изображений идёт через собственную очередь задач в diffusion_jobs.py.
+Ожидающие задачи обслуживаются по кругу между пользователями: десять
+запросов одного пользователя не задерживают первый запрос другого. Пока
+задача ждёт, ей сообщается её место в очереди; переполнение очереди или
+лимита на пользователя отклоняется сразу.
+
+    async with admission.admit('gif', user_id, on_position=report):
+        ...
+"""
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Iterator, Optional
+from contextlib import asynccontextmanager
+from collections import OrderedDict, deque
+from inference_pool import PoolBusyError
+from aiogram.types import Message
+import asyncio
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# (одновременно выполняется, сколько может ждать в очереди)
+ADMISSION_LIMITS: Dict[str, tuple[int, int]] = {
+    'gif': (int(os.getenv("GIF_CONCURRENCY", "2")), int(os.getenv("GIF_ADMISSION_QUEUE", "8"))),
+    # Детекции нужен запас параллельности, иначе микробатчеру нечего объединять
+    'detection': (int(os.getenv("DETECTION_CONCURRENCY", "8")), int(os.getenv("DETECTION_ADMISSION_QUEUE", "32"))),
+    'classification': (int(os.getenv("CLASSIFICATION_CONCURRENCY", "4")), int(os.getenv("CLASSIFICATION_ADMISSION_QUEUE", "32"))),
+}
+# Сколько задач одного пользователя может быть в работе и в очереди одновременно
+ADMISSION_PER_USER: int = int(os.getenv("ADMISSION_PER_USER", "2"))
+
+PositionCallback = Callable[[int], Awaitable[Any]]
+
+
+class AdmissionRejected(PoolBusyError):
+    """Задача не принята в очередь; текст можно показать пользователю."""
+
+    def __init__(self, pool: str, reason: str):
+        super().__init__(pool)
+        # Вместо «пул перегружен» — причина, понятная пользователю
+        self.args = (reason,)
+        self.reason = reason
+
+
+class _Ticket:
+    __slots__ = ('user_id', 'future', 'callback', 'position', 'task', 'enqueued_at')
+
+    def __init__(self, user_id: int, callback: Optional[PositionCallback]):
+        self.user_id = user_id
+        self.future: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+        self.callback = callback
+        self.position = 0
+        self.task: Optional[asyncio.Task[None]] = None
+        self.enqueued_at = time.perf_counter()
+
+
+class AdmissionQueue:
+    """Очередь одной возможности с обслуживанием пользователей по кругу."""
+
+    def __init__(self, name: str, limit: int, max_queue: int, per_user: int = ADMISSION_PER_USER):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max(0, max_queue)
+        self.per_user = max(1, per_user)
+        self.running = 0
+        # Порядок ключей — порядок обхода пользователей
+        self._waiting: "OrderedDict[int, Deque[_Ticket]]" = OrderedDict()
+        self._per_user: Dict[int, int] = {}
+        # Кто получил слот последним: при следующем запуске он пропускает вперёд остальных
+        self._last_served: Optional[int] = None
+        self.stats: Dict[str, Any] = {
+            'admitted': 0,
+            'queued': 0,
+            'rejected': 0,
+            'wait_time': 0.0,
+            'wait_max': 0.0,
+        }
+
+    @property
+    def queued(self) -> int:
+        return sum(len(tickets) for tickets in self._waiting.values())
+
+    def _ordered(self) -> Iterator[_Ticket]:
+        """Ожидающие в том порядке, в котором их запустит _dispatch: по одной задаче от каждого пользователя за круг."""
+        queues = list(self._waiting.values())
+        if len(queues) > 1 and next(iter(self._waiting)) == self._last_served:
+            queues.append(queues.pop(0))
+        depth = max((len(tickets) for tickets in queues), default=0)
+        for round_index in range(depth):
+            for tickets in queues:
+                if round_index < len(tickets):
+                    yield tickets[round_index]
+
+    def _reject(self, reason: str) -> AdmissionRejected:
+        self.stats['rejected'] += 1
+        return AdmissionRejected(self.name, reason)
+
+    @asynccontextmanager
+    async def admit(self, user_id: int, on_position: Optional[PositionCallback] = None) -> AsyncIterator[None]:
+        """Ждёт своей очереди и держит слот до выхода из блока.
+
+        AdmissionRejected — сразу, если у пользователя уже per_user задач или очередь заполнена.
+        on_position получает номер в очереди при каждом его изменении и 0 при старте.
+        """
+        if self._per_user.get(user_id, 0) >= self.per_user:
+            raise self._reject(f"У тебя уже {self.per_user} задачи в очереди, дождись результата")
+        if self.running >= self.limit or self._waiting:
+            if self.queued >= self.max_queue:
+                raise self._reject("Очередь заполнена, попробуй через минуту")
+            await self._wait(user_id, on_position)
+        else:
+            self.running += 1
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self._last_served = user_id
+        self.stats['admitted'] += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self._release_user(user_id)
+            self._dispatch()
+
+    async def _wait(self, user_id: int, on_position: Optional[PositionCallback]) -> None:
+        ticket = _Ticket(user_id, on_position)
+        self._waiting.setdefault(user_id, deque()).append(ticket)
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        self.stats['queued'] += 1
+        self._update_positions()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.future.done() and not ticket.future.cancelled():
+                # Слот уже выдан, но задача отменена — возвращаем его
+                self.running -= 1
+                self._release_user(user_id)
+                self._dispatch()
+            else:
+                self._discard(ticket)
+            raise
+        waited = time.perf_counter() - ticket.enqueued_at
+        self.stats['wait_time'] += waited
+        self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+        if ticket.position:
+            self._notify(ticket, 0)
+
+    def _discard(self, ticket: _Ticket) -> None:
+        tickets = self._waiting.get(ticket.user_id)
+        if tickets is not None and ticket in tickets:
+            tickets.remove(ticket)
+            if not tickets:
+                del self._waiting[ticket.user_id]
+        self._release_user(ticket.user_id)
+        self._update_positions()
+
+    def _release_user(self, user_id: int) -> None:
+        count = self._per_user.get(user_id, 0) - 1
+        if count > 0:
+            self._per_user[user_id] = count
+        else:
+            self._per_user.pop(user_id, None)
+
+    def _dispatch(self) -> None:
+        """Запускает ожидающих, пока есть свободные слоты: берёт первого пользователя
+        в круге и переносит его в конец, если у него остались задачи.
+
+        Пользователь, только что получивший слот без очереди, ещё не стоит в круге,
+        поэтому последний обслуженный уступает первое место, если ждут другие.
+        """
+        started = False
+        while self.running < self.limit and self._waiting:
+            if len(self._waiting) > 1 and next(iter(self._waiting)) == self._last_served:
+                self._waiting.move_to_end(self._last_served)
+            user_id, tickets = next(iter(self._waiting.items()))
+            ticket = tickets.popleft()
+            if tickets:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+            if ticket.future.done():
+                continue
+            self.running += 1
+            self._last_served = user_id
+            ticket.future.set_result(None)
+            started = True
+        if started:
+            self._update_positions()
+
+    def _update_positions(self) -> None:
+        for position, ticket in enumerate(self._ordered(), start=1):
+            if ticket.position != position:
+                self._notify(ticket, position)
+
+    def _notify(self, ticket: _Ticket, position: int) -> None:
+        ticket.position = position
+        if ticket.callback is None or (ticket.task is not None and not ticket.task.done()):
+            return
+        ticket.task = asyncio.create_task(self._deliver(ticket))
+
+    @staticmethod
+    async def _deliver(ticket: _Ticket) -> None:
+        """Отправляет последнюю позицию; быстрые изменения схлопываются в одно сообщение."""
+        assert ticket.callback is not None
+        sent: Optional[int] = None
+        while ticket.position != sent:
+            sent = ticket.position
+            try:
+                await ticket.callback(sent)
+            except Exception as e:
+                logger.debug(f"Не удалось обновить позицию в очереди: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['running'] = self.running
+        stats['limit'] = self.limit
+        stats['waiting'] = self.queued
+        stats['max_queue'] = self.max_queue
+        stats['users'] = len(self._waiting)
+        admitted_from_queue = self.stats['queued'] - self.queued
+        stats['avg_wait'] = self.stats['wait_time'] / admitted_from_queue if admitted_from_queue > 0 else 0.0
+        return stats
+
+
+class Admission:
+    """Очереди допуска по именам возможностей."""
+
+    def __init__(self, limits: Dict[str, tuple[int, int]] = ADMISSION_LIMITS, per_user: int = ADMISSION_PER_USER):
+        self._queues: Dict[str, AdmissionQueue] = {
+            name: AdmissionQueue(name, limit, max_queue, per_user) for name, (limit, max_queue) in limits.items()
+        }
+
+    def __getitem__(self, name: str) -> AdmissionQueue:
+        return self._queues[name]
+
+    def admit(self, capability: str, user_id: int, on_position: Optional[PositionCallback] = None) -> Any:
+        return self._queues[capability].admit(user_id, on_position)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: queue.get_stats() for name, queue in self._queues.items()}
+
+
+def queue_status(status: Message, title: str) -> PositionCallback:
+    """Колбэк, который правит служебное сообщение: «#N в очереди», а при старте — «начинаю»."""
+    async def report(position: int) -> None:
+        if position > 0:
+            await status.edit_text(f"⏳ {title}: ты #{position} в очереди")
+        else:
+            await status.edit_text(f"▶️ {title}: очередь подошла, начинаю")
+    return report
+
+
+admission = Admission()
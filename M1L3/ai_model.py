@@ -1,12 +1,12 @@
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.ensemble import RandomForestClassifier
 from data_processor import DataProcessor
+from log_sink import log_message
 from h5py._hl.dataset import Dataset
 from h5py._hl.files import File
 from typing import Any
 import numpy as np
 import joblib
-import time
 import h5py
 import os
 import io
@@ -40,17 +40,13 @@ class AIModel:
                 self.log_message("Новая модель RandomForest инициализирована")
                 
         except Exception as e:
-            self.log_message(f"Ошибка загрузки модели: {e}")
+            self.log_message(f"Ошибка загрузки модели: {e}", level="ERROR")
             self.model = RandomForestClassifier(n_estimators=100)
-            self.log_message("Создана новая модель после ошибки")
+            self.log_message("Создана новая модель после ошибки", level="WARNING")
     
-    def log_message(self, text: str) -> None:
+    def log_message(self, text: str, level: str = "INFO") -> None:
         """Логирование сообщений"""
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - AI_MODEL - {text}"
-        print(message)
-        with open('bot.log', 'a', encoding='utf-8') as f:
-            f.write(message + '\n')
+        log_message(text, prefix="AI_MODEL", level=level)
 
     def save_model(self):
         """Сохраняет модель в HDF5"""
@@ -65,7 +61,7 @@ class AIModel:
                     getattr(f, "create_dataset")('model', data=np.void(model_bytes))
                 self.log_message("Модель успешно сохранена")
             except Exception as e:
-                self.log_message(f"Ошибка сохранения модели: {e}")
+                self.log_message(f"Ошибка сохранения модели: {e}", level="ERROR")
         else:
             self.log_message("Модель не существует для сохранения")
 
@@ -107,7 +103,7 @@ class AIModel:
             if save_result:
                 self.log_message("Данные пользователя сохранены")
             else:
-                self.log_message("Ошибка сохранения данных пользователя")
+                self.log_message("Ошибка сохранения данных пользователя", level="ERROR")
             self.log_message("Анализ тональности")
             sentiment = self.analyze_sentiment(text)
             self.log_message("Генерация ответа")
@@ -125,7 +121,7 @@ class AIModel:
             self.log_message(f"Обработка сообщения завершена. Ответ: '{response[:50]}...'")
             return result
         except Exception as e:
-            self.log_message(f"Ошибка обработки сообщения: {e}")
+            self.log_message(f"Ошибка обработки сообщения: {e}", level="ERROR")
             return {
                 "response": "Извините, произошла ошибка при обработке сообщения",
                 "sentiment": "Неизвестно",
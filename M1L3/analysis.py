@@ -0,0 +1,102 @@
+"""Разбор одного фото сразу несколькими моделями (/analyze).
+
+Фото скачивается и декодируется один раз: кадр под детектор (длинная сторона
+около YOLO_IMGSZ) и из него же — тензор 224×224, общий для обоих
+классификаторов. Детектор и классификаторы работают параллельно в своих
+пулах, поэтому ответ приходит примерно за время самой медленной модели.
+"""
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+from keras_classifier import KerasClassifier
+from inference_pool import PoolBusyError
+from yolo_backends import YOLO_IMGSZ
+from photo_ingest import decode_photo
+from cv import format_detections
+from PIL import Image
+import numpy as np
+import logging
+import asyncio
+import time
+
+logger = logging.getLogger(__name__)
+
+# Порядок и подписи блоков в ответе
+ANALYSIS_TITLES: Dict[str, str] = {
+    "detector": "🔍 YOLO",
+    "tm": "🤖 Teachable Machine",
+    "ideogram": "🎨 Ideogram",
+}
+
+
+def prepare_inputs(
+    payload: bytes,
+    runtimes: Sequence[KerasClassifier],
+) -> Tuple[Image.Image, Dict[Tuple[int, int], np.ndarray]]:
+    """Декодирует фото один раз; тензор строится по одному на каждый размер входа классификаторов."""
+    image = decode_photo(payload, (YOLO_IMGSZ, YOLO_IMGSZ))
+    tensors: Dict[Tuple[int, int], np.ndarray] = {}
+    for runtime in runtimes:
+        if runtime.input_size not in tensors:
+            tensors[runtime.input_size] = runtime.preprocess([image])
+    return image, tensors
+
+
+async def analyze_photo(
+    payload: bytes,
+    detector: Optional[Any] = None,
+    tm_model: Optional[Any] = None,
+    ideogram_model: Optional[Any] = None,
+) -> Dict[str, Any]:
+    """Запускает доступные модели параллельно на общем входе.
+
+    Возвращает словарь имя модели → результат или исключение (ошибка одной
+    модели не роняет остальные) и ключ 'elapsed' с общим временем в секундах.
+    """
+    started = time.perf_counter()
+    classifiers = {name: model for name, model in (("tm", tm_model), ("ideogram", ideogram_model)) if model is not None}
+    image, tensors = await asyncio.to_thread(
+        prepare_inputs, payload, [model.runtime for model in classifiers.values()],
+    )
+
+    tasks: Dict[str, Any] = {}
+    if detector is not None:
+        tasks["detector"] = detector.detect_objects(image)
+    for name, model in classifiers.items():
+        tasks[name] = model.predict_prepared(tensors[model.runtime.input_size])
+
+    outputs = await asyncio.gather(*tasks.values(), return_exceptions=True)
+    results: Dict[str, Any] = {}
+    for name, output in zip(tasks, outputs):
+        if isinstance(output, BaseException):
+            logger.error(f"/analyze: ошибка модели {name}: {output}")
+            results[name] = output
+        elif name == "detector":
+            results[name] = output
+        else:
+            results[name] = output[0]
+    results["elapsed"] = time.perf_counter() - started
+    return results
+
+
+def format_analysis(results: Mapping[str, Any], limit: int = 5) -> str:
+    """Общая подпись: объекты детектора и top-1 классификаторов.
+
+    Значение-строка — статус модели, которая не запускалась (например, прогревается).
+    """
+    lines: List[str] = [f"🧩 Анализ фото за {results.get('elapsed', 0.0):.1f} с"]
+    for name, title in ANALYSIS_TITLES.items():
+        if name not in results:
+            continue
+        value = results[name]
+        lines.append("")
+        if isinstance(value, str):
+            lines.append(f"{title}: {value}")
+        elif isinstance(value, PoolBusyError):
+            lines.append(f"{title}: ⏳ перегружен, попробуй позже")
+        elif isinstance(value, BaseException):
+            lines.append(f"{title}: ❌ ошибка")
+        elif name == "detector":
+            lines.append(format_detections(value[1], limit=limit))
+        else:
+            class_name, confidence = value
+            lines.append(f"{title}: {class_name} ({confidence:.1%})")
+    return "\n".join(lines)
@@ -0,0 +1,134 @@
+"""Кеш распаковки архивов моделей (.tm, .zip) по хешу содержимого.
+
+Архив распаковывается один раз в папку <имя>-<sha256>; при следующих
+запусках и перезагрузках она используется как есть. Метки и .h5-модель
+можно читать прямо из архива в памяти, вообще не трогая диск.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+from log_sink import log_message
+import threading
+import hashlib
+import logging
+import zipfile
+import shutil
+import io
+import os
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CACHE_DIR: str = os.getenv("ARCHIVE_CACHE_DIR", "data/model_archives")
+ARCHIVE_IN_MEMORY: bool = os.getenv("ARCHIVE_IN_MEMORY", "0") == "1"
+
+MODEL_EXTENSIONS: Tuple[str, ...] = ('.h5', '.hdf5', '.keras')
+COMPLETE_MARKER = ".complete"
+
+_digests: Dict[str, Tuple[int, float, str]] = {}
+_lock = threading.Lock()
+
+
+def archive_digest(path: str, length: int = 16) -> str:
+    """SHA-256 архива; пересчитывается только при изменении размера или mtime."""
+    stat = os.stat(path)
+    cached = _digests.get(path)
+    if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+        return cached[2]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()[:length]
+    _digests[path] = (stat.st_size, stat.st_mtime, value)
+    return value
+
+
+class ModelArchive:
+    """Архив модели: метки и .h5 читаются из zip, остальное — из кешированной распаковки."""
+
+    def __init__(self, archive_path: str, cache_dir: str = ARCHIVE_CACHE_DIR):
+        self.archive_path = archive_path
+        self.cache_dir = cache_dir
+        self.stem = os.path.splitext(os.path.basename(archive_path))[0]
+
+    @property
+    def extract_dir(self) -> str:
+        return os.path.join(self.cache_dir, f"{self.stem}-{archive_digest(self.archive_path)}")
+
+    def extract(self) -> str:
+        """Папка с распакованным архивом; распаковка — только если её ещё нет."""
+        target = self.extract_dir
+        if os.path.exists(os.path.join(target, COMPLETE_MARKER)):
+            return target
+        with _lock:
+            if os.path.exists(os.path.join(target, COMPLETE_MARKER)):
+                return target
+            os.makedirs(self.cache_dir, exist_ok=True)
+            staging = f"{target}.tmp-{os.getpid()}"
+            shutil.rmtree(staging, ignore_errors=True)
+            with zipfile.ZipFile(self.archive_path, 'r') as zf:
+                zf.extractall(staging)
+            open(os.path.join(staging, COMPLETE_MARKER), 'w').close()
+            shutil.rmtree(target, ignore_errors=True)
+            os.replace(staging, target)
+            self._prune_stale(target)
+        log_message(f"Архив {self.archive_path} распакован в {target}")
+        return target
+
+    def _prune_stale(self, current: str) -> None:
+        """Удаляет распаковки прошлых версий того же архива."""
+        prefix = f"{self.stem}-"
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(prefix) and path != current and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+                logger.info(f"Удалена устаревшая распаковка {path}")
+
+    def read_labels(self) -> List[str]:
+        """labels.txt прямо из архива, без распаковки."""
+        with zipfile.ZipFile(self.archive_path, 'r') as zf:
+            for name in zf.namelist():
+                if os.path.basename(name) == "labels.txt":
+                    text = zf.read(name).decode('utf-8')
+                    return [line.strip() for line in text.splitlines()]
+        return []
+
+    def model_member(self) -> Optional[str]:
+        with zipfile.ZipFile(self.archive_path, 'r') as zf:
+            for name in zf.namelist():
+                if name.endswith(MODEL_EXTENSIONS):
+                    return name
+        return None
+
+    def open_h5(self) -> Optional[Any]:
+        """h5py.File поверх байтов .h5 из архива или None, если модель не в HDF5."""
+        member = self.model_member()
+        if member is None or not member.endswith(('.h5', '.hdf5')):
+            return None
+        try:
+            import h5py
+        except ImportError:
+            return None
+        with zipfile.ZipFile(self.archive_path, 'r') as zf:
+            data = zf.read(member)
+        return h5py.File(io.BytesIO(data), 'r')
+
+    def load_keras_in_memory(self, custom_objects: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        """Модель Keras из .h5 в архиве без распаковки; None — тогда грузить из распаковки.
+
+        Keras 3 load_model принимает только путь, поэтому h5py.File читается
+        загрузчиком устаревшего формата HDF5.
+        """
+        h5_file = self.open_h5()
+        if h5_file is None:
+            return None
+        try:
+            from keras.src.legacy.saving.legacy_h5_format import load_model_from_hdf5
+            return load_model_from_hdf5(h5_file, custom_objects=custom_objects, compile=False)
+        except Exception as e:
+            log_message(f"⚠️ {self.archive_path}: загрузка из памяти не удалась ({e}), распаковываю", level="WARNING")
+            return None
+        finally:
+            h5_file.close()
+
+    def remove(self) -> None:
+        """Удаляет распаковку текущей версии архива."""
+        shutil.rmtree(self.extract_dir, ignore_errors=True)
@@ -1,26 +1,42 @@
 from M2L1U4 import find_best_anime_match, format_anime_result, format_character_result, format_manga_result, format_person_result, format_pokemon_result, get_dog_image, get_fox_image, get_pokemon_info, get_random_pokemon, search_anime_advanced, search_kitsu
 from image_generator import ImageGenerator, LightImageGenerator
 from aiogram.types import BotCommand, BotCommandScopeDefault, Message
-from typing import Any, Coroutine, Dict, cast
+from typing import Any, Coroutine, Dict, List, Optional, cast
 from aiogram import Bot, Dispatcher, types
 from tm import TeachableMachineRuntime
 from aiogram.filters import Command
-from ideogram import IdeogramModel
+from ideogram import IMG_SIZE as IDEOGRAM_INPUT_SIZE, IdeogramModel
+from analysis import analyze_photo, format_analysis
 from dotenv import load_dotenv
 from datetime import datetime
 from bs4 import BeautifulSoup
-from cv import detector
+from inference_cache import INFERENCE_CACHE_STORE_IMAGES, CacheKey, inference_cache
+from archive_cache import archive_digest
+from tflite_export import CLASSIFIER_TFLITE
+from cv import CONFIDENCE_THRESHOLD, IOU_THRESHOLD, YOLODetector, detector
+from yolo_backends import YOLO_IMGSZ
 from aiogram import F
 from gtts import gTTS
+from response_cache import kitsu_cache
+from media_cache import answer_photo_file_cached, answer_photo_url_cached
+from http_client import http_client
+from inference_pool import PoolBusyError, inference_pools
+from admission import AdmissionRejected, admission, queue_status
+from diffusion_jobs import DiffusionJob, diffusion_jobs
+from prompt_embeddings import prompt_embeddings
+from generated_cache import generated_images
+from photo_ingest import PhotoDownloadError, fetch_photo
+from model_registry import ModelState, models
+from log_sink import log_message, sink as log_sink
 from GIF import GIF
 import requests
 import tempfile
+import io
 import logging
 import asyncio
 import random
 import string
 import torch
-import time
 import os
 
 load_dotenv()
@@ -35,19 +51,58 @@ bot = Bot(token=TOKEN)
 dp = Dispatcher()
 gif_creator = GIF()
 light_gen = LightImageGenerator()
-image_gen = ImageGenerator()
-tm_model = TeachableMachineRuntime("project2.tm")
-ideogram_model = IdeogramModel("converted_keras.zip")
-tm_model.load_project()
 gif_creator.bot = bot
 user_states = {}
 
-def log_message(text: str) -> None:
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    message = f"{timestamp} - {text}"
-    print(message)
-    with open('bot.log', 'a', encoding='utf-8') as f:
-        f.write(message + '\n')
+TM_PROJECT_PATH = "project2.tm"
+IDEOGRAM_ZIP_PATH = "converted_keras.zip"
+
+def load_tm_model() -> TeachableMachineRuntime:
+    model = TeachableMachineRuntime(TM_PROJECT_PATH)
+    if not model.load_project():
+        raise RuntimeError(f"Проект {TM_PROJECT_PATH} не загружен")
+    return model
+
+def load_ideogram_model() -> IdeogramModel:
+    model = IdeogramModel(IDEOGRAM_ZIP_PATH)
+    if not model.load():
+        raise RuntimeError(f"Архив {IDEOGRAM_ZIP_PATH} не загружен")
+    return model
+
+# Архивы классификаторов: их хеш — версия модели в ключах кеша инференса
+CLASSIFIER_ARCHIVES: Dict[str, str] = {
+    "teachable_machine": TM_PROJECT_PATH,
+    "ideogram": IDEOGRAM_ZIP_PATH,
+}
+
+async def classifier_cache_key(file_unique_id: str, model: str) -> CacheKey:
+    """Ключ кеша классификатора: фото + хеш архива модели + режим TFLite.
+
+    После замены архива ключи меняются, и старые предсказания не отдаются.
+    """
+    path = CLASSIFIER_ARCHIVES[model]
+    version = await asyncio.to_thread(archive_digest, path) if os.path.exists(path) else "missing"
+    return inference_cache.make_key(file_unique_id, model, version=version, runtime=CLASSIFIER_TFLITE or "keras")
+
+models.register("detector", detector.load, "YOLO", warmup=YOLODetector.warmup)
+models.register("tm", load_tm_model, "Teachable Machine", warmup=TeachableMachineRuntime.warmup)
+models.register("ideogram", load_ideogram_model, "Ideogram", warmup=IdeogramModel.warmup)
+models.register("image_gen", ImageGenerator, "Stable Diffusion", warmup=ImageGenerator.warmup)
+warmup_task: "asyncio.Task[Dict[str, Any]] | None" = None
+
+async def require_model(name: str, message: types.Message) -> Any:
+    """Возвращает готовую модель или отвечает, что она ещё прогревается."""
+    instance = models.get(name)
+    if instance is not None:
+        return instance
+    entry = models.entry(name)
+    if entry.state is ModelState.FAILED:
+        await message.answer(f"❌ Модель {entry.title} недоступна. Попробуй позже.")
+        return None
+    if entry.state is ModelState.COLD:
+        models.start_loading(name)
+    await message.answer(f"⏳ Модель {entry.title} прогревается, попробуй через минуту.")
+    return None
 
 async def get_user_info(message: types.Message) -> str:
     """Получает информацию о пользователе для логов"""
@@ -85,6 +140,7 @@ async def set_bot_commands(bot: Bot):
         BotCommand(command="detect", description="🔍 Детекция объектов на фото"),
         BotCommand(command="tm", description="🤖 Teachable Machine"),
         BotCommand(command="ideogram", description="🎨 Ideogram анализ фото"),
+        BotCommand(command="analyze", description="🧩 Все модели на одном фото"),
         BotCommand(command="audio", description="Озвучить текст"),
         BotCommand(command="pass8", description="Пароль 8 символов"),
         BotCommand(command="pass12", description="Пароль 12 символов"),
@@ -155,6 +211,14 @@ def command_caption_filter(command: str, message: Message) -> bool:
 def detect_caption_filter(message: Message) -> bool:
     return command_caption_filter("detect", message)
 
+def detect_text_only(message: Message) -> bool:
+    """/detect text (или /detect текст) — прислать только список объектов без картинки"""
+    args = (message.text or message.caption or "").split()[1:]
+    return any(arg.lower() in ("text", "текст") for arg in args)
+
+def analyze_caption_filter(message: Message) -> bool:
+    return command_caption_filter("analyze", message)
+
 def ideogram_caption_filter(message: types.Message) -> bool:
     """Фильтр для сообщений с командой /ideogram и фото"""
     return (
@@ -166,7 +230,7 @@ def ideogram_caption_filter(message: types.Message) -> bool:
 @dp.message(Command("detect"))
 @dp.message(detect_caption_filter)
 async def detect_command(message: types.Message):
-    """Детекция объектов на фото: /detect"""
+    """Детекция объектов на фото: /detect, только подпись: /detect text"""
     source_message = None
     if message.reply_to_message and message.reply_to_message.photo:
         source_message = message.reply_to_message
@@ -177,29 +241,57 @@ async def detect_command(message: types.Message):
         await message.answer("Ответь на фото командой /detect или прикрепи фото к сообщению с командой.")
         return
     
-    await message.answer("🔍 Анализирую изображение...")
+    status = await message.answer("🔍 Анализирую изображение...")
     
     try:
         if not message.from_user:
             await message.answer("❌ Ошибка: не удалось определить пользователя")
             return
         user_id = message.from_user.id
+        text_only = detect_text_only(message)
 
         photo = source_message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        if file.file_path is None:
-            await message.answer("❌ Ошибка: путь к файлу отсутствует")
+        cache_key = inference_cache.make_key(
+            photo.file_unique_id, f"{detector.model_path}:{detector.backend}", conf=CONFIDENCE_THRESHOLD, iou=IOU_THRESHOLD,
+        )
+        cached = inference_cache.get(cache_key)
+        if cached is not None and text_only:
+            await message.answer(cached['caption'])
             return
-        image_bytes = await bot.download_file(file.file_path)
-        if image_bytes is None:
-            await message.answer("❌ Ошибка: не удалось скачать файл")
+        if cached is not None and (cached.get('file_id') or cached.get('image')):
+            if cached.get('file_id'):
+                await message.answer_photo(cached['file_id'], caption=cached['caption'])
+            else:
+                await message.answer_photo(
+                    types.BufferedInputFile(cached['image'], filename=f"detection_{user_id}.jpg"),
+                    caption=cached['caption'],
+                )
             return
-        if isinstance(image_bytes, (bytes, bytearray)):
-            payload = bytes(image_bytes)
-        else:
-            payload = image_bytes.read()
-        photo_file, caption = await detector.detect_and_format_telegram(payload, user_id)
-        await message.answer_photo(photo_file, caption=caption)
+
+        detector_model = await require_model("detector", message)
+        if detector_model is None:
+            return
+        payload = await fetch_photo(bot, source_message.photo, max_side=YOLO_IMGSZ)
+        async with admission.admit('detection', user_id, queue_status(status, "Детекция")):
+            photo_file, caption = await detector_model.detect_and_format_telegram(
+                payload, user_id, with_image=not text_only,
+            )
+        if photo_file is None:
+            await message.answer(caption)
+            inference_cache.set(cache_key, {'caption': caption, 'image': None, 'file_id': None})
+            return
+        sent = await message.answer_photo(photo_file, caption=caption)
+        inference_cache.set(cache_key, {
+            'caption': caption,
+            'image': photo_file.data if INFERENCE_CACHE_STORE_IMAGES else None,
+            'file_id': sent.photo[-1].file_id if sent.photo else None,
+        })
+    except PhotoDownloadError as e:
+        await message.answer(f"❌ {e}")
+    except AdmissionRejected as e:
+        await message.answer(f"⏳ {e}")
+    except PoolBusyError:
+        await message.answer("⏳ Детектор сейчас перегружен, попробуй через минуту.")
     except Exception as e:
         logger.error(f"Ошибка детекции: {e}")
         await message.answer("❌ Ошибка при анализе изображения")
@@ -218,7 +310,7 @@ async def ideogram_handler(message: types.Message):
         await message.answer("📸 Ответь на фото командой /ideogram или прикрепи фото с подписью /ideogram")
         return
     
-    await message.answer("🎨 Ideogram анализирует...")
+    status = await message.answer("🎨 Ideogram анализирует...")
     
     try:
         if not message.from_user:
@@ -226,42 +318,148 @@ async def ideogram_handler(message: types.Message):
             return
 
         photo = source_message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        if file.file_path is None:
-            await message.answer("❌ Ошибка: путь к файлу отсутствует")
-            return
-        image_bytes = await bot.download_file(file.file_path)
-        if image_bytes is None:
-            await message.answer("❌ Ошибка: не удалось скачать файл")
-            return
-        if isinstance(image_bytes, (bytes, bytearray)):
-            payload: bytes = bytes(image_bytes)
+        cache_key = await classifier_cache_key(photo.file_unique_id, "ideogram")
+        cached = inference_cache.get(cache_key)
+        if cached is not None:
+            class_name, confidence = cached
         else:
-            payload = image_bytes.read()
-
-        class_name, confidence = await ideogram_model.predict(payload)
+            ideogram_model = await require_model("ideogram", message)
+            if ideogram_model is None:
+                return
+            payload = await fetch_photo(bot, source_message.photo, min_side=IDEOGRAM_INPUT_SIZE)
+            async with admission.admit('classification', message.from_user.id, queue_status(status, "Ideogram")):
+                class_name, confidence = await ideogram_model.predict(payload)
+            if confidence > 0:
+                inference_cache.set(cache_key, (class_name, confidence))
         
         await message.answer(
             f"🎯 Результат Ideogram:\n"
             f"📌 Класс: {class_name}\n"
             f"📊 Уверенность: {confidence:.1%}"
         )
+    except PhotoDownloadError as e:
+        await message.answer(f"❌ {e}")
+    except AdmissionRejected as e:
+        await message.answer(f"⏳ {e}")
+    except PoolBusyError:
+        await message.answer("⏳ Классификатор сейчас перегружен, попробуй через минуту.")
     except Exception as e:
         logger.error(f"Ошибка Ideogram: {e}")
         await message.answer("❌ Ошибка при анализе")
 
 async def generate_image(message: types.Message, text: str):
-    """Генерация изображения по тексту"""
+    """Ставит генерацию изображения в очередь; результат пришлёт воркер"""
     user_info = await get_user_info(message)
     log_message(f"Генерация изображения для {user_info}: '{text[:50]}...'")
-    await message.answer("Создаю изображение... Это может занять несколько секунд")
+    if not message.from_user:
+        await message.answer("Ошибка: не удалось определить пользователя")
+        return
+    entry = models.entry("image_gen")
+    if entry.state is ModelState.FAILED:
+        await message.answer(f"❌ Модель {entry.title} недоступна. Попробуй позже.")
+        return
+    if entry.state is ModelState.COLD:
+        models.start_loading("image_gen")
+    prompt = ' '.join(text.split())
+    cached = await cached_images([prompt])
+    if cached is not None and cached[0] is not None:
+        # Повтор уже сгенерированного запроса: отвечаем сразу, без очереди
+        log_message(f"Изображение для {user_info} взято из кеша генераций")
+        await message.answer_photo(
+            types.BufferedInputFile(cached[0], filename=f"image_{message.from_user.id}.png"),
+            caption=f"Изображение по запросу: {prompt}",
+        )
+        return
     try:
-        if not message.from_user:
-            await message.answer("Ошибка: не удалось определить пользователя")
+        status = await message.answer("Ставлю изображение в очередь...")
+        job = DiffusionJob(message.from_user.id, message.chat.id, prompt, status.message_id)
+        position = await diffusion_jobs.submit(job)
+    except AdmissionRejected as e:
+        await message.answer(str(e))
+        return
+    except Exception as e:
+        log_message(f"Ошибка постановки генерации в очередь для {user_info}: {e}", level="ERROR")
+        await message.answer("Произошла ошибка при создании изображения. Попробуй другой запрос или повтори позже.")
+        return
+    log_message(f"Задача генерации {job.id} для {user_info} поставлена в очередь, позиция {position}")
+    # Воркер мог уже взять задачу и сам поправить статус — тогда не трогаем его
+    if job.started_at is None:
+        try:
+            await report_image_position(job, position)
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статус задачи {job.id}: {e}")
+
+async def report_image_position(job: DiffusionJob, position: int):
+    """Правит служебное сообщение задачи: номер в очереди"""
+    if job.status_message_id is None:
+        return
+    if position > 1:
+        text = f"⏳ Генерация изображения: ты #{position} в очереди"
+    else:
+        text = "Создаю изображение... Это может занять несколько секунд"
+    await bot.edit_message_text(text, chat_id=job.chat_id, message_id=job.status_message_id)
+
+async def report_dropped_image_job(job: DiffusionJob):
+    """Сообщает в чат, что задача генерации снята после нескольких неудачных попыток"""
+    await bot.send_message(
+        job.chat_id,
+        f"❌ Не удалось создать изображение по запросу: {job.prompt}\n"
+        f"Генерация несколько раз прерывалась, попробуй другой запрос.",
+    )
+
+async def cached_images(prompts: List[str]) -> Optional[List[Optional[bytes]]]:
+    """Готовые картинки из кеша генераций; None — модель ещё не загружена и ключ не вычислить"""
+    image_gen = models.get("image_gen")
+    if image_gen is None:
+        return None
+    try:
+        return await asyncio.to_thread(image_gen.cached_batch, prompts)
+    except Exception as e:
+        log_message(f"⚠️ Ошибка чтения кеша генераций: {e}", level="WARNING")
+        return None
+
+async def run_image_jobs(jobs: List[DiffusionJob]):
+    """Воркер очереди: генерирует батч изображений одним проходом и раздаёт их по чатам задач.
+    Попадания в кеш генераций отправляются сразу, не дожидаясь модели и пула диффузии"""
+    cached = await cached_images([job.prompt for job in jobs])
+    if cached is not None:
+        hits = [(job, data) for job, data in zip(jobs, cached) if data is not None]
+        if hits:
+            await asyncio.gather(*(deliver_image(job, io.BytesIO(data)) for job, data in hits))
+        jobs = [job for job, data in zip(jobs, cached) if data is None]
+        if not jobs:
             return
-        user_id = message.from_user.id
-        clean_text = ' '.join(text.split())
-        image_bytes = image_gen.auto_generate(clean_text, str(user_id), save_to_disk=True)
+    for job in jobs:
+        try:
+            if job.status_message_id is not None:
+                await bot.edit_message_text(
+                    "Создаю изображение... Это может занять несколько секунд",
+                    chat_id=job.chat_id, message_id=job.status_message_id,
+                )
+        except Exception as e:
+            logger.debug(f"Не удалось обновить статус задачи {job.id}: {e}")
+    try:
+        image_gen = await models.ensure("image_gen")
+        results = await inference_pools.run(
+            'diffusion', image_gen.generate_batch,
+            [job.prompt for job in jobs], [str(job.user_id) for job in jobs],
+            save_to_disk=True, check_cache=cached is None,
+        )
+    except PoolBusyError:
+        for job in jobs:
+            await bot.send_message(job.chat_id, "Сейчас в работе много изображений. Попробуй через минуту.")
+        return
+    except Exception as e:
+        log_message(f"Ошибка генерации батча из {len(jobs)} изображений: {e}", level="ERROR")
+        for job in jobs:
+            await bot.send_message(job.chat_id, "Произошла ошибка при создании изображения. Попробуй другой запрос или повтори позже.")
+        return
+    await asyncio.gather(*(deliver_image(job, image_bytes) for job, image_bytes in zip(jobs, results)))
+
+async def deliver_image(job: DiffusionJob, image_bytes: Any):
+    """Отправляет готовое изображение в чат задачи"""
+    user_info = f"user_id={job.user_id}"
+    try:
         result_type = type(image_bytes).__name__
         buffer_size = None
         if hasattr(image_bytes, 'getbuffer'):
@@ -269,7 +467,7 @@ async def generate_image(message: types.Message, text: str):
                 buffer_size = image_bytes.getbuffer().nbytes
             except Exception:
                 buffer_size = None
-        log_message(f"auto_generate вернул {result_type}, размер буфера: {buffer_size}")
+        log_message(f"generate_batch вернул {result_type}, размер буфера: {buffer_size}")
 
         if image_bytes and buffer_size is not None and buffer_size > 1000:
             log_message(f"Размер изображения: {buffer_size} байт для {user_info}")
@@ -282,24 +480,25 @@ async def generate_image(message: types.Message, text: str):
                     image_data = image_bytes.read()
                 else:
                     raise TypeError("Unexpected image_bytes type")
-                await message.answer_photo(
+                await bot.send_photo(
+                    job.chat_id,
                     types.BufferedInputFile(
                         image_data,
-                        filename=f"image_{user_id}.png"
+                        filename=f"image_{job.user_id}.png"
                     ),
-                    caption=f"Изображение по запросу: {clean_text}"
+                    caption=f"Изображение по запросу: {job.prompt}"
                 )
                 log_message(f"Изображение успешно создано для {user_info}")
             except Exception as send_error:
-                log_message(f"Ошибка отправки изображения для {user_info}: {send_error}")
-                await message.answer("Ошибка при отправке изображения. Попробуйте ещё раз.")
+                log_message(f"Ошибка отправки изображения для {user_info}: {send_error}", level="ERROR")
+                await bot.send_message(job.chat_id, "Ошибка при отправке изображения. Попробуйте ещё раз.")
         else:
-            await message.answer("Не удалось создать изображение. Попробуй другой запрос.")
-            log_message(f"Ошибка: пустое или маленькое изображение для {user_info}, тип {result_type}, размер {buffer_size}")
+            await bot.send_message(job.chat_id, "Не удалось создать изображение. Попробуй другой запрос.")
+            log_message(f"Ошибка: пустое или маленькое изображение для {user_info}, тип {result_type}, размер {buffer_size}", level="ERROR")
     except Exception as e:
         error_msg = f"Ошибка генерации изображения для {user_info}: {e}"
-        log_message(error_msg)
-        await message.answer("Произошла ошибка при создании изображения. Попробуй другой запрос или повтори позже.")
+        log_message(error_msg, level="ERROR")
+        await bot.send_message(job.chat_id, "Произошла ошибка при создании изображения. Попробуй другой запрос или повтори позже.")
 
 async def generate_audio(message: types.Message, text: str):
     """Генерация аудио по тексту"""
@@ -324,11 +523,11 @@ async def generate_audio(message: types.Message, text: str):
             log_message(f"Аудио успешно создано для {user_info}")
         else:
             await message.answer("Не удалось создать аудио")
-            log_message(f"Ошибка: пустой аудиофайл для {user_info}")
+            log_message(f"Ошибка: пустой аудиофайл для {user_info}", level="ERROR")
         os.unlink(temp_path)
     except Exception as e:
         error_msg = f"Ошибка создания аудио для {user_info}: {e}"
-        log_message(error_msg)
+        log_message(error_msg, level="ERROR")
         await message.answer("Произошла ошибка при создании аудио")
 
 @dp.message(Command("tm"))
@@ -339,30 +538,32 @@ async def detect_with_tm_command(message: types.Message):
         await message.answer("📸 Ответь на фото командой /tm")
         return
     
-    await message.answer("🤖 Teachable Machine анализирует изображение...")
+    status = await message.answer("🤖 Teachable Machine анализирует изображение...")
     
     try:
         if not message.from_user:
             await message.answer("❌ Ошибка: не удалось определить пользователя")
             return
 
-        # Скачиваем фото из Telegram
         photo = message.reply_to_message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        if file.file_path is None:
-            await message.answer("❌ Ошибка: путь к файлу отсутствует")
-            return
-        image_bytes = await bot.download_file(file.file_path)
-        if image_bytes is None:
-            await message.answer("❌ Ошибка: не удалось скачать файл")
-            return
-        if isinstance(image_bytes, (bytes, bytearray)):
-            image_payload = bytes(image_bytes)
+        cache_key = await classifier_cache_key(photo.file_unique_id, "teachable_machine")
+        cached = inference_cache.get(cache_key)
+        if cached is not None:
+            class_name, confidence = cached
         else:
-            image_payload = image_bytes.read()
-
-        # Предсказание
-        class_name, confidence = await tm_model.predict_image(image_payload)
+            tm_model = await require_model("tm", message)
+            if tm_model is None:
+                return
+            # Скачиваем самый маленький вариант фото, которого хватает модели,
+            # до входа в очередь: загрузка не должна занимать слот модели
+            image_payload = await fetch_photo(
+                bot, message.reply_to_message.photo, min_side=min(tm_model.input_shape),
+            )
+            async with admission.admit('classification', message.from_user.id, queue_status(status, "Teachable Machine")):
+                # Предсказание
+                class_name, confidence = await tm_model.predict_image(image_payload)
+            if confidence > 0:
+                inference_cache.set(cache_key, (class_name, confidence))
         
         # Отправляем результат
         await message.answer(
@@ -371,10 +572,104 @@ async def detect_with_tm_command(message: types.Message):
             f"📊 Уверенность: {confidence:.1%}"
         )
         
+    except PhotoDownloadError as e:
+        await message.answer(f"❌ {e}")
+    except AdmissionRejected as e:
+        await message.answer(f"⏳ {e}")
+    except PoolBusyError:
+        await message.answer("⏳ Классификатор сейчас перегружен, попробуй через минуту.")
     except Exception as e:
         logger.error(f"Ошибка TM: {e}")
         await message.answer("❌ Ошибка при анализе изображения")
 
+def analysis_model(name: str) -> Any:
+    """Готовая модель или None; холодную модель заодно начинает грузить."""
+    instance = models.get(name)
+    if instance is None and models.entry(name).state is ModelState.COLD:
+        models.start_loading(name)
+    return instance
+
+@dp.message(Command("analyze"))
+@dp.message(analyze_caption_filter)
+async def analyze_command(message: types.Message):
+    """Детектор, Teachable Machine и Ideogram на одном фото: одна загрузка, одно декодирование, один ответ"""
+    source_message = None
+    if message.reply_to_message and message.reply_to_message.photo:
+        source_message = message.reply_to_message
+    elif message.photo:
+        source_message = message
+
+    if source_message is None or not source_message.photo:
+        await message.answer("📸 Ответь на фото командой /analyze или прикрепи фото с подписью /analyze")
+        return
+
+    if not message.from_user:
+        await message.answer("❌ Ошибка: не удалось определить пользователя")
+        return
+    user_id = message.from_user.id
+
+    detector_model = analysis_model("detector")
+    tm_model = analysis_model("tm")
+    ideogram_model = analysis_model("ideogram")
+
+    try:
+        photo = source_message.photo[-1]
+        # Для классификаторов используем те же ключи кеша, что и /tm и /ideogram
+        cache_keys = {
+            "tm": await classifier_cache_key(photo.file_unique_id, "teachable_machine"),
+            "ideogram": await classifier_cache_key(photo.file_unique_id, "ideogram"),
+        }
+        cached: Dict[str, Any] = {}
+        for name, key in cache_keys.items():
+            value = inference_cache.get(key)
+            if value is not None:
+                cached[name] = value
+        if "tm" in cached:
+            tm_model = None
+        if "ideogram" in cached:
+            ideogram_model = None
+
+        results: Dict[str, Any]
+        if detector_model is None and tm_model is None and ideogram_model is None:
+            if not cached:
+                await message.answer("⏳ Модели ещё прогреваются, попробуй через минуту.")
+                return
+            # Запускать нечего: классификаторы уже в кеше, детектор ещё холодный — отвечаем сразу
+            results = {"elapsed": 0.0}
+        else:
+            status = await message.answer("🧩 Анализирую изображение всеми моделями...")
+            # Самая тяжёлая часть /analyze — детектор, поэтому задача стоит в его очереди
+            payload = await fetch_photo(
+                bot, source_message.photo, min_side=IDEOGRAM_INPUT_SIZE, max_side=YOLO_IMGSZ,
+            )
+            async with admission.admit('detection', user_id, queue_status(status, "Анализ")):
+                results = await analyze_photo(payload, detector_model, tm_model, ideogram_model)
+        results.update(cached)
+        for name in ("detector", "tm", "ideogram"):
+            if name not in results:
+                results[name] = "⏳ прогревается"
+        for name, key in cache_keys.items():
+            value = results.get(name)
+            if name not in cached and isinstance(value, tuple) and value[1] > 0:
+                inference_cache.set(key, value)
+
+        caption = format_analysis(results)
+        detection = results.get("detector")
+        if isinstance(detection, tuple) and detection[0]:
+            await message.answer_photo(
+                types.BufferedInputFile(detection[0], filename=f"analyze_{user_id}.jpg"),
+                caption=caption,
+            )
+        else:
+            await message.answer(caption)
+    except PhotoDownloadError as e:
+        await message.answer(f"❌ {e}")
+    except AdmissionRejected as e:
+        await message.answer(f"⏳ {e}")
+    except Exception as e:
+        logger.error(f"Ошибка /analyze: {e}")
+        await message.answer("❌ Ошибка при анализе изображения")
+
 @dp.message(Command("pass8"))
 async def pass8(message: types.Message):
     """Обработчик команды /pass8"""
@@ -436,8 +731,7 @@ async def send_heh(message: types.Message):
 @dp.message(Command("mem"))
 async def send_mem(message: types.Message):
     try:
-        with open(f"./M1L3/images/mem1.jpeg", "rb") as photo:   
-            await message.answer_photo(types.BufferedInputFile(photo.read(), filename="mem1.jpeg"))
+        await answer_photo_file_cached(message, "./M1L3/images/mem1.jpeg")
     except FileNotFoundError:
         await message.answer("Мем не найден 😢")
     except Exception as e:
@@ -456,7 +750,7 @@ async def cmd_anime(message: types.Message):
             await message.answer("Слишком короткий запрос. Минимум 2 символа.")
             return
         await message.answer(f"🔍 Ищу аниме '{query}'...")
-        results = search_anime_advanced(query)
+        results = await search_anime_advanced(query, stop_on_exact=True)
         if not results.get('data'):
             await message.answer(
                 f"🎌 Аниме '{query}' не найдено 😔\n\n"
@@ -482,8 +776,9 @@ async def cmd_anime(message: types.Message):
         
         poster_url = attributes.get('posterImage', {}).get('original')
         if poster_url:
-            await message.answer_photo(
-                photo=poster_url,
+            await answer_photo_url_cached(
+                message,
+                poster_url,
                 caption=response,
                 parse_mode="HTML"
             )
@@ -512,7 +807,7 @@ async def cmd_manga(message: types.Message):
         text = message.text or ""
         parts = text.split(' ', 1)
         query = parts[1] if len(parts) > 1 else ""
-        results = search_kitsu('manga', query)
+        results = await search_kitsu('manga', query)
         if not results['data']:
             await message.answer(f"Манга '{query}' не найдена 😔")
             return
@@ -520,8 +815,9 @@ async def cmd_manga(message: types.Message):
         response = format_manga_result(attributes)
         poster_url = attributes.get('posterImage', {}).get('original')
         if poster_url:
-            await message.answer_photo(
-                photo=poster_url,
+            await answer_photo_url_cached(
+                message,
+                poster_url,
                 caption=response,
                 parse_mode="HTML"
             )
@@ -540,7 +836,7 @@ async def cmd_character(message: types.Message):
         text = message.text or ""
         parts = text.split(' ', 1)
         query = parts[1] if len(parts) > 1 else ""
-        results = search_kitsu('characters', query)
+        results = await search_kitsu('characters', query)
         if not results['data']:
             await message.answer(f"Персонаж '{query}' не найден 😔")
             return
@@ -548,8 +844,9 @@ async def cmd_character(message: types.Message):
         response = format_character_result(attributes)
         image_url = attributes.get('image', {}).get('original')
         if image_url:
-            await message.answer_photo(
-                photo=image_url,
+            await answer_photo_url_cached(
+                message,
+                image_url,
                 caption=response,
                 parse_mode="HTML"
             )
@@ -573,7 +870,7 @@ async def cmd_person(message: types.Message):
             await message.answer("Пожалуйста, укажите имя для поиска")
             return
         await message.answer(f"🔍 Ищу информацию о '{query}'...")
-        results = search_kitsu('people', query)
+        results = await search_kitsu('people', query)
         if not results.get('data'):
             await message.answer(
                 f"Человек '{query}' не найден 😔\n\n"
@@ -588,8 +885,9 @@ async def cmd_person(message: types.Message):
         response = format_person_result(attributes)
         image_url = attributes.get('image', {}).get('original')
         if image_url:
-            await message.answer_photo(
-                photo=image_url,
+            await answer_photo_url_cached(
+                message,
+                image_url,
                 caption=response,
                 parse_mode="HTML"
             )
@@ -613,13 +911,14 @@ async def cmd_dog(message: types.Message):
     """Random dog image: /dog"""
     try:
         await message.answer("🐕 Getting cute dog...")
-        image_url = get_dog_image()
+        image_url = await get_dog_image()
         if not image_url:
             await message.answer("❌ Failed to get dog image. Try again later.")
             return
         if any(ext in image_url.lower() for ext in ['.mp4', '.webm', '.gif']):
             await message.answer_video(image_url, caption="🐕 Here's your random dog!")
         else:
+            # URL случайный и почти не повторяется: кешировать его file_id бесполезно
             await message.answer_photo(image_url, caption="🐕 Here's your random dog!")
 
     except Exception as e:
@@ -631,7 +930,7 @@ async def cmd_fox(message: types.Message):
     """Random fox image: /fox"""
     try:
         await message.answer("🦊 Getting cute fox...")
-        image_url = get_fox_image()
+        image_url = await get_fox_image()
         if not image_url:
             await message.answer("❌ Failed to get fox image. Try again later.")
             return
@@ -639,12 +938,9 @@ async def cmd_fox(message: types.Message):
             await message.answer_photo(image_url, caption="🦊 Here's your random fox!")
         except Exception:
             try:
-                response = requests.get(image_url, timeout=10)
-                if response.status_code == 200:
-                    photo = types.BufferedInputFile(response.content, filename="fox.jpg")
-                    await message.answer_photo(photo, caption="🦊 Here's your random fox!")
-                else:
-                    await message.answer("❌ Failed to load fox image.")
+                content = await http_client.get_bytes(image_url, timeout=10)
+                photo = types.BufferedInputFile(content, filename="fox.jpg")
+                await message.answer_photo(photo, caption="🦊 Here's your random fox!")
             except Exception:
                 await message.answer("❌ Could not send fox image.")
     except Exception as e:
@@ -660,10 +956,10 @@ async def cmd_pokemon(message: types.Message):
         query = parts[1].strip() if len(parts) > 1 else "random"
         if query.lower() == "random":
             await message.answer("🎲 Getting random Pokémon...")
-            pokemon_data = get_random_pokemon()
+            pokemon_data = await get_random_pokemon()
         else:
             await message.answer(f"🔍 Searching Pokémon '{query}'...")
-            pokemon_data = get_pokemon_info(query)
+            pokemon_data = await get_pokemon_info(query)
         if not pokemon_data:
             await message.answer(
                 f"❌ Pokémon '{query}' not found!\n\n"
@@ -680,8 +976,9 @@ async def cmd_pokemon(message: types.Message):
         response = format_pokemon_result(pokemon_data)
         image_url = pokemon_data['sprites']['other']['official-artwork']['front_default']
         if image_url:
-            await message.answer_photo(
-                photo=image_url,
+            await answer_photo_url_cached(
+                message,
+                image_url,
                 caption=response,
                 parse_mode="HTML"
             )
@@ -707,15 +1004,16 @@ async def cmd_pokedex(message: types.Message):
     """Random Pokemon: /pokedex"""
     try:
         await message.answer("📚 Opening Pokédex...")
-        pokemon_data = get_random_pokemon()
+        pokemon_data = await get_random_pokemon()
         if not pokemon_data:
             await message.answer("❌ Failed to get Pokémon data. Try again later.")
             return
         response = format_pokemon_result(pokemon_data)
         image_url = pokemon_data['sprites']['other']['official-artwork']['front_default']
         if image_url:
-            await message.answer_photo(
-                photo=image_url,
+            await answer_photo_url_cached(
+                message,
+                image_url,
                 caption=response,
                 parse_mode="HTML"
             )
@@ -910,13 +1208,45 @@ async def stats_handler(message: types.Message):
     hours, remainder = divmod(uptime.total_seconds(), 3600)
     minutes, seconds = divmod(remainder, 60)
     success_rate = (stats['successful_gifs'] / stats['total_requests'] * 100) if stats['total_requests'] > 0 else 0
+    cache_stats = kitsu_cache.get_stats()
+    batch_stats = detector.get_batch_stats()
+    queues = ', '.join(
+        f"{name}={pool['pending']}/{pool['capacity']}" for name, pool in inference_pools.get_stats().items()
+    )
+    admitted = ', '.join(
+        f"{name}={queue['running']}/{queue['limit']}+{queue['waiting']}, отказов {queue['rejected']}, "
+        f"ожидание {queue['avg_wait']:.1f} с"
+        for name, queue in admission.get_stats().items()
+    )
+    jobs = diffusion_jobs.get_stats()
+    embeds = prompt_embeddings.get_stats()
+    images = await asyncio.to_thread(generated_images.get_stats)
+    logs = log_sink.get_stats()
+    inference = inference_cache.get_stats()
     await message.answer(
         f"Статистика:\n"
         f"Время работы: {int(hours)}ч {int(minutes)}м {int(seconds)}с\n"
         f"Запросов: {stats['total_requests']}\n"
         f"Успешных GIF: {stats['successful_gifs']}\n"
         f"Ошибок: {stats['failed_gifs']}\n"
-        f"Эффективность: {success_rate:.1f}%"
+        f"Эффективность: {success_rate:.1f}%\n"
+        f"Кеш Kitsu: {cache_stats['hits'] + cache_stats['disk_hits']} попаданий, "
+        f"{cache_stats['misses']} промахов\n"
+        f"YOLO батчи: {batch_stats['batches']}, средний размер {batch_stats['avg_batch_size']:.1f}, "
+        f"макс. {batch_stats['max_batch_size']}, ожидание {batch_stats['avg_wait'] * 1000:.0f} мс\n"
+        f"Очереди: {queues}\n"
+        f"Допуск: {admitted}\n"
+        f"Генерация: в очереди {jobs['depth']}, в работе {jobs['running']}/{jobs['workers']}, "
+        f"ожидание {jobs['avg_wait']:.0f} с, генерация {jobs['avg_run']:.0f} с, "
+        f"батч {jobs['avg_batch_size']:.1f} (макс. {jobs['max_batch_size']}), снято после сбоев {jobs['dropped']}\n"
+        f"Кеш инференса: {inference['hits']} попаданий, {inference['misses']} промахов, "
+        f"{inference['size']} записей, {inference['bytes'] / 2**20:.1f} МБ\n"
+        f"Кеш эмбеддингов: {embeds['hits']} попаданий, {embeds['misses']} промахов, {embeds['size_mb']} МБ\n"
+        f"Кеш изображений: {images['hits']} попаданий, {images['misses']} промахов, "
+        f"{images['entries']} файлов, {images['size_mb']} МБ\n"
+        f"Лог: {logs['written']} строк, {logs['batches']} пачек, запись {logs['write_time_avg'] * 1000:.1f} мс "
+        f"(макс. {logs['write_time_max'] * 1000:.1f} мс), в очереди {logs['queued']}, потеряно {logs['dropped']}\n"
+        f"Модели: {', '.join(f'{name}={state}' for name, state in models.status().items())}"
     )
 
 @dp.message(Command("help"))
@@ -929,7 +1259,9 @@ async def help_handler(message: types.Message):
         "</code>/gif - Создать GIF из фото\n"
         "</code>/image - Создать изображение\n"
         "</code>/detect - 🔍 Детекция объектов на фото\n"
+        "</code>/detect text - 🔍 Только список объектов, без картинки\n"
         "</code>/tm - 🤖 Teachable Machine — распознавание изображений\n"
+        "</code>/analyze - 🧩 Детектор, TM и Ideogram на одном фото одним ответом\n"
         "</code>/ideogram - 🎨 Ideogram анализ фото\n"
         "</code>/audio - Озвучить текст\n"
         "</code>/pass8 - Пароль 8 символов\n"
@@ -1015,19 +1347,32 @@ async def stop_bot():
     await bot.session.close()
     
 async def stop_image_gen():
-    if image_gen.pipeline:
+    image_gen = models.get("image_gen")
+    if image_gen is not None and image_gen.pipeline:
         del image_gen.pipeline
         torch.cuda.empty_cache()
     
+async def stop_http_client():
+    await http_client.close()
+
+async def stop_models():
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    await diffusion_jobs.shutdown()
+    models.shutdown()
+    inference_pools.shutdown()
+
 async def stop_dispatcher():
     await dp.stop_polling()
 
-async def shutdown(bot: Bot, dp: Dispatcher, gif_creator: GIF, image_gen: ImageGenerator):
+async def shutdown(bot: Bot, dp: Dispatcher, gif_creator: GIF):
     print("\nЗавершение работы бота...")
     await asyncio.gather(
         stop_gif(),
         stop_bot(),
         stop_image_gen(),
+        stop_http_client(),
+        stop_models(),
         stop_dispatcher(),
         return_exceptions=True
     )
@@ -1042,6 +1387,20 @@ async def shutdown(bot: Bot, dp: Dispatcher, gif_creator: GIF, image_gen: ImageG
     print(f"   Ошибок: {gif_creator.session_stats['failed_gifs']}")
     print("Бот завершил работу")
 
+@dp.startup()
+async def warmup_models():
+    """Параллельный прогрев моделей в фоне после старта поллинга"""
+    global warmup_task
+    log_message("Фоновый прогрев моделей...")
+    warmup_task = asyncio.create_task(models.warmup_all())
+
+@dp.startup()
+async def start_diffusion_workers():
+    """Воркеры очереди генерации; задачи, не выполненные до перезапуска, подхватываются из базы.
+    Заодно чистим папку сгенерированных изображений по лимитам кеша"""
+    await asyncio.to_thread(generated_images.prune)
+    await diffusion_jobs.start(run_image_jobs, report_image_position, report_dropped_image_job)
+
 async def main():
     os.environ['HF_HOME'] = 'D:/.cache/huggingface'
     log_message("Бот запускается...")
@@ -1054,19 +1413,15 @@ async def main():
         start_polling_method = getattr(dp, "start_polling")
         poll_task: Coroutine[Any, Any, None] = cast(Coroutine[Any, Any, None], start_polling_method(bot))
         await poll_task
-        if ideogram_model.load():
-            log_message("Ideogram модель загружена")
-        else:
-            log_message("⚠️ Ideogram модель не загружена")
     except (KeyboardInterrupt, asyncio.CancelledError):
         log_message("Бот остановлен по прерыванию")
         print("\nБот остановлен")
     except Exception as e:
-        log_message(f"Бот упал с ошибкой: {e}")
+        log_message(f"Бот упал с ошибкой: {e}", level="ERROR")
         print(f"Бот упал с ошибкой: {e}")
     finally:
         log_message("Бот выключается...")
-        await shutdown(bot, dp, gif_creator, image_gen)
+        await shutdown(bot, dp, gif_creator)
         log_message("Выключение бота завершено")
 
 if __name__ == "__main__":
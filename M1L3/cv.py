@@ -2,13 +2,18 @@
 Модуль детекции объектов YOLOv10m с интеграцией aiogram.
 Использует CPU/CUDA в зависимости от доступности.
 """
-from typing import Any, List, Optional, Tuple
+from typing import Any, Hashable, List, Optional, Tuple, Union
 from aiogram.types import BufferedInputFile
+from micro_batcher import MicroBatcher
+from inference_pool import inference_pools
+from yolo_backends import BACKENDS, YOLO_IMGSZ, OnnxYOLO, export_artifact
+from photo_ingest import decode_photo
 from ultralytics import YOLO
-from PIL import Image
+from log_sink import log_message
+from PIL import Image, ImageDraw
+import threading
 import logging
 import torch
-import time
 import io
 import os
 
@@ -18,77 +23,243 @@ logger = logging.getLogger(__name__)
 CONFIDENCE_THRESHOLD: float = 0.5
 IOU_THRESHOLD: float = 0.45
 
-def log_message(text: str) -> None:
-    timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-    message = f"{timestamp} - {text}"
-    print(message)
-    with open('bot.log', 'a', encoding='utf-8') as f:
-        f.write(message + '\n')
+# Микробатчинг: одновременные /detect с одинаковыми параметрами идут одним predict
+YOLO_BATCHING: bool = os.getenv("YOLO_BATCHING", "1") == "1"
+YOLO_BATCH_WINDOW_MS: float = float(os.getenv("YOLO_BATCH_WINDOW_MS", "20"))
+YOLO_MAX_BATCH: int = int(os.getenv("YOLO_MAX_BATCH", "8"))
+
+# Рендер аннотаций: light — рамки на уменьшенной копии, ultralytics — result.plot() в полном размере
+DETECT_ANNOTATOR: str = os.getenv("DETECT_ANNOTATOR", "light")
+DETECT_MAX_SIDE: int = int(os.getenv("DETECT_MAX_SIDE", "1024"))
+DETECT_JPEG_QUALITY: int = int(os.getenv("DETECT_JPEG_QUALITY", "80"))
+DETECT_JPEG_OPTIMIZE: bool = os.getenv("DETECT_JPEG_OPTIMIZE", "0") == "1"
+
+# torch — ultralytics PyTorch, onnx — собственная сессия ONNX Runtime, openvino — экспорт OpenVINO
+YOLO_BACKEND: str = os.getenv("YOLO_BACKEND", "torch")
+
+DetectionResult = Tuple[bytes, List[dict[str, Any]]]
+# Байты фото или уже декодированный кадр (его передаёт /analyze, чтобы не декодировать повторно)
+ImageSource = Union[bytes, Image.Image]
+
+_PALETTE: Tuple[Tuple[int, int, int], ...] = (
+    (255, 56, 56), (255, 157, 151), (255, 112, 31), (255, 178, 29), (207, 210, 49),
+    (72, 249, 10), (146, 204, 23), (61, 219, 134), (26, 147, 52), (0, 212, 187),
+    (44, 153, 168), (0, 194, 255), (52, 69, 147), (100, 115, 255), (0, 24, 236),
+    (132, 56, 255), (82, 0, 133), (203, 56, 255), (255, 149, 200), (255, 55, 199),
+)
+
+
+def render_annotations(
+    image: Image.Image,
+    detections: List[dict[str, Any]],
+    max_side: int = DETECT_MAX_SIDE,
+    quality: int = DETECT_JPEG_QUALITY,
+    optimize: bool = DETECT_JPEG_OPTIMIZE,
+) -> bytes:
+    """Рисует рамки на уменьшенной копии и кодирует её в JPEG.
+    
+    Дешевле result.plot(): нет перевода в BGR и обратно, а рисование
+    и кодирование идут по картинке не больше max_side по длинной стороне.
+    """
+    scale = min(1.0, max_side / max(image.size))
+    if scale < 1.0:
+        canvas = image.resize(
+            (max(1, round(image.width * scale)), max(1, round(image.height * scale))),
+            Image.Resampling.BILINEAR,
+        )
+    else:
+        canvas = image.copy()
+    draw = ImageDraw.Draw(canvas)
+    line = max(2, round(max(canvas.size) / 400))
+    for det in detections:
+        x1, y1, x2, y2 = (coord * scale for coord in det["bbox"])
+        color = _PALETTE[det["class_id"] % len(_PALETTE)]
+        draw.rectangle((x1, y1, x2, y2), outline=color, width=line)
+        label = f"{det['class']} {det['confidence']:.2f}"
+        left, top, right, bottom = draw.textbbox((x1, y1), label)
+        label_top = max(0.0, y1 - (bottom - top) - 2 * line)
+        draw.rectangle((x1, label_top, x1 + (right - left) + 2 * line, label_top + (bottom - top) + 2 * line), fill=color)
+        draw.text((x1 + line, label_top + line - top + y1), label, fill=(255, 255, 255))
+    output_buffer = io.BytesIO()
+    canvas.save(output_buffer, format="JPEG", quality=quality, optimize=optimize)
+    return output_buffer.getvalue()
+
+
+def format_detections(detections: List[dict[str, Any]], limit: int = 10) -> str:
+    """Подпись со списком найденных объектов."""
+    if not detections:
+        return "🔍 Объекты не обнаружены"
+    lines = [f"🔍 Обнаружено {len(detections)} объектов:"]
+    for det in detections[:limit]:
+        conf_percent = det["confidence"] * 100
+        lines.append(
+            f"• {det['class']}: {conf_percent:.1f}% "
+            f"({det['bbox'][0]:.0f},{det['bbox'][1]:.0f})"
+        )
+    return "\n".join(lines)
 
 class YOLODetector:
     """Детектор объектов на основе YOLOv10m."""
     
-    def __init__(self, model_path: str = "yolov10m.pt"):
+    def __init__(self, model_path: str = "yolov10m.pt", autoload: bool = True, backend: str = YOLO_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд YOLO: {backend}")
         self.model_path = model_path
+        self.backend = backend
         self.model: Optional[Any] = None
-        self._device: str = "cuda" if torch.cuda.is_available() else "cpu"
-        self._load_model()
+        self._device: str = "cuda" if backend == "torch" and torch.cuda.is_available() else "cpu"
+        self._predict_lock = threading.Lock()
+        self._batcher: MicroBatcher[Tuple[ImageSource, bool], DetectionResult] = MicroBatcher(
+            self._run_batch,
+            window=YOLO_BATCH_WINDOW_MS / 1000,
+            max_batch=YOLO_MAX_BATCH,
+            name="yolo",
+        )
+        if autoload:
+            self._load_model()
+    
+    def load(self) -> "YOLODetector":
+        """Загружает веса, если они ещё не загружены."""
+        if self.model is None:
+            self._load_model()
+        return self
     
     def _load_model(self) -> None:
         try:
-            if os.path.exists(self.model_path):
-                self.model = YOLO(self.model_path)
-            else:
-                self.model = YOLO("yolov10m.pt")
+            pt_path = self.model_path if os.path.exists(self.model_path) else "yolov10m.pt"
+            
+            if self.backend != "torch":
+                try:
+                    if not os.path.exists(pt_path):
+                        # Весов ещё нет: их скачивает ultralytics, после чего экспорт всё равно нужен
+                        pt_path = str(YOLO(pt_path).ckpt_path)
+                    # PyTorch-модель не строится: готовый артефакт ищется по хешу .pt
+                    self.model = self._load_exported(pt_path)
+                    log_message(f"YOLO загружена через {self.backend}")
+                    return
+                except Exception as e:
+                    log_message(f"⚠️ Бэкенд {self.backend} недоступен ({e}), используется PyTorch", level="WARNING")
+                    self.backend = "torch"
             
+            self.model = YOLO(pt_path)
             self.model.to(self._device)
             log_message(f"YOLO загружена на {self._device}")
         except Exception as e:
-            log_message(f"Ошибка загрузки модели: {e}")
+            log_message(f"Ошибка загрузки модели: {e}", level="ERROR")
             raise
     
+    def _load_exported(self, pt_path: str) -> Any:
+        """Экспортированная модель; экспорт выполняется один раз на хеш весов."""
+        artifact = export_artifact(pt_path, self.backend)
+        if self.backend == "onnx":
+            return OnnxYOLO(artifact)
+        return YOLO(artifact, task="detect")
+    
+    @staticmethod
+    def _decode(source: ImageSource) -> Image.Image:
+        if isinstance(source, Image.Image):
+            return source.convert("RGB") if source.mode != "RGB" else source
+        return decode_photo(source, (YOLO_IMGSZ, YOLO_IMGSZ))
+    
+    @staticmethod
+    def _postprocess(result: Any, image: Image.Image, annotate: bool = True) -> DetectionResult:
+        """Список детекций и, если annotate, JPEG с рамками (иначе пустые байты)."""
+        detections: List[dict[str, Any]] = []
+        if getattr(result, "boxes", None) is not None:
+            for box in result.boxes:
+                x1, y1, x2, y2 = map(float, box.xyxy[0].tolist())
+                confidence = float(box.conf[0])
+                class_id = int(box.cls[0])
+                class_name = result.names.get(class_id, "unknown")
+                
+                detections.append({
+                    "bbox": (x1, y1, x2, y2),
+                    "confidence": confidence,
+                    "class": class_name,
+                    "class_id": class_id,
+                })
+        
+        if not annotate:
+            return b"", detections
+        if DETECT_ANNOTATOR == "light":
+            return render_annotations(image, detections), detections
+        
+        annotated_plot = result.plot()
+        annotated_image = Image.fromarray(annotated_plot[..., ::-1])
+        output_buffer = io.BytesIO()
+        annotated_image.save(output_buffer, format="JPEG", quality=DETECT_JPEG_QUALITY, optimize=DETECT_JPEG_OPTIMIZE)
+        return output_buffer.getvalue(), detections
+    
+    def _run_batch(self, key: Hashable, items: List[Tuple[ImageSource, bool]]) -> List[Any]:
+        """Один predict на весь батч. Ошибка декодирования достаётся только своему запросу.
+        
+        Флаг аннотации лежит в самом запросе, а не в ключе: запросы с картинкой
+        и без неё попадают в один батч.
+        """
+        conf, iou, classes = key
+        outputs: List[Any] = [None] * len(items)
+        images: List[Image.Image] = []
+        positions: List[int] = []
+        for index, (source, _) in enumerate(items):
+            try:
+                images.append(self._decode(source))
+                positions.append(index)
+            except Exception as e:
+                outputs[index] = ValueError(f"Не удалось прочитать изображение: {e}")
+        if not images:
+            return outputs
+        
+        assert self.model is not None
+        with self._predict_lock:
+            results: Any = self.model.predict(
+                source=images,
+                conf=conf,
+                iou=iou,
+                classes=list(classes) if classes is not None else None,
+                device=self._device,
+                verbose=False,
+            )
+        for index, image, result in zip(positions, images, results):
+            try:
+                outputs[index] = self._postprocess(result, image, annotate=items[index][1])
+            except Exception as e:
+                outputs[index] = e
+        if len(items) > 1:
+            logger.info(f"YOLO батч: {len(images)} изображений за один проход")
+        return outputs
+    
     async def detect_objects(
         self, 
-        image_bytes: bytes,
+        image_bytes: ImageSource,
         classes: Optional[List[int]] = None,
         conf: float = CONFIDENCE_THRESHOLD,
         iou: float = IOU_THRESHOLD,
-    ) -> Tuple[bytes, List[dict[str, Any]]]:
-        """Детектирует объекты на изображении."""
+        annotate: bool = True,
+    ) -> DetectionResult:
+        """Детектирует объекты на изображении (байты или готовый PIL-кадр).
+        
+        При annotate=False картинка с рамками не рисуется и вместо неё
+        возвращаются пустые байты. Запросы с одинаковыми conf/iou/classes, пришедшие в пределах
+        YOLO_BATCH_WINDOW_MS, объединяются в один батч.
+        """
+        pool = inference_pools['detection']
+        if self.model is None:
+            await pool.run(self.load)
         if self.model is None:
             raise RuntimeError("Модель не загружена")
         
+        key = (conf, iou, tuple(classes) if classes else None)
         try:
-            image = Image.open(io.BytesIO(image_bytes))
-            results: Any = self.model.predict(
-                source=image,
-                conf=conf,
-                iou=iou,
-                classes=classes,
-                device=self._device,
-                verbose=False,
-            )
-            detections: List[dict[str, Any]] = []
-            result: Any = results[0]
-            if getattr(result, "boxes", None) is not None:
-                for box in result.boxes:
-                    x1, y1, x2, y2 = map(float, box.xyxy[0].tolist())
-                    confidence = float(box.conf[0])
-                    class_id = int(box.cls[0])
-                    class_name = result.names.get(class_id, "unknown")
-                    
-                    detections.append({
-                        "bbox": (x1, y1, x2, y2),
-                        "confidence": confidence,
-                        "class": class_name,
-                        "class_id": class_id,
-                    })
-            
-            annotated_plot = result.plot()
-            annotated_image = Image.fromarray(annotated_plot[..., ::-1])
-            output_buffer = io.BytesIO()
-            annotated_image.save(output_buffer, format="JPEG", quality=85)
-            annotated_bytes = output_buffer.getvalue()
+            if YOLO_BATCHING:
+                with pool.slot():
+                    # пул пересоздаётся после shutdown, поэтому executor берём при каждом вызове
+                    self._batcher.executor = pool.executor
+                    annotated_bytes, detections = await self._batcher.submit(key, (image_bytes, annotate))
+            else:
+                output = (await pool.run(self._run_batch, key, [(image_bytes, annotate)]))[0]
+                if isinstance(output, BaseException):
+                    raise output
+                annotated_bytes, detections = output
             
             logger.info(f"Обнаружено {len(detections)} объектов")
             return annotated_bytes, detections
@@ -102,23 +273,19 @@ class YOLODetector:
         image_bytes: bytes,
         user_id: int,
         classes: Optional[List[int]] = None,
-    ) -> Tuple[BufferedInputFile, str]:
-        """Детектирует объекты и возвращает результат для Telegram."""
+        with_image: bool = True,
+    ) -> Tuple[Optional[BufferedInputFile], str]:
+        """Детектирует объекты и возвращает результат для Telegram.
+        
+        При with_image=False возвращает только подпись (фото — None).
+        """
         annotated_bytes, detections = await self.detect_objects(
-            image_bytes, classes=classes,
+            image_bytes, classes=classes, annotate=with_image,
         )
         
-        if detections:
-            lines = [f"🔍 Обнаружено {len(detections)} объектов:"]
-            for det in detections[:10]:
-                conf_percent = det["confidence"] * 100
-                lines.append(
-                    f"• {det['class']}: {conf_percent:.1f}% "
-                    f"({det['bbox'][0]:.0f},{det['bbox'][1]:.0f})"
-                )
-            caption = "\n".join(lines)
-        else:
-            caption = "🔍 Объекты не обнаружены"
+        caption = format_detections(detections)
+        if not with_image:
+            return None, caption
         
         photo = BufferedInputFile(
             annotated_bytes,
@@ -127,6 +294,16 @@ class YOLODetector:
         
         return photo, caption
     
+    def warmup(self) -> None:
+        """Пробный инференс на пустом кадре: инициализирует граф и буферы."""
+        self.load()
+        assert self.model is not None
+        self.model.predict(source=Image.new("RGB", (640, 640)), device=self._device, verbose=False)
+    
+    def get_batch_stats(self) -> dict[str, Any]:
+        """Статистика микробатчинга: размеры батчей и ожидание в очереди."""
+        return self._batcher.get_stats()
+    
     @property
     def is_loaded(self) -> bool:
         """Проверяет, загружена ли модель."""
@@ -137,4 +314,4 @@ class YOLODetector:
         """Возвращает устройство вычислений."""
         return self._device
 
-detector = YOLODetector()
\ No newline at end of file
+detector = YOLODetector(autoload=False)
\ No newline at end of file
@@ -1,10 +1,10 @@
 from typing import Optional, Tuple, Any, Dict
 from h5py._hl.dataset import Dataset
 from h5py._hl.files import File
+from log_sink import log_message
 from datetime import datetime
 import pandas as pd
 import numpy as np
-import time
 import json
 import h5py
 import os
@@ -48,11 +48,8 @@ class ModelWeightsProcessor:
         f.attrs['input_shape'] = json.dumps([100])
         f.attrs['output_classes'] = 10
     
-    def log_message(self, text: str) -> None: 
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - {text}"
-        with open('bot.log', 'a', encoding='utf-8') as f:
-            f.write(message + '\n')
+    def log_message(self, text: str, level: str = "INFO") -> None: 
+        log_message(text, level=level, echo=False)
             
     def get_weights(self, layer_name: str) -> Tuple[Optional[np.ndarray], Optional[np.ndarray]]:
         """Получает веса указанного слоя"""
@@ -128,12 +125,8 @@ class DataProcessor:
         """Создает папку для данных если её нет"""
         os.makedirs(os.path.dirname(self.hdf5_path), exist_ok=True)
     
-    def log_message(self, text: str) -> None: 
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - {text}"
-        print(message)
-        with open('bot.log', 'a', encoding='utf-8') as f:
-            f.write(message + '\n')
+    def log_message(self, text: str, level: str = "INFO") -> None: 
+        log_message(text, level=level)
             
     def save_user_data(self, user_id: int, action_type: str, data: Optional[str] = None) -> bool:
         """Сохраняет данные пользователя в HDF5"""
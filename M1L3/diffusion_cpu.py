@@ -0,0 +1,262 @@
+"""CPU-режим диффузии: bfloat16, channels_last, torch.compile, потоки и экспорт.
+
+На CPU-хостах пайплайн по умолчанию работает во float32 без какой-либо
+настройки. Здесь собраны оптимизации, которые включаются конфигом:
+
+* DIFFUSION_BF16 — autocast в bfloat16 (auto — если CPU умеет bf16: AVX512-BF16/AMX);
+* DIFFUSION_CHANNELS_LAST — формат памяти channels_last для UNet и VAE;
+* DIFFUSION_COMPILE — torch.compile для "unet" и/или "vae" (через запятую);
+* DIFFUSION_COMPILE_MODE — режим torch.compile; reduce-overhead строит CUDA-графы
+  и на CPU ничего не даёт, поэтому по умолчанию default;
+* DIFFUSION_THREADS / DIFFUSION_INTEROP_THREADS — потоки intra-op и inter-op;
+* DIFFUSION_BACKEND — torch, onnx (ONNX Runtime) или openvino через optimum.
+
+При DIFFUSION_BENCHMARK=1 секунды на шаг замеряются до и после оптимизаций
+и пишутся в DIFFUSION_REPORT_PATH. То же вручную:
+    python diffusion_cpu.py
+"""
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Tuple
+from contextlib import nullcontext
+from log_sink import log_message
+import json
+import time
+import os
+
+DIFFUSION_CPU_MODE: bool = os.getenv("DIFFUSION_CPU_MODE", "1") == "1"
+DIFFUSION_BF16: str = os.getenv("DIFFUSION_BF16", "auto")
+DIFFUSION_CHANNELS_LAST: bool = os.getenv("DIFFUSION_CHANNELS_LAST", "1") == "1"
+DIFFUSION_COMPILE: str = os.getenv("DIFFUSION_COMPILE", "")
+DIFFUSION_COMPILE_MODE: str = os.getenv("DIFFUSION_COMPILE_MODE", "default")
+DIFFUSION_THREADS: int = int(os.getenv("DIFFUSION_THREADS", "0"))
+DIFFUSION_INTEROP_THREADS: int = int(os.getenv("DIFFUSION_INTEROP_THREADS", "0"))
+DIFFUSION_BACKEND: str = os.getenv("DIFFUSION_BACKEND", "torch")
+DIFFUSION_EXPORT_DIR: str = os.getenv("DIFFUSION_EXPORT_DIR", "data/diffusion_export")
+DIFFUSION_BENCHMARK: bool = os.getenv("DIFFUSION_BENCHMARK", "0") == "1"
+DIFFUSION_REPORT_PATH: str = os.getenv("DIFFUSION_REPORT_PATH", "data/diffusion_cpu_report.json")
+
+BACKENDS = ("torch", "onnx", "openvino")
+
+
+def bf16_supported() -> bool:
+    """Есть ли у CPU быстрый bfloat16 (AVX512-BF16 или AMX)."""
+    import torch
+
+    checker = getattr(getattr(torch.ops, "mkldnn", None), "_is_mkldnn_bf16_supported", None)
+    if checker is not None:
+        try:
+            return bool(checker())
+        except Exception:
+            pass
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def measure_seconds_per_step(
+    pipeline: Any,
+    height: int = 512,
+    width: int = 512,
+    guidance_scale: float = 7.0,
+    steps: Tuple[int, int] = (2, 6),
+    context: Optional[Callable[[], ContextManager[Any]]] = None,
+) -> float:
+    """Секунды на шаг денойзинга: разница двух прогонов с разным числом шагов,
+    так что текстовый энкодер и декодирование VAE в замер не попадают."""
+    import torch
+
+    def run(num_steps: int) -> float:
+        started = time.perf_counter()
+        with torch.no_grad(), (context() if context is not None else nullcontext()):
+            pipeline(
+                prompt="benchmark",
+                output_type="pil",
+                height=height,
+                width=width,
+                num_inference_steps=num_steps,
+                guidance_scale=guidance_scale,
+            )
+        return time.perf_counter() - started
+
+    run(1)  # прогрев: граф, буферы, компиляция
+    short, long = steps
+    return (run(long) - run(short)) / (long - short)
+
+
+def exported_latents(pipeline: Any, seeds: List[int], height: int, width: int) -> Any:
+    """Начальный шум для пайплайнов optimum: у каждого промпта свой np.random.RandomState(seed).
+
+    Пайплайны ONNX Runtime и OpenVINO принимают один генератор numpy на весь
+    батч, и шум картинки зависел бы от её места в батче. Готовые latents дают
+    тот же шум, что generator=RandomState(seed) у одиночного запроса.
+    """
+    import numpy as np
+
+    config = getattr(getattr(pipeline, "unet", None), "config", None)
+    channels = config.get("in_channels", 4) if isinstance(config, dict) else getattr(config, "in_channels", 4)
+    scale = int(getattr(pipeline, "vae_scale_factor", 8))
+    shape = (int(channels), height // scale, width // scale)
+    return np.stack([np.random.RandomState(seed).randn(*shape) for seed in seeds]).astype(np.float32)
+
+
+class CpuDiffusionRuntime:
+    """Выбранные в конфиге CPU-оптимизации и их применение к пайплайну."""
+
+    def __init__(
+        self,
+        enabled: bool = DIFFUSION_CPU_MODE,
+        bf16: str = DIFFUSION_BF16,
+        channels_last: bool = DIFFUSION_CHANNELS_LAST,
+        compile_targets: str = DIFFUSION_COMPILE,
+        compile_mode: str = DIFFUSION_COMPILE_MODE,
+        backend: str = DIFFUSION_BACKEND,
+        benchmark: bool = DIFFUSION_BENCHMARK,
+    ):
+        if backend not in BACKENDS:
+            raise ValueError(f"Неизвестный бэкенд диффузии: {backend}")
+        self.enabled = enabled
+        self.bf16_mode = bf16
+        self.channels_last = channels_last
+        self.compile_targets = [target.strip() for target in compile_targets.split(",") if target.strip()]
+        self.compile_mode = compile_mode
+        self.backend = backend
+        self.benchmark = benchmark
+        self.bf16 = False
+        self.applied: List[str] = []
+
+    @property
+    def tag(self) -> str:
+        """Метка режима для ключей кеша: bf16 и экспорт дают немного другие пиксели."""
+        return f"{self.backend}{'-bf16' if self.bf16 else ''}"
+
+    def configure_threads(self) -> None:
+        """Потоки intra-op и inter-op; inter-op можно задать только до первой параллельной работы."""
+        if not self.enabled:
+            return
+        import torch
+
+        if DIFFUSION_THREADS > 0:
+            torch.set_num_threads(DIFFUSION_THREADS)
+        if DIFFUSION_INTEROP_THREADS > 0:
+            try:
+                torch.set_num_interop_threads(DIFFUSION_INTEROP_THREADS)
+            except RuntimeError as e:
+                log_message(f"⚠️ Inter-op потоки уже заданы: {e}", level="WARNING")
+        log_message(f"🧵 Потоки torch: intra-op {torch.get_num_threads()}, inter-op {torch.get_num_interop_threads()}")
+
+    def autocast(self) -> ContextManager[Any]:
+        """autocast в bfloat16 для torch-бэкенда, иначе пустой контекст."""
+        if not self.bf16:
+            return nullcontext()
+        import torch
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+
+    def optimize(self, pipeline: Any) -> Any:
+        """Применяет bf16, channels_last и torch.compile к torch-пайплайну на месте."""
+        import torch
+
+        self.applied = []
+        if not self.enabled:
+            return pipeline
+        self.bf16 = self.bf16_mode == "1" or (self.bf16_mode == "auto" and bf16_supported())
+        if self.bf16:
+            self.applied.append("bf16-autocast")
+        if self.channels_last:
+            for name in ("unet", "vae"):
+                module = getattr(pipeline, name, None)
+                if module is not None:
+                    module.to(memory_format=torch.channels_last)
+            self.applied.append("channels_last")
+        for name in self.compile_targets:
+            module = getattr(pipeline, name, None)
+            if module is None:
+                continue
+            try:
+                if name == "vae":
+                    module.decoder = torch.compile(module.decoder, mode=self.compile_mode)
+                else:
+                    setattr(pipeline, name, torch.compile(module, mode=self.compile_mode))
+                self.applied.append(f"compile-{name}")
+            except Exception as e:
+                log_message(f"⚠️ torch.compile для {name} не удался: {e}", level="WARNING")
+        return pipeline
+
+    def load_exported(self, model_id: str) -> Any:
+        """Пайплайн ONNX Runtime или OpenVINO; экспорт выполняется один раз на модель."""
+        if self.backend == "onnx":
+            from optimum.onnxruntime import ORTStableDiffusionPipeline as pipeline_cls
+        else:
+            from optimum.intel import OVStableDiffusionPipeline as pipeline_cls
+
+        export_path = os.path.join(DIFFUSION_EXPORT_DIR, self.backend, model_id.replace("/", "--"))
+        if os.path.isdir(export_path):
+            pipeline = pipeline_cls.from_pretrained(export_path)
+        else:
+            started = time.perf_counter()
+            pipeline = pipeline_cls.from_pretrained(model_id, export=True)
+            pipeline.save_pretrained(export_path)
+            log_message(f"📦 {model_id} экспортирована в {self.backend} за {time.perf_counter() - started:.0f} с: {export_path}")
+        self.bf16 = False
+        self.applied = [f"backend-{self.backend}"]
+        return pipeline
+
+    def prepare(self, pipeline: Any, model_id: str, params: Dict[str, Any]) -> Any:
+        """Включает CPU-режим для загруженного пайплайна и, если нужно, замеряет эффект.
+
+        Возвращает пайплайн, который нужно использовать дальше (при экспорте — новый объект).
+        """
+        if not self.enabled:
+            return pipeline
+        bench_args = {
+            "height": int(params.get("height", 512)),
+            "width": int(params.get("width", 512)),
+            "guidance_scale": float(params.get("guidance_scale", 7.0)),
+        }
+        before = measure_seconds_per_step(pipeline, **bench_args) if self.benchmark else None
+
+        if self.backend != "torch":
+            try:
+                pipeline = self.load_exported(model_id)
+            except Exception as e:
+                log_message(f"⚠️ Бэкенд {self.backend} недоступен ({e}), остаётся torch", level="WARNING")
+                self.backend = "torch"
+        if self.backend == "torch":
+            pipeline = self.optimize(pipeline)
+        log_message(f"⚙️ CPU-режим диффузии: {', '.join(self.applied) or 'без оптимизаций'}")
+
+        if before is not None:
+            after = measure_seconds_per_step(pipeline, context=self.autocast, **bench_args)
+            self.write_report(model_id, before, after, bench_args)
+        return pipeline
+
+    def write_report(self, model_id: str, before: float, after: float, bench_args: Dict[str, Any]) -> Dict[str, Any]:
+        report = {
+            'model': model_id,
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'resolution': f"{bench_args['width']}x{bench_args['height']}",
+            'applied': self.applied,
+            'seconds_per_step_before': round(before, 3),
+            'seconds_per_step_after': round(after, 3),
+            'speedup': round(before / after, 2) if after > 0 else None,
+        }
+        log_message(
+            f"⏱️ Диффузия на CPU: {before:.2f} → {after:.2f} с/шаг "
+            f"({report['speedup']}×, {', '.join(self.applied) or 'без оптимизаций'})"
+        )
+        if DIFFUSION_REPORT_PATH:
+            os.makedirs(os.path.dirname(DIFFUSION_REPORT_PATH) or ".", exist_ok=True)
+            with open(DIFFUSION_REPORT_PATH, 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+cpu_runtime = CpuDiffusionRuntime()
+
+
+if __name__ == "__main__":
+    cpu_runtime.benchmark = True
+    from image_generator import ImageGenerator
+
+    ImageGenerator()
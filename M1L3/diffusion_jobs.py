@@ -0,0 +1,349 @@
+"""Фоновая очередь задач генерации изображений.
+
+Хендлер /image только ставит задачу в очередь и сразу освобождается;
+воркеры забирают задачи, генерируют картинки в пуле диффузии
+и сами отправляют результат в чат. Ожидающие задачи хранятся в SQLite,
+поэтому после перезапуска бота они не теряются, а прерванные на середине
+запускаются заново. Пропускная способность /image растёт с числом воркеров.
+
+Воркер забирает до DIFFUSION_BATCH_SIZE ожидающих задач сразу и генерирует
+их одним вызовом пайплайна: все задачи /image идут с одинаковыми моделью,
+шагами, размером и guidance, так что они всегда совместимы.
+
+Запуск задачи засчитывается в базе как попытка: задача, которая уже
+DIFFUSION_JOB_MAX_ATTEMPTS раз роняла бота, после перезапуска не
+повторяется, а пользователю приходит сообщение об ошибке.
+"""
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+from admission import ADMISSION_PER_USER, AdmissionRejected
+from inference_pool import POOL_LIMITS
+from log_sink import log_message
+from collections import deque
+import threading
+import asyncio
+import logging
+import sqlite3
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+DIFFUSION_JOBS_DB: str = os.getenv("DIFFUSION_JOBS_DB", "data/diffusion_jobs.sqlite")
+DIFFUSION_JOB_QUEUE: int = int(os.getenv("DIFFUSION_JOB_QUEUE", "16"))
+# По умолчанию воркеров столько же, сколько потоков в пуле диффузии
+DIFFUSION_JOB_WORKERS: int = int(os.getenv("DIFFUSION_JOB_WORKERS", str(POOL_LIMITS['diffusion'][0])))
+DIFFUSION_BATCH_SIZE: int = int(os.getenv("DIFFUSION_BATCH_SIZE", "4"))
+# Сколько раз задачу можно начать; прерванная перезапуском задача считается попыткой
+DIFFUSION_JOB_MAX_ATTEMPTS: int = int(os.getenv("DIFFUSION_JOB_MAX_ATTEMPTS", "3"))
+
+
+class DiffusionJob:
+    """Одна задача генерации: кто просил, что рисовать и куда отвечать."""
+
+    __slots__ = (
+        'id', 'user_id', 'chat_id', 'prompt', 'status_message_id', 'created_at',
+        'started_at', 'attempts', 'position', 'notify_task',
+    )
+
+    def __init__(
+        self,
+        user_id: int,
+        chat_id: int,
+        prompt: str,
+        status_message_id: Optional[int] = None,
+        created_at: Optional[float] = None,
+        job_id: Optional[int] = None,
+        attempts: int = 0,
+    ):
+        self.id = job_id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.prompt = prompt
+        self.status_message_id = status_message_id
+        self.created_at = created_at if created_at is not None else time.time()
+        self.started_at: Optional[float] = None
+        self.attempts = attempts
+        self.position = 0
+        self.notify_task: Optional["asyncio.Task[None]"] = None
+
+
+JobHandler = Callable[[List[DiffusionJob]], Awaitable[Any]]
+PositionHandler = Callable[[DiffusionJob, int], Awaitable[Any]]
+DroppedHandler = Callable[[DiffusionJob], Awaitable[Any]]
+
+
+class DiffusionJobQueue:
+    """Очередь задач с воркерами, хранением в SQLite и статистикой ожидания и работы."""
+
+    def __init__(
+        self,
+        db_path: str = DIFFUSION_JOBS_DB,
+        max_pending: int = DIFFUSION_JOB_QUEUE,
+        workers: int = DIFFUSION_JOB_WORKERS,
+        per_user: int = ADMISSION_PER_USER,
+        max_batch: int = DIFFUSION_BATCH_SIZE,
+        max_attempts: int = DIFFUSION_JOB_MAX_ATTEMPTS,
+    ):
+        self.db_path = db_path
+        self.max_pending = max(0, max_pending)
+        self.workers = max(1, workers)
+        self.per_user = max(1, per_user)
+        self.max_batch = max(1, max_batch)
+        self.max_attempts = max(1, max_attempts)
+        self._pending: Deque[DiffusionJob] = deque()
+        self._running: Dict[int, DiffusionJob] = {}
+        # Места, занятые задачами, которые ещё записываются в базу
+        self._reserved: Dict[int, int] = {}
+        self._handler: Optional[JobHandler] = None
+        self._on_position: Optional[PositionHandler] = None
+        self._wakeup: Optional[asyncio.Condition] = None
+        self._tasks: List["asyncio.Task[None]"] = []
+        self._db_lock = threading.Lock()
+        self.stats: Dict[str, Any] = {
+            'submitted': 0,
+            'restored': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'dropped': 0,
+            'batches': 0,
+            'max_batch_size': 0,
+            'wait_time': 0.0,
+            'wait_max': 0.0,
+            'run_time': 0.0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, chat_id INTEGER, "
+            "prompt TEXT, status_message_id INTEGER, created_at REAL, attempts INTEGER DEFAULT 0)"
+        )
+        columns = {row[1] for row in db.execute("PRAGMA table_info(jobs)")}
+        if 'attempts' not in columns:
+            # База от версии без счётчика попыток
+            db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER DEFAULT 0")
+            db.commit()
+        return db
+
+    def _insert(self, job: DiffusionJob) -> int:
+        with self._db_lock:
+            db = self._connect()
+            try:
+                cursor = db.execute(
+                    "INSERT INTO jobs (user_id, chat_id, prompt, status_message_id, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (job.user_id, job.chat_id, job.prompt, job.status_message_id, job.created_at),
+                )
+                db.commit()
+                return int(cursor.lastrowid or 0)
+            finally:
+                db.close()
+
+    def _delete(self, job_ids: List[int]) -> None:
+        with self._db_lock:
+            db = self._connect()
+            try:
+                db.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in job_ids])
+                db.commit()
+            finally:
+                db.close()
+
+    def _mark_started(self, job_ids: List[int]) -> None:
+        with self._db_lock:
+            db = self._connect()
+            try:
+                db.executemany("UPDATE jobs SET attempts = attempts + 1 WHERE id = ?", [(job_id,) for job_id in job_ids])
+                db.commit()
+            finally:
+                db.close()
+
+    def _load(self) -> Tuple[List[DiffusionJob], List[DiffusionJob]]:
+        """Незавершённые задачи прошлого запуска: (к повтору, исчерпавшие попытки).
+
+        Исчерпавшие попытки сразу удаляются из базы.
+        """
+        if not os.path.exists(self.db_path):
+            return [], []
+        with self._db_lock:
+            db = self._connect()
+            try:
+                rows = db.execute(
+                    "SELECT id, user_id, chat_id, prompt, status_message_id, created_at, attempts FROM jobs ORDER BY id"
+                ).fetchall()
+                jobs = [
+                    DiffusionJob(user_id, chat_id, prompt, status_message_id, created_at, job_id=job_id, attempts=attempts or 0)
+                    for job_id, user_id, chat_id, prompt, status_message_id, created_at, attempts in rows
+                ]
+                dropped = [job for job in jobs if job.attempts >= self.max_attempts]
+                if dropped:
+                    db.executemany("DELETE FROM jobs WHERE id = ?", [(job.id,) for job in dropped])
+                    db.commit()
+            finally:
+                db.close()
+        return [job for job in jobs if job.attempts < self.max_attempts], dropped
+
+    @property
+    def depth(self) -> int:
+        return len(self._pending)
+
+    def _user_jobs(self, user_id: int) -> int:
+        return self._reserved.get(user_id, 0) + sum(job.user_id == user_id for job in self._pending) + sum(
+            job.user_id == user_id for job in self._running.values()
+        )
+
+    def _release_reservation(self, user_id: int) -> None:
+        count = self._reserved.get(user_id, 0) - 1
+        if count > 0:
+            self._reserved[user_id] = count
+        else:
+            self._reserved.pop(user_id, None)
+
+    async def start(
+        self,
+        handler: JobHandler,
+        on_position: Optional[PositionHandler] = None,
+        on_dropped: Optional[DroppedHandler] = None,
+    ) -> None:
+        """Поднимает воркеров и возвращает в очередь задачи, сохранённые до перезапуска.
+
+        handler получает список задач, которые нужно выполнить одним батчем;
+        on_dropped — задачи, исчерпавшие попытки, чтобы сообщить об ошибке их чатам.
+        """
+        if self._tasks:
+            return
+        self._handler = handler
+        self._on_position = on_position
+        self._wakeup = asyncio.Condition()
+        restored, dropped = await asyncio.to_thread(self._load)
+        self._pending.extend(restored)
+        self.stats['restored'] += len(restored)
+        self.stats['dropped'] += len(dropped)
+        if restored:
+            log_message(f"Восстановлено {len(restored)} задач генерации из {self.db_path}")
+        if dropped:
+            log_message(
+                f"Задачи генерации {[job.id for job in dropped]} отброшены после {self.max_attempts} попыток",
+                level="WARNING",
+            )
+        if on_dropped is not None:
+            for job in dropped:
+                try:
+                    await on_dropped(job)
+                except Exception as e:
+                    logger.debug(f"Не удалось сообщить об отброшенной задаче {job.id}: {e}")
+        self._tasks = [asyncio.create_task(self._worker(index)) for index in range(self.workers)]
+        self._update_positions()
+
+    async def submit(self, job: DiffusionJob) -> int:
+        """Ставит задачу в очередь и возвращает её номер в очереди (1 — следующая).
+
+        AdmissionRejected — сразу, если очередь заполнена или у пользователя уже per_user задач.
+        """
+        if self._user_jobs(job.user_id) >= self.per_user:
+            self.stats['rejected'] += 1
+            raise AdmissionRejected('diffusion', f"У тебя уже {self.per_user} изображения в очереди, дождись результата")
+        if len(self._pending) + sum(self._reserved.values()) >= self.max_pending:
+            self.stats['rejected'] += 1
+            raise AdmissionRejected('diffusion', "Очередь генерации заполнена, попробуй через минуту")
+        # Место занимается до записи в базу, иначе параллельные submit обойдут лимиты
+        self._reserved[job.user_id] = self._reserved.get(job.user_id, 0) + 1
+        try:
+            job.id = await asyncio.to_thread(self._insert, job)
+        finally:
+            self._release_reservation(job.user_id)
+        self._pending.append(job)
+        self.stats['submitted'] += 1
+        job.position = len(self._pending)
+        if self._wakeup is not None:
+            async with self._wakeup:
+                self._wakeup.notify()
+        return job.position
+
+    async def _worker(self, index: int) -> None:
+        assert self._wakeup is not None and self._handler is not None
+        while True:
+            async with self._wakeup:
+                await self._wakeup.wait_for(lambda: bool(self._pending))
+                batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+            now = time.time()
+            for job in batch:
+                assert job.id is not None
+                self._running[job.id] = job
+                job.started_at = now
+                job.attempts += 1
+                waited = now - job.created_at
+                self.stats['wait_time'] += waited
+                self.stats['wait_max'] = max(self.stats['wait_max'], waited)
+            self.stats['batches'] += 1
+            self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+            self._update_positions()
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self._mark_started, [job.id for job in batch if job.id is not None])
+                await self._handler(batch)
+                self.stats['completed'] += len(batch)
+            except asyncio.CancelledError:
+                # Задачи остаются в базе и будут повторены после перезапуска
+                raise
+            except Exception as e:
+                self.stats['failed'] += len(batch)
+                log_message(f"Батч задач генерации {[job.id for job in batch]} завершился ошибкой: {e}", level="ERROR")
+            finally:
+                self.stats['run_time'] += time.perf_counter() - started
+                for job in batch:
+                    self._running.pop(job.id or 0, None)
+            try:
+                await asyncio.to_thread(self._delete, [job.id for job in batch if job.id is not None])
+            except Exception as e:
+                # Строки останутся в базе и повторятся после перезапуска, но воркер продолжит работу
+                log_message(f"Не удалось удалить задачи генерации {[job.id for job in batch]} из базы: {e}", level="ERROR")
+
+    def _update_positions(self) -> None:
+        for position, job in enumerate(self._pending, start=1):
+            if job.position != position:
+                self._notify(job, position)
+
+    def _notify(self, job: DiffusionJob, position: int) -> None:
+        job.position = position
+        if self._on_position is None or (job.notify_task is not None and not job.notify_task.done()):
+            return
+        job.notify_task = asyncio.create_task(self._deliver(job))
+
+    async def _deliver(self, job: DiffusionJob) -> None:
+        """Отправляет последнюю позицию; быстрые изменения схлопываются в одну правку."""
+        assert self._on_position is not None
+        sent: Optional[int] = None
+        while job.position != sent and job.started_at is None:
+            sent = job.position
+            try:
+                await self._on_position(job, sent)
+            except Exception as e:
+                logger.debug(f"Не удалось обновить позицию задачи {job.id}: {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        finished = self.stats['completed'] + self.stats['failed']
+        started = finished + len(self._running)
+        now = time.time()
+        stats['depth'] = len(self._pending)
+        stats['running'] = len(self._running)
+        stats['workers'] = self.workers
+        stats['avg_wait'] = self.stats['wait_time'] / started if started else 0.0
+        stats['avg_run'] = self.stats['run_time'] / self.stats['batches'] if self.stats['batches'] else 0.0
+        stats['avg_batch_size'] = finished / self.stats['batches'] if self.stats['batches'] else 0.0
+        stats['oldest_wait'] = now - self._pending[0].created_at if self._pending else 0.0
+        return stats
+
+    async def shutdown(self) -> None:
+        """Останавливает воркеров; незавершённые задачи остаются в базе до следующего запуска."""
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+diffusion_jobs = DiffusionJobQueue()
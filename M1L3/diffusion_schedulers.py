@@ -0,0 +1,88 @@
+"""Планировщики диффузии и профили шагов под каждую модель.
+
+PNDM из чекпойнта SD v1.5 требует 25–30 шагов. DPM-Solver++ и
+Euler-ancestral дают сопоставимое качество за 8–12 шагов, а LCM
+(с LCM-LoRA) — за 4. Планировщик строится из конфига уже загруженного,
+поэтому его можно менять на лету, не перезагружая веса UNet и VAE.
+
+Выбор: DIFFUSION_SCHEDULER для всех моделей или MODEL_PROFILES[...]["scheduler"]
+для конкретной; "default" — планировщик из самого чекпойнта.
+"""
+from typing import Any, Dict, Optional, Tuple
+import os
+
+DIFFUSION_SCHEDULER: str = os.getenv("DIFFUSION_SCHEDULER", "")
+# Путь или репозиторий LCM-LoRA; пусто — по таблице LCM_LORAS
+LCM_LORA: str = os.getenv("LCM_LORA", "")
+
+# имя → (класс diffusers, параметры from_config)
+SCHEDULERS: Dict[str, Tuple[str, Dict[str, Any]]] = {
+    "pndm": ("PNDMScheduler", {"skip_prk_steps": True}),
+    "dpmpp": ("DPMSolverMultistepScheduler", {"algorithm_type": "dpmsolver++", "use_karras_sigmas": True}),
+    "euler_a": ("EulerAncestralDiscreteScheduler", {}),
+    "lcm": ("LCMScheduler", {}),
+}
+
+# Шаги и guidance для планировщика, если у модели нет своего профиля
+SCHEDULER_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "default": {},
+    "pndm": {"num_inference_steps": 25, "guidance_scale": 7.5},
+    "dpmpp": {"num_inference_steps": 8, "guidance_scale": 7.0},
+    "euler_a": {"num_inference_steps": 10, "guidance_scale": 7.0},
+    "lcm": {"num_inference_steps": 4, "guidance_scale": 1.0},
+}
+
+MODEL_PROFILES: Dict[str, Dict[str, Any]] = {
+    "runwayml/stable-diffusion-v1-5": {
+        "scheduler": "dpmpp",
+        "default": {"num_inference_steps": 25, "guidance_scale": 7.5},
+        "dpmpp": {"num_inference_steps": 8, "guidance_scale": 7.0},
+        "euler_a": {"num_inference_steps": 10, "guidance_scale": 7.0},
+        "lcm": {"num_inference_steps": 4, "guidance_scale": 1.0},
+    },
+    "bguisard/stable-diffusion-nano-2-1": {
+        "scheduler": "dpmpp",
+        "default": {"num_inference_steps": 20, "guidance_scale": 7.0},
+        "dpmpp": {"num_inference_steps": 8, "guidance_scale": 6.5},
+        "euler_a": {"num_inference_steps": 10, "guidance_scale": 6.5},
+    },
+    # sd-turbo дистиллирована под свой планировщик и 1–4 шага без guidance
+    "stabilityai/sd-turbo": {
+        "scheduler": "default",
+        "default": {"num_inference_steps": 4, "guidance_scale": 0.0},
+    },
+}
+
+LCM_LORAS: Dict[str, str] = {
+    "runwayml/stable-diffusion-v1-5": "latent-consistency/lcm-lora-sdv1-5",
+}
+
+
+def scheduler_for(model_id: str) -> str:
+    """Планировщик модели: DIFFUSION_SCHEDULER, иначе из профиля модели, иначе из чекпойнта."""
+    if DIFFUSION_SCHEDULER:
+        return DIFFUSION_SCHEDULER
+    return str(MODEL_PROFILES.get(model_id, {}).get("scheduler", "default"))
+
+
+def step_profile(model_id: str, scheduler: str) -> Dict[str, Any]:
+    """Шаги и guidance для пары модель + планировщик."""
+    profile = MODEL_PROFILES.get(model_id, {}).get(scheduler)
+    if profile is not None:
+        return dict(profile)
+    return dict(SCHEDULER_DEFAULTS.get(scheduler, {}))
+
+
+def lcm_lora_for(model_id: str) -> Optional[str]:
+    return LCM_LORA or LCM_LORAS.get(model_id)
+
+
+def build_scheduler(name: str, base_config: Any) -> Any:
+    """Новый планировщик из конфига текущего; веса пайплайна не трогаются."""
+    if name not in SCHEDULERS:
+        raise ValueError(f"Неизвестный планировщик: {name}")
+    import diffusers
+
+    class_name, overrides = SCHEDULERS[name]
+    scheduler_cls = getattr(diffusers, class_name)
+    return scheduler_cls.from_config(base_config, **overrides)
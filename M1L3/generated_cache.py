@@ -0,0 +1,187 @@
+"""Кеш сгенерированных изображений с адресацией по содержимому запроса.
+
+Ключ — хеш модели, планировщика, режима исполнения (бэкенд, bf16),
+итогового промпта, негативного промпта, seed и параметров генерации. Одинаковый запрос отдаёт те же байты PNG
+сразу, без диффузии. Файлы лежат в папке вывода как <ключ>.png, индекс —
+в SQLite рядом. Размер папки ограничен GENERATED_CACHE_MAX_MB (вытесняются
+давно не использованные), возраст — GENERATED_CACHE_MAX_AGE_DAYS; старые
+PNG без записи в индексе (от прежних версий бота) удаляются по возрасту.
+"""
+from typing import Any, Dict, List, Optional
+import threading
+import hashlib
+import logging
+import sqlite3
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+GENERATED_CACHE_DIR: str = os.getenv("GENERATED_CACHE_DIR", "generated_images")
+GENERATED_CACHE_MAX_MB: int = int(os.getenv("GENERATED_CACHE_MAX_MB", "512"))
+GENERATED_CACHE_MAX_AGE_DAYS: float = float(os.getenv("GENERATED_CACHE_MAX_AGE_DAYS", "30"))
+# Пусто — seed выводится из промпта (повторный запрос детерминирован и попадает в кеш),
+# число — общий фиксированный seed
+GENERATION_SEED: str = os.getenv("GENERATION_SEED", "")
+
+INDEX_NAME = "index.sqlite"
+
+
+def seed_for(prompt: str) -> int:
+    """Seed генерации: GENERATION_SEED или стабильный хеш промпта."""
+    if GENERATION_SEED:
+        return int(GENERATION_SEED)
+    return int.from_bytes(hashlib.sha256(prompt.encode('utf-8')).digest()[:4], 'big') & 0x7FFFFFFF
+
+
+def make_key(**fields: Any) -> str:
+    payload = json.dumps(fields, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class GeneratedImageCache:
+    """PNG по ключу запроса с вытеснением по размеру папки и по возрасту."""
+
+    def __init__(
+        self,
+        directory: str = GENERATED_CACHE_DIR,
+        max_bytes: int = GENERATED_CACHE_MAX_MB * 1024 * 1024,
+        max_age: float = GENERATED_CACHE_MAX_AGE_DAYS * 86400,
+    ):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.db_path = os.path.join(directory, INDEX_NAME)
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'stored': 0,
+            'evictions': 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        os.makedirs(self.directory, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "key TEXT PRIMARY KEY, size INTEGER, created REAL, last_used REAL)"
+        )
+        return db
+
+    def path_for(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            db = self._connect()
+            try:
+                row = db.execute("SELECT key FROM images WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    try:
+                        with open(self.path_for(key), 'rb') as f:
+                            data = f.read()
+                    except OSError:
+                        db.execute("DELETE FROM images WHERE key = ?", (key,))
+                        db.commit()
+                    else:
+                        db.execute("UPDATE images SET last_used = ? WHERE key = ?", (time.time(), key))
+                        db.commit()
+                        self.stats['hits'] += 1
+                        return data
+            finally:
+                db.close()
+        self.stats['misses'] += 1
+        return None
+
+    def put(self, key: str, data: bytes) -> str:
+        """Сохраняет PNG и применяет лимиты; возвращает путь к файлу."""
+        path = self.path_for(key)
+        with self._lock:
+            db = self._connect()
+            try:
+                tmp_path = f"{path}.tmp"
+                with open(tmp_path, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+                now = time.time()
+                db.execute(
+                    "INSERT OR REPLACE INTO images (key, size, created, last_used) VALUES (?, ?, ?, ?)",
+                    (key, len(data), now, now),
+                )
+                db.commit()
+                self.stats['stored'] += 1
+                self._evict(db)
+            finally:
+                db.close()
+        return path
+
+    def _remove(self, db: sqlite3.Connection, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+        db.executemany("DELETE FROM images WHERE key = ?", [(key,) for key in keys])
+        self.stats['evictions'] += len(keys)
+
+    def _evict(self, db: sqlite3.Connection) -> None:
+        now = time.time()
+        if self.max_age > 0:
+            expired = [key for (key,) in db.execute("SELECT key FROM images WHERE created < ?", (now - self.max_age,))]
+            self._remove(db, expired)
+        if self.max_bytes > 0:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM images").fetchone()[0]
+            if total > self.max_bytes:
+                evicted: List[str] = []
+                for key, size in db.execute("SELECT key, size FROM images ORDER BY last_used"):
+                    if total <= self.max_bytes:
+                        break
+                    evicted.append(key)
+                    total -= size
+                self._remove(db, evicted)
+        db.commit()
+
+    def prune(self) -> int:
+        """Полная уборка: лимиты индекса и удаление старых PNG, которых нет в индексе."""
+        removed = 0
+        with self._lock:
+            db = self._connect()
+            try:
+                before = self.stats['evictions']
+                self._evict(db)
+                removed += self.stats['evictions'] - before
+                if self.max_age > 0:
+                    indexed = {key for (key,) in db.execute("SELECT key FROM images")}
+                    cutoff = time.time() - self.max_age
+                    for name in os.listdir(self.directory):
+                        path = os.path.join(self.directory, name)
+                        if not name.lower().endswith('.png') or name[:-4] in indexed:
+                            continue
+                        try:
+                            if os.path.getmtime(path) < cutoff:
+                                os.remove(path)
+                                removed += 1
+                        except OSError:
+                            pass
+            finally:
+                db.close()
+        if removed:
+            logger.info(f"Удалено {removed} старых изображений из {self.directory}")
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        with self._lock:
+            db = self._connect()
+            try:
+                count, total = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM images").fetchone()
+            finally:
+                db.close()
+        stats['entries'] = count
+        stats['size_mb'] = round(total / 2**20, 1)
+        return stats
+
+
+generated_images = GeneratedImageCache()
@@ -0,0 +1,89 @@
+"""Асинхронный HTTP-клиент с общим пулом keep-alive соединений."""
+from typing import Any, Dict, Optional
+import aiohttp
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+HTTP_POOL_LIMIT: int = int(os.getenv("HTTP_POOL_LIMIT", "100"))
+HTTP_POOL_LIMIT_PER_HOST: int = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", "10"))
+HTTP_KEEPALIVE_TIMEOUT: float = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", "30"))
+HTTP_TOTAL_TIMEOUT: float = float(os.getenv("HTTP_TOTAL_TIMEOUT", "10"))
+HTTP_CONNECT_TIMEOUT: float = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+
+
+class HttpClient:
+    """Ленивая общая aiohttp-сессия с лимитами на хост и таймаутами."""
+
+    def __init__(
+        self,
+        limit: int = HTTP_POOL_LIMIT,
+        limit_per_host: int = HTTP_POOL_LIMIT_PER_HOST,
+        keepalive_timeout: float = HTTP_KEEPALIVE_TIMEOUT,
+        total_timeout: float = HTTP_TOTAL_TIMEOUT,
+        connect_timeout: float = HTTP_CONNECT_TIMEOUT,
+    ):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = aiohttp.ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+
+    async def get_session(self) -> aiohttp.ClientSession:
+        """Возвращает общую сессию, создавая её в текущем event loop."""
+        if self._session is not None and not self._session.closed:
+            return self._session
+        async with self._lock:
+            if self._session is None or self._session.closed:
+                connector = aiohttp.TCPConnector(
+                    limit=self.limit,
+                    limit_per_host=self.limit_per_host,
+                    keepalive_timeout=self.keepalive_timeout,
+                    ttl_dns_cache=300,
+                )
+                self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+                logger.info(
+                    f"HTTP-сессия создана (limit={self.limit}, per_host={self.limit_per_host})"
+                )
+        return self._session
+
+    def _timeout(self, timeout: Optional[float]) -> Optional[aiohttp.ClientTimeout]:
+        if timeout is None:
+            return None
+        return aiohttp.ClientTimeout(total=timeout, connect=min(timeout, self.timeout.connect or timeout))
+
+    async def get_json(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> Any:
+        """GET-запрос с разбором JSON. Ошибки HTTP поднимаются как ClientResponseError."""
+        session = await self.get_session()
+        async with session.get(url, headers=headers, timeout=self._timeout(timeout)) as response:
+            response.raise_for_status()
+            return await response.json(content_type=None)
+
+    async def get_bytes(
+        self,
+        url: str,
+        headers: Optional[Dict[str, str]] = None,
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        """GET-запрос, возвращает тело ответа."""
+        session = await self.get_session()
+        async with session.get(url, headers=headers, timeout=self._timeout(timeout)) as response:
+            response.raise_for_status()
+            return await response.read()
+
+    async def close(self) -> None:
+        """Закрывает сессию и все соединения пула."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+http_client = HttpClient()
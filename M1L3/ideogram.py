@@ -1,25 +1,23 @@
 """ideogram.py — Модуль для работы с ZIP-архивом от Ideogram."""
 from __future__ import annotations
 
-import io
 import os
-import shutil
-import time
-import zipfile
 from pathlib import Path
-from typing import Any, Final
+from typing import Any, Final, Sequence
 
 import keras
 import numpy as np
-import numpy.typing as npt
-from PIL import Image
 
 from ai_model import AIModel
 from data_processor import DataProcessor, ModelWeightsProcessor
+from archive_cache import ARCHIVE_IN_MEMORY, ModelArchive
+from inference_pool import inference_pools
+from keras_classifier import ImageInput, KerasClassifier, find_model_file
+from log_sink import log_message
+from tflite_export import CLASSIFIER_TFLITE, load_or_export
 from keras.src.saving.saving_api import load_model
 
 IMG_SIZE: Final[int] = 224
-EXTRACT_DIR: Final[str] = "ideogram_extracted"
 
 
 class IdeogramModel:
@@ -27,18 +25,20 @@ class IdeogramModel:
 
     __slots__ = (
         "_zip_path",
-        "_model",
-        "_labels",
+        "_archive",
+        "_tflite_mode",
+        "_runtime",
         "_is_loaded",
         "_weights_processor",
         "_data_processor",
         "_ai_model",
     )
 
-    def __init__(self, zip_path: str = "converted_keras.zip") -> None:
+    def __init__(self, zip_path: str = "converted_keras.zip", tflite_mode: str = CLASSIFIER_TFLITE) -> None:
         self._zip_path: str = zip_path
-        self._model: keras.Model | None = None
-        self._labels: list[str] = []
+        self._archive = ModelArchive(zip_path)
+        self._tflite_mode: str = tflite_mode
+        self._runtime = KerasClassifier((IMG_SIZE, IMG_SIZE))
         self._is_loaded: bool = False
         self._weights_processor = ModelWeightsProcessor()
         self._data_processor = DataProcessor()
@@ -48,85 +48,93 @@ class IdeogramModel:
         """Загружает модель из ZIP и подготавливает систему."""
         try:
             if not os.path.exists(self._zip_path):
-                self._log(f"ZIP-архив не найден: {self._zip_path}")
+                self._log(f"ZIP-архив не найден: {self._zip_path}", level="ERROR")
                 return False
 
-            if os.path.exists(EXTRACT_DIR):
-                shutil.rmtree(EXTRACT_DIR)
-
-            with zipfile.ZipFile(self._zip_path, "r") as zf:
-                zf.extractall(EXTRACT_DIR)
-            self._log(f"Архив {self._zip_path} распакован")
-
-            labels_path = Path(EXTRACT_DIR) / "labels.txt"
-            if labels_path.exists():
-                self._labels = labels_path.read_text(encoding="utf-8").splitlines()
-                self._log(f"Загружено {len(self._labels)} меток")
-
-            model_path = next(
-                (
-                    Path(root) / f
-                    for root, _, files in os.walk(EXTRACT_DIR)
-                    for f in files
-                    if f.endswith((".h5", ".hdf5", ".keras"))
-                ),
-                None,
-            )
-
-            if model_path is None:
-                self._log("Модель не найдена в архиве")
+            labels = self._archive.read_labels()
+            if labels:
+                self._log(f"Загружено {len(labels)} меток")
+
+            if self._tflite_mode:
+                model = load_or_export("ideogram", self._archive, self._tflite_mode, self._load_keras, self._runtime)
+                self._log(f"TFLite-модель ({model.mode}) загружена: {Path(model.path).name}")
+            else:
+                model = self._load_keras()
+            if model is None:
                 return False
 
-            self._model = load_model(
-                str(model_path),
-                custom_objects={"DepthwiseConv2D": self._fixed_depthwise_conv2d},
-                compile=False,
-            )
-            self._log(f"Модель загружена: {model_path.name}")
+            self._runtime.set_model(model, labels)
             self._is_loaded = True
             return True
         except Exception as exc:
-            self._log(f"Ошибка загрузки: {exc}")
+            self._log(f"Ошибка загрузки: {exc}", level="ERROR")
             return False
 
+    def _load_keras(self) -> keras.Model | None:
+        if ARCHIVE_IN_MEMORY:
+            model = self._load_in_memory()
+            if model is not None:
+                self._log(f"Модель загружена из {self._zip_path} в памяти")
+                return model
+
+        model_file = find_model_file(self._archive.extract())
+        if model_file is None:
+            self._log("Модель не найдена в архиве", level="ERROR")
+            return None
+
+        model = load_model(
+            model_file,
+            custom_objects={"DepthwiseConv2D": self._fixed_depthwise_conv2d},
+            compile=False,
+        )
+        self._log(f"Модель загружена: {Path(model_file).name}")
+        return model
+
+    def _load_in_memory(self) -> keras.Model | None:
+        """.h5 прямо из архива; None, если модель не в HDF5 или загрузчик недоступен."""
+        return self._archive.load_keras_in_memory({"DepthwiseConv2D": self._fixed_depthwise_conv2d})
+
     @staticmethod
     def _fixed_depthwise_conv2d(**kwargs: Any) -> keras.layers.DepthwiseConv2D:
         kwargs.pop("groups", None)
         return keras.layers.DepthwiseConv2D(**kwargs)
 
     async def predict(self, image_bytes: bytes) -> tuple[str, float]:
-        """Предсказывает класс изображения."""
+        """Предсказывает класс изображения в пуле классификации."""
+        return await inference_pools.run("classification", self.predict_sync, image_bytes)
+
+    def predict_sync(self, image: ImageInput) -> tuple[str, float]:
+        """Синхронное предсказание: декодирование, predict, выбор класса."""
         if not self._is_loaded and not self.load():
             return "Модель не загружена", 0.0
 
-        if self._model is None:
+        if not self._runtime.is_ready:
             return "Модель отсутствует", 0.0
 
         try:
-            image = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-            image = image.resize((IMG_SIZE, IMG_SIZE), Image.Resampling.LANCZOS)
-
-            img_array: npt.NDArray[np.float32] = (
-                np.array(image, dtype=np.float32) / 255.0
-            )
-            img_array = np.expand_dims(img_array, axis=0)
-
-            predictions: npt.NDArray[np.float32] = self._model.predict(
-                img_array, verbose=0
-            )
-            predicted_idx = int(np.argmax(predictions[0]))
-            confidence = float(predictions[0][predicted_idx])
-
-            class_name = (
-                self._labels[predicted_idx]
-                if predicted_idx < len(self._labels)
-                else f"Класс {predicted_idx}"
-            )
-            return class_name, confidence
+            return self._runtime.predict([image])[0]
         except Exception as exc:
-            self._log(f"Ошибка предсказания: {exc}")
+            self._log(f"Ошибка предсказания: {exc}", level="ERROR")
             return "Ошибка", 0.0
 
+    async def predict_batch(self, images: Sequence[ImageInput]) -> list[tuple[str, float]]:
+        """Top-1 для нескольких изображений одним проходом модели."""
+        if not self._is_loaded and not self.load():
+            raise RuntimeError("Ideogram модель не загружена")
+        return await inference_pools.run("classification", self._runtime.predict, images)
+
+    async def predict_top_k(self, image: ImageInput, k: int = 3) -> list[tuple[str, float]]:
+        """k самых вероятных классов по убыванию уверенности."""
+        if not self._is_loaded and not self.load():
+            raise RuntimeError("Ideogram модель не загружена")
+        return await inference_pools.run("classification", self._runtime.top_k, image, k)
+
+    async def predict_prepared(self, batch: np.ndarray) -> list[tuple[str, float]]:
+        """Top-1 для готового тензора (N, 224, 224, 3), общего с другими моделями."""
+        if not self._is_loaded and not self.load():
+            raise RuntimeError("Ideogram модель не загружена")
+        return await inference_pools.run("classification", self._runtime.predict_prepared, batch)
+
     def process_and_predict(self, user_id: int, text: str) -> dict[str, Any]:
         """Обрабатывает данные пользователя и делает AI-предсказание."""
         return {
@@ -139,17 +147,26 @@ class IdeogramModel:
         }
 
     @staticmethod
-    def _log(text: str) -> None:
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - IDEOGRAM - {text}"
-        print(message)
-        with open("bot.log", "a", encoding="utf-8") as f:
-            f.write(message + "\n")
+    def _log(text: str, level: str = "INFO") -> None:
+        log_message(text, prefix="IDEOGRAM", level=level)
 
     @property
     def is_loaded(self) -> bool:
         return self._is_loaded
 
+    @property
+    def runtime(self) -> KerasClassifier:
+        return self._runtime
+
+    @property
+    def archive(self) -> ModelArchive:
+        return self._archive
+
+    def warmup(self) -> None:
+        """Пробный инференс на нулевом изображении для прогрева графа."""
+        if not self._is_loaded and not self.load():
+            return
+        self._runtime.warmup()
+
     def cleanup(self) -> None:
-        if os.path.exists(EXTRACT_DIR):
-            shutil.rmtree(EXTRACT_DIR)
\ No newline at end of file
+        self._archive.remove()
\ No newline at end of file
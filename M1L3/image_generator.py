@@ -1,11 +1,17 @@
-from typing import Any, Dict, List, TypedDict, Optional, cast, TYPE_CHECKING
+from typing import Any, Dict, List, Sequence, TypedDict, Optional, cast, TYPE_CHECKING
 from PIL import Image, ImageDraw, ImageFont
+from log_sink import log_message
+from prompt_embeddings import prompt_embeddings
+from diffusion_schedulers import build_scheduler, lcm_lora_for, scheduler_for, step_profile
+from generated_cache import generated_images, make_key, seed_for
+from diffusion_cpu import cpu_runtime, exported_latents
 from datetime import datetime
 import numpy as np
+import contextlib
+import threading
 import traceback
 import requests
 import warnings
-import time
 import io
 import os
 import gc
@@ -41,6 +47,12 @@ except Exception as e:
     diffusers_available = False
     diffusers_error = str(e)
 
+HQ_NEGATIVE_PROMPT = (
+    "blurry, low quality, worst quality, jpeg artifacts, "
+    "deformed, malformed, mutated, disfigured, bad anatomy, "
+    "watermark, signature, text, username, cartoon, anime"
+)
+
 class LoraConfig(TypedDict):
     url: str
     trigger_word: str
@@ -57,6 +69,14 @@ class ImageGenerator:
         os.makedirs(self.loras_dir, exist_ok=True)
         self.lora_adapters: Dict[str, Any] = {}
         self.pipeline: Optional[Any] = None
+        self.scheduler_name = "default"
+        # Шаги и guidance текущего планировщика поверх model_params
+        self.step_params: Dict[str, Any] = {}
+        self._base_scheduler: Any = None
+        self._lcm_loaded = False
+        self._pipeline_lock = threading.Lock()
+        # torch, onnx или openvino: экспортированный пайплайн не принимает torch-генераторы и эмбеддинги
+        self.runtime_backend = "torch"
         self.current_model_id = None
         self.torch_available = diffusers_available
         self.hf_token: Optional[str] = os.getenv("HF_TOKEN") or os.getenv("HUGGINGFACE_TOKEN")
@@ -65,7 +85,7 @@ class ImageGenerator:
             self.log_message("🔑 HF token найден, будет использоваться для загрузки моделей")
             os.environ["HUGGINGFACE_TOKEN"] = self.hf_token
         else:
-            self.log_message("⚠️ HF token отсутствует — загрузка моделей будет анонимной")
+            self.log_message("⚠️ HF token отсутствует — загрузка моделей будет анонимной", level="WARNING")
 
         os.environ.setdefault("HF_HOME", self.models_cache_dir)
         os.environ.setdefault("HF_HUB_DISABLE_TELEMETRY", "1")
@@ -136,14 +156,14 @@ class ImageGenerator:
             self._load_base_model_safe(models_to_try)
             self._load_lora_adapters()
         else:
-            self.log_message(f"⚠️ Diffusers/Torch unavailable: {diffusers_error}")
+            self.log_message(f"⚠️ Diffusers/Torch unavailable: {diffusers_error}", level="WARNING")
             self.log_message("💡 Будет использоваться упрощённая генерация без модели")
 
     def _cache_model_parts(self, model_id: str) -> None:
         """Кеширует компоненты модели локально."""
         self.log_message(f"📦 Кеширование модели: {model_id}")
         if not diffusers_available:
-            self.log_message("⚠️ Отмена кеширования: diffusers недоступен")
+            self.log_message("⚠️ Отмена кеширования: diffusers недоступен", level="WARNING")
             return
         assert torch is not None
         try:
@@ -171,7 +191,7 @@ class ImageGenerator:
                         getattr(PNDMScheduler, "from_pretrained")(model_id, subfolder="scheduler", low_cpu_mem_usage=True)
                         scheduler_loaded = True
             except Exception as scheduler_error:
-                self.log_message(f"⚠️ Scheduler не загрузился для {model_id}: {scheduler_error}")
+                self.log_message(f"⚠️ Scheduler не загрузился для {model_id}: {scheduler_error}", level="WARNING")
 
             if scheduler_loaded:
                 self.log_message(f"✅ Кеширование завершено: {model_id}")
@@ -179,8 +199,8 @@ class ImageGenerator:
                 self.log_message(f"✅ Кеширование основных весов завершено: {model_id} (scheduler пропущен)")
             
         except Exception as e:
-            self.log_message(f"⚠️ Не удалось закешировать {model_id}: {e}")
-            self.log_message(f"🔍 Трассировка: {traceback.format_exc()}")
+            self.log_message(f"⚠️ Не удалось закешировать {model_id}: {e}", level="WARNING")
+            self.log_message(f"🔍 Трассировка: {traceback.format_exc()}", level="WARNING")
         finally:
             gc.collect()
 
@@ -197,7 +217,7 @@ class ImageGenerator:
         except Exception as first_error:
             message = str(first_error)
             if any(marker in message for marker in ("client has been closed", "getaddrinfo failed", "Connection refused", "Name or service not known")):
-                self.log_message(f"⚠️ Сетевая ошибка при загрузке {model_id}: {message}")
+                self.log_message(f"⚠️ Сетевая ошибка при загрузке {model_id}: {message}", level="WARNING")
                 self.log_message("ℹ️ Пробую загрузить компонент из локального кеша")
                 kwargs["local_files_only"] = True
                 kwargs.pop("use_auth_token", None)
@@ -212,12 +232,14 @@ class ImageGenerator:
             try:
                 self._cache_model_parts(model_id)
             except Exception:
-                self.log_message(f"⚠️ Пропускаю кеширование {model_id} после ошибки")
+                self.log_message(f"⚠️ Пропускаю кеширование {model_id} после ошибки", level="WARNING")
 
     def _load_base_model_safe(self, models_to_try: List[str]) -> None:
         if not diffusers_available:
             return
         assert torch is not None, "PyTorch недоступен"
+        if self.device == "cpu":
+            cpu_runtime.configure_threads()
         for model_id in models_to_try:
             try:
                 self.log_message(f"🔄 Пробуем загрузить по частям: {model_id}")
@@ -255,25 +277,76 @@ class ImageGenerator:
                         self.pipeline.enable_vae_slicing()
                     self.pipeline.enable_attention_slicing()
                     self.log_message("✅ CPU Offload + VAE Slicing включены")
+                else:
+                    self.pipeline = cpu_runtime.prepare(self.pipeline, model_id, self.model_params.get(model_id, self.standard_params))
+                    self.runtime_backend = cpu_runtime.backend if cpu_runtime.enabled else "torch"
                 
                 self.current_model_id = model_id
+                self._base_scheduler = scheduler
+                self._lcm_loaded = False
+                self.set_scheduler(scheduler_for(model_id))
                 self.log_message(f"✅ Успешно загружена по частям: {model_id}")
                 self.log_message("ℹ️ Пропускаем кеширование остальных моделей — это снижает расход памяти и предотвращает MemoryError")
                 return
                 
             except Exception as e:
-                self.log_message(f"❌ Не удалось загрузить {model_id}: {e}")
-                self.log_message(f"🔍 Трассировка: {traceback.format_exc()}")
+                self.log_message(f"❌ Не удалось загрузить {model_id}: {e}", level="ERROR")
+                self.log_message(f"🔍 Трассировка: {traceback.format_exc()}", level="ERROR")
                 if self.pipeline is not None:
                     self.pipeline = None
                 if hasattr(torch, "cuda"):
                     torch.cuda.empty_cache()
         
-        self.log_message("⚠️ Не удалось загрузить ни одну модель!")
+        self.log_message("⚠️ Не удалось загрузить ни одну модель!", level="WARNING")
+
+    def set_scheduler(self, name: str) -> str:
+        """Меняет планировщик на лету и подставляет его профиль шагов; веса не перезагружаются.
+
+        "default" — планировщик из чекпойнта, "lcm" дополнительно включает LCM-LoRA.
+        Возвращает имя действующего планировщика: при ошибке остаётся прежний.
+        """
+        if self.pipeline is None or self._base_scheduler is None:
+            raise RuntimeError("Пайплайн не загружен")
+        model_id = str(self.current_model_id)
+        with self._pipeline_lock:
+            try:
+                if name == "default":
+                    scheduler = self._base_scheduler
+                else:
+                    scheduler = build_scheduler(name, self._base_scheduler.config)
+                if name == "lcm":
+                    self._enable_lcm_lora(model_id)
+                elif self._lcm_loaded:
+                    self.pipeline.disable_lora()
+                self.pipeline.scheduler = scheduler
+            except Exception as e:
+                self.log_message(f"⚠️ Планировщик {name} недоступен для {model_id}: {e}", level="WARNING")
+                return self.scheduler_name
+            self.scheduler_name = name
+            self.step_params = step_profile(model_id, name)
+        self.log_message(
+            f"🗓️ Планировщик {name}: {self.step_params.get('num_inference_steps', 'шаги модели')} шагов, "
+            f"guidance {self.step_params.get('guidance_scale', 'модели')}"
+        )
+        return name
+
+    def _enable_lcm_lora(self, model_id: str) -> None:
+        """LCM-планировщику нужна LCM-LoRA; она грузится один раз и потом только включается."""
+        assert self.pipeline is not None
+        if self._lcm_loaded:
+            self.pipeline.enable_lora()
+            return
+        lora_path = lcm_lora_for(model_id)
+        if not lora_path:
+            raise RuntimeError("для модели нет LCM-LoRA")
+        self.pipeline.load_lora_weights(lora_path, adapter_name="lcm")
+        self.pipeline.set_adapters(["lcm"], adapter_weights=[1.0])
+        self._lcm_loaded = True
+        self.log_message(f"✅ LCM-LoRA загружена: {lora_path}")
 
     def _load_lora_adapters(self):
         if self.pipeline is None:
-            self.log_message("⚠️ Пропускаем загрузку LoRA: базовая модель не загружена")
+            self.log_message("⚠️ Пропускаем загрузку LoRA: базовая модель не загружена", level="WARNING")
             return
 
         loaded: List[str] = []
@@ -292,17 +365,17 @@ class ImageGenerator:
                     self.log_message(f"✅ LoRA {lora_name} загружен (конфиг сохранен)")
                 else:
                     missing.append(lora_name)
-                    self.log_message(f"⚠️ LoRA файл не найден: {lora_name}")
+                    self.log_message(f"⚠️ LoRA файл не найден: {lora_name}", level="WARNING")
             except Exception as e:
                 missing.append(lora_name)
-                self.log_message(f"❌ Ошибка загрузки LoRA {lora_name}: {e}")
+                self.log_message(f"❌ Ошибка загрузки LoRA {lora_name}: {e}", level="ERROR")
 
         existing_files = [f for f in os.listdir(self.loras_dir) if f.lower().endswith('.safetensors')]
         self.log_message(f"ℹ️ Содержимое папки LoRA ({self.loras_dir}): {', '.join(existing_files) if existing_files else 'пусто'}")
         if loaded:
             self.log_message(f"✅ Загруженные LoRA: {', '.join(sorted(loaded))}")
         if missing:
-            self.log_message(f"⚠️ Не найдены/не загружены LoRA: {', '.join(sorted(missing))}")
+            self.log_message(f"⚠️ Не найдены/не загружены LoRA: {', '.join(sorted(missing))}", level="WARNING")
 
     def _download_lora(self, url: str, lora_name: str) -> str:
         """Скачивание LoRA файла"""
@@ -325,9 +398,26 @@ class ImageGenerator:
             
             return local_path
         except Exception as e:
-            self.log_message(f"❌ Ошибка скачивания LoRA: {e}")
+            self.log_message(f"❌ Ошибка скачивания LoRA: {e}", level="ERROR")
             raise
 
+    def warmup(self) -> None:
+        """Один шаг диффузии на малом разрешении: прогревает текстовый энкодер, UNet и VAE"""
+        if self.pipeline is None:
+            return
+        assert torch is not None
+        raw_params = {**self.model_params.get(str(self.current_model_id), self.standard_params), **self.step_params}
+        with torch.no_grad(), self._autocast():
+            self.pipeline(
+                prompt="warmup",
+                output_type="pil",
+                height=256,
+                width=256,
+                num_inference_steps=1,
+                guidance_scale=float(raw_params.get("guidance_scale", 7.0)),
+            )
+        self.log_message("🔥 Пайплайн прогрет")
+
     def _enhance_prompt_for_quality(self, prompt: str) -> str:
         """Усиление промпта для максимального качества"""
         quality_enhancers = [
@@ -360,54 +450,200 @@ class ImageGenerator:
         else:
             return f"{prompt}, realistic, high quality, detailed"
 
+    def _generation_params(self, defaults: Dict[str, Any]) -> Dict[str, Any]:
+        """Размер, шаги и guidance текущей модели с учётом профиля планировщика"""
+        raw_params = {**self.model_params.get(str(self.current_model_id), defaults), **self.step_params}
+        return {
+            "height": int(raw_params.get("height", 512)),
+            "width": int(raw_params.get("width", 512)),
+            "num_inference_steps": int(raw_params.get("num_inference_steps", defaults["num_inference_steps"])),
+            "guidance_scale": float(raw_params.get("guidance_scale", defaults["guidance_scale"])),
+        }
+
+    def _autocast(self) -> Any:
+        """bfloat16-autocast CPU-режима; на CUDA и без bf16 — пустой контекст"""
+        return cpu_runtime.autocast() if self.device == "cpu" else contextlib.nullcontext()
+
+    @property
+    def runtime_tag(self) -> str:
+        """Бэкенд и точность: от них зависят пиксели, поэтому они входят в ключ кеша"""
+        return cpu_runtime.tag if self.device == "cpu" else self.device
+
+    def _effective_negative(self, negative_prompt: Optional[str]) -> Optional[str]:
+        return negative_prompt if "turbo" not in str(self.current_model_id).lower() else None
+
+    def _run_pipeline(
+        self,
+        prompts: List[str],
+        negative_prompt: Optional[str],
+        defaults: Dict[str, Any],
+        cross_attention_kwargs: Optional[Dict[str, Any]] = None,
+        seeds: Optional[List[int]] = None,
+    ) -> List[Image.Image]:
+        """Один вызов пайплайна на весь список промптов с параметрами текущей модели.
+
+        Эмбеддинги промптов и негативного промпта берутся из кеша, если он включён;
+        с LoRA (cross_attention_kwargs) энкодер зависит от веса адаптера, поэтому там кеш не используется.
+        С seeds у каждого промпта свой генератор шума и результат воспроизводим;
+        экспортированным пайплайнам (ONNX, OpenVINO) шум передаётся готовыми latents.
+        """
+        assert self.pipeline is not None and torch is not None
+        negative_prompt = self._effective_negative(negative_prompt)
+        use_negative = negative_prompt is not None
+        call_kwargs: Dict[str, Any] = {
+            "output_type": "pil",
+            "cross_attention_kwargs": cross_attention_kwargs,
+            **self._generation_params(defaults),
+        }
+        guidance_scale = call_kwargs["guidance_scale"]
+        if seeds is not None and self.runtime_backend == "torch":
+            call_kwargs["generator"] = [torch.Generator(device="cpu").manual_seed(seed) for seed in seeds]
+        elif seeds is not None:
+            call_kwargs["latents"] = exported_latents(self.pipeline, seeds, call_kwargs["height"], call_kwargs["width"])
+        use_embeddings = prompt_embeddings.enabled and cross_attention_kwargs is None and self.runtime_backend == "torch"
+        with self._pipeline_lock, torch.no_grad(), self._autocast():
+            if use_embeddings and hasattr(self.pipeline, "encode_prompt"):
+                call_kwargs["prompt_embeds"] = self._encode_prompts(prompts)
+                if guidance_scale > 1.0:
+                    # Без негативного промпта пайплайн сам подставил бы пустую строку
+                    negative_text = negative_prompt if use_negative and negative_prompt is not None else ""
+                    call_kwargs["negative_prompt_embeds"] = self._encode_prompts([negative_text] * len(prompts))
+            else:
+                call_kwargs["prompt"] = prompts
+                call_kwargs["negative_prompt"] = [negative_prompt] * len(prompts) if use_negative else None
+            result = self.pipeline(**call_kwargs)
+        return self._extract_images(result, len(prompts))
+
+    def _encode_prompts(self, texts: List[str]) -> Any:
+        """prompt_embeds для списка текстов; текстовый энкодер запускается только на промахах кеша"""
+        assert self.pipeline is not None
+        pipeline = self.pipeline
+        device = getattr(pipeline, "_execution_device", self.device)
+
+        def encode(batch: List[str]) -> Any:
+            embeds, _ = pipeline.encode_prompt(batch, device, 1, False)
+            return embeds
+
+        return prompt_embeddings.encode(str(self.current_model_id), texts, encode)
+
+    def _pipeline_key(
+        self,
+        prompt: str,
+        negative_prompt: Optional[str],
+        seed: int,
+        defaults: Dict[str, Any],
+        **extra: Any,
+    ) -> str:
+        """Ключ generated_images для промпта с текущими моделью, планировщиком и параметрами"""
+        return make_key(
+            model=self.current_model_id,
+            scheduler=self.scheduler_name,
+            runtime=self.runtime_tag,
+            prompt=prompt,
+            negative_prompt=self._effective_negative(negative_prompt),
+            seed=seed,
+            **self._generation_params(defaults),
+            **extra,
+        )
+
+    def _store(self, key: str, data: bytes, label: str) -> None:
+        """Сохраняет PNG в generated_images: так он учитывается в лимитах папки"""
+        filepath = generated_images.put(key, data)
+        self.log_message(f"💾 {label} сохранено: {filepath}")
+
+    def cached_batch(self, prompts: Sequence[str]) -> List[Optional[bytes]]:
+        """Готовые картинки generate_batch из generated_images без диффузии; None — промах.
+
+        Ключ зависит от выбранной при загрузке модели, поэтому до загрузки всё — промахи.
+        """
+        if not self.pipeline:
+            return [None] * len(prompts)
+        params = self.high_quality_params
+        keys = []
+        for prompt in prompts:
+            enhanced_prompt = self._enhance_prompt_for_quality(prompt)
+            keys.append(self._pipeline_key(enhanced_prompt, HQ_NEGATIVE_PROMPT, seed_for(enhanced_prompt), params))
+        return [generated_images.get(key) for key in keys]
+
     def generate_high_quality(self, prompt: str, user_id: str, save_to_disk: bool = True) -> io.BytesIO:
         """Генерация с акцентом на максимальное качество"""
         if not self.pipeline:
             return self.auto_generate(prompt, user_id, save_to_disk)
-        
-        try:
-            enhanced_prompt = self._enhance_prompt_for_quality(prompt)
-            
-            negative_prompt = (
-                "blurry, low quality, worst quality, jpeg artifacts, "
-                "deformed, malformed, mutated, disfigured, bad anatomy, "
-                "watermark, signature, text, username, cartoon, anime"
-            )
+        return self.generate_batch([prompt], [user_id], save_to_disk)[0]
+
+    def generate_batch(
+        self,
+        prompts: Sequence[str],
+        user_ids: Sequence[str],
+        save_to_disk: bool = True,
+        check_cache: bool = True,
+    ) -> List[io.BytesIO]:
+        """HQ-генерация нескольких промптов одним вызовом пайплайна.
+
+        У всех промптов общие модель, число шагов, размер и guidance, поэтому
+        фиксированная стоимость шага UNet делится на весь батч. Картинки
+        возвращаются в порядке промптов, чтобы каждая ушла своему автору.
+
+        Seed выводится из промпта, поэтому повтор запроса отдаётся из
+        generated_images без диффузии; в пайплайн идут только промахи.
+        При save_to_disk новые картинки сохраняются в этот кеш. check_cache=False —
+        вызывающий уже проверил кеш через cached_batch.
+        """
+        if len(prompts) != len(user_ids):
+            raise ValueError("Число промптов и пользователей не совпадает")
+        if not prompts:
+            return []
+        if not self.pipeline:
+            return [self.auto_generate(prompt, user_id, save_to_disk) for prompt, user_id in zip(prompts, user_ids)]
 
-            self.log_message(f"🎨 Генерация HQ: {enhanced_prompt}")
-            
-            raw_params = self.model_params.get(str(self.current_model_id), self.high_quality_params)
-            assert torch is not None
+        try:
+            enhanced_prompts = [self._enhance_prompt_for_quality(prompt) for prompt in prompts]
+            seeds = [seed_for(prompt) for prompt in enhanced_prompts]
+            keys = [
+                self._pipeline_key(enhanced_prompt, HQ_NEGATIVE_PROMPT, seed, self.high_quality_params)
+                for enhanced_prompt, seed in zip(enhanced_prompts, seeds)
+            ]
 
-            with torch.no_grad():
-                result = self.pipeline(
-                    prompt=enhanced_prompt,
-                    negative_prompt=negative_prompt if "turbo" not in str(self.current_model_id).lower() else None,
-                    output_type="pil",
-                    height=int(raw_params.get("height", 512)),
-                    width=int(raw_params.get("width", 512)),
-                    num_inference_steps=int(raw_params.get("num_inference_steps", 25)),
-                    guidance_scale=float(raw_params.get("guidance_scale", 7.5)),
+            outputs: List[Optional[io.BytesIO]] = [None] * len(prompts)
+            for index, key in enumerate(keys if check_cache else []):
+                cached = generated_images.get(key)
+                if cached is not None:
+                    outputs[index] = io.BytesIO(cached)
+            missing = [index for index, output in enumerate(outputs) if output is None]
+            if len(missing) < len(prompts):
+                self.log_message(f"♻️ Из кеша: {len(prompts) - len(missing)} из {len(prompts)} изображений")
+
+            if missing:
+                for index in missing:
+                    self.log_message(f"🎨 Генерация HQ: {enhanced_prompts[index]}")
+                images = self._run_pipeline(
+                    [enhanced_prompts[index] for index in missing],
+                    HQ_NEGATIVE_PROMPT,
+                    self.high_quality_params,
+                    seeds=[seeds[index] for index in missing],
                 )
+                if len(images) != len(missing):
+                    # Иначе картинки сдвинутся и уйдут чужим задачам батча
+                    raise ValueError(f"Пайплайн вернул {len(images)} изображений вместо {len(missing)}")
+                for index, image in zip(missing, images):
+                    img_bytes = io.BytesIO()
+                    image.save(img_bytes, format='PNG', quality=100)
+                    outputs[index] = io.BytesIO(img_bytes.getvalue())
+
+                    if save_to_disk:
+                        self._store(keys[index], img_bytes.getvalue(), "HQ изображение")
+
+                if len(missing) > 1:
+                    self.log_message(f"✅ Батч из {len(missing)} изображений премиум-качества создан одним проходом")
+                else:
+                    self.log_message("✅ Изображение премиум-качества создано!")
+            if any(output is None for output in outputs):
+                raise ValueError("Не для всех промптов батча получено изображение")
+            return cast(List[io.BytesIO], outputs)
 
-                image = self._safe_extract_image(result)
-            
-            img_bytes = io.BytesIO()
-            image.save(img_bytes, format='PNG', quality=100)
-            img_bytes.seek(0)
-            
-            if save_to_disk:
-                filename = f"hq_{user_id}_{datetime.now().strftime('%H%M%S')}.png"
-                filepath = os.path.join(self.output_dir, filename)
-                image.save(filepath, format='PNG', quality=100)
-                self.log_message(f"💾 HQ изображение сохранено: {filepath}")
-            
-            self.log_message("✅ Изображение премиум-качества создано!")
-            return img_bytes
-            
         except Exception as e:
-            self.log_message(f"❌ Ошибка HQ генерации: {e}")
-            return self._create_error_image(f"Генерация не удалась: {str(e)[:100]}")
+            self.log_message(f"❌ Ошибка HQ генерации: {e}", level="ERROR")
+            return [self._create_error_image(f"Генерация не удалась: {str(e)[:100]}") for _ in prompts]
 
     def auto_generate(self, prompt: str, user_id: str, save_to_disk: bool = True) -> io.BytesIO:
         """Всегда использует режим максимального качества"""
@@ -447,38 +683,27 @@ class ImageGenerator:
                 "squirrel, rodent, rabbit, bear, monkey, deformed, ugly, "
                 "bad anatomy, disfigured, poor quality, extra limbs, mutation"
             )
+            seed = seed_for(enhanced_prompt)
+            key = self._pipeline_key(enhanced_prompt, negative_prompt, seed, self.standard_params)
+            cached = generated_images.get(key)
+            if cached is not None:
+                self.log_message("♻️ AI изображение из кеша")
+                return io.BytesIO(cached)
 
-            raw_params = self.model_params.get(str(self.current_model_id), self.standard_params)
-            assert torch is not None
-
-            with torch.no_grad():
-                result = self.pipeline(
-                    prompt=enhanced_prompt,
-                    negative_prompt=negative_prompt if "turbo" not in str(self.current_model_id).lower() else None,
-                    output_type="pil",
-                    height=int(raw_params.get("height", 512)),
-                    width=int(raw_params.get("width", 512)),
-                    num_inference_steps=int(raw_params.get("num_inference_steps", 20)),
-                    guidance_scale=float(raw_params.get("guidance_scale", 7.0)),
-                )
-                
-                image = self._safe_extract_image(result)
+            image = self._run_pipeline([enhanced_prompt], negative_prompt, self.standard_params, seeds=[seed])[0]
             
             img_bytes = io.BytesIO()
             image.save(img_bytes, format='PNG')
             img_bytes.seek(0)
             
             if save_to_disk:
-                filename = f"ai_{user_id}_{datetime.now().strftime('%H%M%S')}.png"
-                filepath = os.path.join(self.output_dir, filename)
-                image.save(filepath)
-                self.log_message(f"💾 Изображение сохранено: {filepath}")
+                self._store(key, img_bytes.getvalue(), "Изображение")
             
             self.log_message("✅ AI изображение создано!")
             return img_bytes
             
         except Exception as e:
-            self.log_message(f"❌ Ошибка AI генерации: {e}")
+            self.log_message(f"❌ Ошибка AI генерации: {e}", level="ERROR")
             self.log_message(f"🔍 Детали: {traceback.format_exc()}")
             return self.auto_generate(prompt, user_id, save_to_disk)
 
@@ -504,44 +729,36 @@ class ImageGenerator:
             
             negative_prompt = "deformed, ugly, bad anatomy, disfigured, poor quality, extra limbs"
             
-            raw_params = self.model_params.get(str(self.current_model_id), self.standard_params)
-            assert torch is not None
-
-            with torch.no_grad():
-                cross_attention_kwargs = None
-                if lora_style and lora_style in self.lora_adapters:
-                    cross_attention_kwargs = {"scale": lora_weight}
-                
-                result = self.pipeline(
-                    prompt=enhanced_prompt,
-                    negative_prompt=negative_prompt if "turbo" not in str(self.current_model_id).lower() else None,
-                    output_type="pil",
-                    height=int(raw_params.get("height", 512)),
-                    width=int(raw_params.get("width", 512)),
-                    num_inference_steps=int(raw_params.get("num_inference_steps", 20)),
-                    guidance_scale=float(raw_params.get("guidance_scale", 7.0)),
-                    cross_attention_kwargs=cross_attention_kwargs,
-                )
+            cross_attention_kwargs = None
+            if lora_style and lora_style in self.lora_adapters:
+                cross_attention_kwargs = {"scale": lora_weight}
+            seed = seed_for(enhanced_prompt)
+            key = self._pipeline_key(
+                enhanced_prompt, negative_prompt, seed, self.standard_params,
+                lora=lora_style if cross_attention_kwargs else None, lora_weight=lora_weight,
+            )
+            cached = generated_images.get(key)
+            if cached is not None:
+                self.log_message("♻️ Изображение с LoRA из кеша")
+                return io.BytesIO(cached)
 
-                image = self._safe_extract_image(result)
+            image = self._run_pipeline(
+                [enhanced_prompt], negative_prompt, self.standard_params, cross_attention_kwargs, seeds=[seed],
+            )[0]
             
             img_bytes = io.BytesIO()
             image.save(img_bytes, format='PNG')
             img_bytes.seek(0)
             
             if save_to_disk:
-                style_suffix = f"_{lora_style}" if lora_style else ""
-                filename = f"lora{style_suffix}_{user_id}_{datetime.now().strftime('%H%M%S')}.png"
-                filepath = os.path.join(self.output_dir, filename)
-                image.save(filepath)
-                self.log_message(f"💾 Изображение сохранено: {filepath}")
+                self._store(key, img_bytes.getvalue(), "Изображение")
             
             self.log_message("✅ Изображение с LoRA создано!")
             return img_bytes
             
         except Exception as e:
-            self.log_message(f"❌ Ошибка генерации с LoRA: {e}")
-            self.log_message(f"🔍 Детали ошибки: {traceback.format_exc()}")
+            self.log_message(f"❌ Ошибка генерации с LoRA: {e}", level="ERROR")
+            self.log_message(f"🔍 Детали ошибки: {traceback.format_exc()}", level="ERROR")
             return self.auto_generate(prompt, user_id, save_to_disk)
 
     def _auto_detect_lora_style(self, prompt: str) -> str:
@@ -628,16 +845,14 @@ class ImageGenerator:
             img_bytes.seek(0)
             
             if save_to_disk:
-                filename = f"{style.lower()}_{user_id}_{datetime.now().strftime('%H%M%S')}.png"
-                filepath = os.path.join(self.output_dir, filename)
-                img.save(filepath)
-                self.log_message(f"Изображение сохранено: {filepath}")
+                key = make_key(fallback=style, prompt=prompt, user_id=user_id, hq=False)
+                self._store(key, img_bytes.getvalue(), "Изображение")
             
             self.log_message(f"✅ Создано {style} изображение: {prompt}")
             return img_bytes
             
         except Exception as e:
-            self.log_message(f"Ошибка генерации {style}: {e}")
+            self.log_message(f"Ошибка генерации {style}: {e}", level="ERROR")
             return self._create_error_image(str(e))
 
     def _generate_styled_image_hq(self, prompt: str, user_id: str, style: str, color: tuple[int, int, int], save_to_disk: bool = True) -> io.BytesIO:
@@ -685,35 +900,33 @@ class ImageGenerator:
             img_bytes.seek(0)
             
             if save_to_disk:
-                filename = f"hq_{style.lower()}_{user_id}_{datetime.now().strftime('%H%M%S')}.png"
-                filepath = os.path.join(self.output_dir, filename)
-                img.save(filepath, format='PNG', optimize=True, quality=95)
-                self.log_message(f"💾 HQ изображение сохранено: {filepath}")
+                # На картинке время создания, поэтому из кеша её не отдаём — только учитываем в лимитах
+                key = make_key(fallback=style, prompt=prompt, user_id=user_id, hq=True)
+                self._store(key, img_bytes.getvalue(), "HQ изображение")
             
             self.log_message(f"✅ Создано HQ {style} изображение: {prompt}")
             return img_bytes
             
         except Exception as e:
-            self.log_message(f"❌ Ошибка HQ генерации {style}: {e}")
+            self.log_message(f"❌ Ошибка HQ генерации {style}: {e}", level="ERROR")
             return self._create_error_image(str(e))
 
-    def _safe_extract_image(self, result: Any) -> Image.Image:
-        """Безопасное извлечение и конвертация изображения в PIL"""
+    def _extract_images(self, result: Any, count: int) -> List[Image.Image]:
+        """Безопасное извлечение count изображений из результата и конвертация в PIL"""
         try:
             if hasattr(result, 'images') and result.images:
-                raw = result.images[0]
+                raw_images: List[Any] = list(result.images)
             elif isinstance(result, (list, tuple)) and result:
-                raw: Any = cast(Any, result[0])
+                raw_images = list(cast(Any, result))
             else:
                 raise ValueError("Не удалось извлечь изображение из результата")
+            if len(raw_images) < count:
+                raise ValueError(f"Пайплайн вернул {len(raw_images)} изображений вместо {count}")
             
-            if isinstance(raw, Image.Image):
-                return raw
-            
-            return self._convert_to_pil(raw)
+            return [raw if isinstance(raw, Image.Image) else self._convert_to_pil(raw) for raw in raw_images[:count]]
             
         except Exception as e:
-            self.log_message(f"❌ Ошибка при извлечении изображения: {e}")
+            self.log_message(f"❌ Ошибка при извлечении изображения: {e}", level="ERROR")
             raise
 
     def _convert_to_pil(self, image_data: Any) -> Image.Image:
@@ -757,13 +970,9 @@ class ImageGenerator:
         img_bytes.seek(0)
         return img_bytes
 
-    def log_message(self, text: str) -> None:
+    def log_message(self, text: str, level: str = "INFO") -> None:
         """Логирование сообщений"""
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - IMAGE_GENERATOR - {text}"
-        print(message)
-        with open('bot.log', 'a', encoding='utf-8') as f:
-            f.write(message + '\n')
+        log_message(text, prefix="IMAGE_GENERATOR", level=level)
 
 
 class LightImageGenerator:
@@ -787,15 +996,13 @@ class LightImageGenerator:
             img_bytes.seek(0)
             
             if save_to_disk:
-                filename = f"simple_{user_id}_{datetime.now().strftime('%H%M%S')}.png"
-                filepath = os.path.join(self.output_dir, filename)
-                img.save(filepath)
+                generated_images.put(make_key(fallback="simple", prompt=prompt, user_id=user_id), img_bytes.getvalue())
             
             self.log_message(f"✅ Создано простое изображение: {prompt}")
             return img_bytes
             
         except Exception as e:
-            self.log_message(f"Ошибка простой генерации: {e}")
+            self.log_message(f"Ошибка простой генерации: {e}", level="ERROR")
             return self._create_error_image(str(e))
 
     def _create_error_image(self, error_msg: str = ""):
@@ -811,7 +1018,5 @@ class LightImageGenerator:
         img_bytes.seek(0)
         return img_bytes
 
-    def log_message(self, text: str) -> None:
-        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
-        message = f"{timestamp} - LIGHT_GENERATOR - {text}"
-        print(message)
\ No newline at end of file
+    def log_message(self, text: str, level: str = "INFO") -> None:
+        log_message(text, prefix="LIGHT_GENERATOR", level=level)
\ No newline at end of file
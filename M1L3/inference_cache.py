@@ -0,0 +1,91 @@
+"""Кеш результатов инференса по file_unique_id фото Telegram.
+
+Пересланное или повторно отправленное фото имеет тот же file_unique_id,
+поэтому попадание в кеш пропускает и скачивание, и проход модели.
+"""
+from typing import Any, Dict, Hashable, Optional, Tuple
+from collections import OrderedDict
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_CACHE_MAX_ENTRIES: int = int(os.getenv("INFERENCE_CACHE_MAX_ENTRIES", "1024"))
+INFERENCE_CACHE_MAX_BYTES: int = int(os.getenv("INFERENCE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+INFERENCE_CACHE_STORE_IMAGES: bool = os.getenv("INFERENCE_CACHE_STORE_IMAGES", "1") == "1"
+
+CacheKey = Tuple[str, str, Tuple[Tuple[str, Hashable], ...]]
+
+
+def _entry_size(value: Any) -> int:
+    if isinstance(value, (bytes, bytearray)):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_entry_size(v) for v in value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_entry_size(v) for v in value)
+    return 0
+
+
+class InferenceCache:
+    """Ограниченный LRU по числу записей и по объёму хранимых байтов."""
+
+    def __init__(self, max_entries: int = INFERENCE_CACHE_MAX_ENTRIES, max_bytes: int = INFERENCE_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[CacheKey, Tuple[int, Any]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+    @staticmethod
+    def make_key(file_unique_id: str, model: str, **params: Any) -> CacheKey:
+        """Ключ: фото + модель + параметры инференса."""
+        normalized = tuple(
+            sorted((name, tuple(value) if isinstance(value, list) else value) for name, value in params.items())
+        )
+        return (file_unique_id, model, normalized)
+
+    def get(self, key: CacheKey) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def set(self, key: CacheKey, value: Any) -> None:
+        size = _entry_size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[0]
+            self._entries[key] = (size, value)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (evicted_size, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.stats['evictions'] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats['size'] = len(self._entries)
+        stats['bytes'] = self._bytes
+        return stats
+
+
+inference_cache = InferenceCache()
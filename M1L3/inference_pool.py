@@ -0,0 +1,131 @@
+"""Выделенные пулы потоков под тяжёлые задачи, чтобы инференс не блокировал цикл aiogram.
+
+У каждого класса нагрузки (детекция, классификация, диффузия, GIF) свой пул
+фиксированного размера и своя очередь. Переполненная очередь сразу отвечает
+PoolBusyError, а не копит запросы бесконечно.
+"""
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+import asyncio
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# (число потоков, сколько задач может ждать сверх занятых потоков)
+# Классификаторов два (TM и Ideogram) и у каждого свой лок, поэтому двумя потоками
+# /analyze гоняет их параллельно, а не друг за другом
+POOL_LIMITS: Dict[str, tuple[int, int]] = {
+    'detection': (int(os.getenv("DETECTION_WORKERS", "1")), int(os.getenv("DETECTION_QUEUE", "16"))),
+    'classification': (int(os.getenv("CLASSIFICATION_WORKERS", "2")), int(os.getenv("CLASSIFICATION_QUEUE", "16"))),
+    'diffusion': (int(os.getenv("DIFFUSION_WORKERS", "1")), int(os.getenv("DIFFUSION_QUEUE", "4"))),
+    'gif': (int(os.getenv("GIF_WORKERS", "2")), int(os.getenv("GIF_QUEUE", "8"))),
+}
+
+
+class PoolBusyError(RuntimeError):
+    """Очередь пула заполнена: задачу стоит отклонить, а не ждать."""
+
+    def __init__(self, pool: str):
+        super().__init__(f"Пул {pool} перегружен")
+        self.pool = pool
+
+
+class WorkloadPool:
+    """Пул потоков одного класса нагрузки с ограниченной очередью."""
+
+    def __init__(self, name: str, workers: int, max_queue: int):
+        self.name = name
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        self.stats: Dict[str, Any] = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'busy_time': 0.0,
+        }
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"pool-{self.name}")
+        return self._executor
+
+    @property
+    def capacity(self) -> int:
+        return self.workers + self.max_queue
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Занимает место в очереди пула или сразу бросает PoolBusyError.
+
+        Нужен, когда задача попадает в executor не напрямую, а через
+        промежуточный слой (например, микробатчер детектора).
+        """
+        if self.pending >= self.capacity:
+            self.stats['rejected'] += 1
+            raise PoolBusyError(self.name)
+        self.pending += 1
+        self.stats['submitted'] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.stats['failed'] += 1
+            raise
+        else:
+            self.stats['completed'] += 1
+        finally:
+            self.pending -= 1
+            self.stats['busy_time'] += time.perf_counter() - started
+
+    async def run(self, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Выполняет func в потоке пула, не блокируя цикл событий."""
+        with self.slot():
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats = dict(self.stats)
+        stats['workers'] = self.workers
+        stats['pending'] = self.pending
+        stats['capacity'] = self.capacity
+        return stats
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+class InferencePools:
+    """Набор пулов по именам классов нагрузки."""
+
+    def __init__(self, limits: Dict[str, tuple[int, int]] = POOL_LIMITS):
+        self._pools: Dict[str, WorkloadPool] = {
+            name: WorkloadPool(name, workers, max_queue) for name, (workers, max_queue) in limits.items()
+        }
+
+    def __getitem__(self, name: str) -> WorkloadPool:
+        return self._pools[name]
+
+    async def run(self, workload: str, func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        return await self._pools[workload].run(func, *args, **kwargs)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.get_stats() for name, pool in self._pools.items()}
+
+    def shutdown(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown()
+
+
+inference_pools = InferencePools()
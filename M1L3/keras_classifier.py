@@ -0,0 +1,150 @@
+"""Общий рантайм Keras-классификаторов 224×224 (Teachable Machine и Ideogram).
+
+Поиск модели, препроцессинг и инференс живут здесь; tm.py и ideogram.py
+отвечают только за загрузку своих моделей.
+"""
+from typing import Any, Callable, List, Optional, Sequence, Tuple, Union
+from archive_cache import MODEL_EXTENSIONS
+from photo_ingest import decode_photo
+from PIL import Image
+import numpy as np
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# Скомпилированный tf.function вместо model.predict: у predict большой фиксированный
+# оверхед (tf.data, колбэки, цикл по шагам), заметный при батче из одного кадра
+KERAS_DIRECT_CALL: bool = os.getenv("KERAS_DIRECT_CALL", "1") == "1"
+
+ImageInput = Union[bytes, Image.Image]
+
+
+def compile_forward(model: Any) -> Callable[[np.ndarray], Any]:
+    """Прямой вызов модели, обёрнутый один раз в tf.function.
+
+    Граф трассируется на первом вызове и переиспользуется; reduce_retracing
+    не даёт плодить трассировки под каждый размер батча. Модели не из Keras
+    (TFLite) вызываются как есть.
+    """
+    try:
+        import tensorflow as tf
+    except ImportError:
+        return lambda batch: model(batch, training=False)
+    if not isinstance(model, tf.keras.Model):
+        return lambda batch: model(batch, training=False)
+    return tf.function(lambda batch: model(batch, training=False), reduce_retracing=True)
+
+
+def find_model_file(root: str, saved_model: bool = False) -> Optional[str]:
+    """Файл модели Keras, а при saved_model=True — ещё и папка SavedModel."""
+    for directory, _, files in os.walk(root):
+        for file in files:
+            if file.endswith(MODEL_EXTENSIONS):
+                return os.path.join(directory, file)
+    if saved_model:
+        for directory, _, files in os.walk(root):
+            if 'saved_model.pb' in files:
+                return directory
+    return None
+
+
+class KerasClassifier:
+    """Инференс классификатора: батчи, переиспользуемый входной буфер и top-k."""
+
+    def __init__(self, input_size: Tuple[int, int] = (224, 224), direct_call: bool = KERAS_DIRECT_CALL):
+        self.input_size = input_size
+        self.direct_call = direct_call
+        self.model: Optional[Any] = None
+        self._compiled: Optional[Callable[[np.ndarray], Any]] = None
+        self.labels: List[str] = []
+        self._buffer: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+    def set_model(self, model: Any, labels: Sequence[str]) -> None:
+        self.model = model
+        self._compiled = compile_forward(model) if self.direct_call else None
+        self.labels = list(labels)
+
+    @property
+    def is_ready(self) -> bool:
+        return self.model is not None
+
+    def label_for(self, index: int) -> str:
+        return self.labels[index] if index < len(self.labels) else f"Класс {index}"
+
+    def _batch_buffer(self, size: int) -> np.ndarray:
+        """Входной тензор (size, H, W, 3); растёт по необходимости и не пересоздаётся на каждый вызов."""
+        if self._buffer is None or self._buffer.shape[0] < size:
+            width, height = self.input_size
+            self._buffer = np.empty((size, height, width, 3), dtype=np.float32)
+        return self._buffer[:size]
+
+    def _to_image(self, item: ImageInput) -> Image.Image:
+        if isinstance(item, Image.Image):
+            image = item.convert("RGB") if item.mode != "RGB" else item
+        else:
+            image = decode_photo(item, self.input_size)
+        if image.size != self.input_size:
+            image = image.resize(self.input_size, Image.Resampling.LANCZOS)
+        return image
+
+    def preprocess(self, items: Sequence[ImageInput]) -> np.ndarray:
+        """Отдельный (не разделяемый) входной тензор (N, H, W, 3) в диапазоне [0, 1]."""
+        width, height = self.input_size
+        batch = np.empty((len(items), height, width, 3), dtype=np.float32)
+        for index, item in enumerate(items):
+            batch[index] = np.asarray(self._to_image(item))
+        batch *= 1.0 / 255.0
+        return batch
+
+    def _forward(self, batch: np.ndarray) -> np.ndarray:
+        assert self.model is not None
+        if self._compiled is not None:
+            return np.asarray(self._compiled(batch))
+        return np.asarray(self.model.predict(batch, verbose=0))
+
+    def predict_proba(self, items: Sequence[ImageInput]) -> np.ndarray:
+        """Вероятности классов (N, C) для батча байтов или PIL-изображений."""
+        if self.model is None:
+            raise RuntimeError("Модель не загружена")
+        images = [self._to_image(item) for item in items]
+        with self._lock:
+            batch = self._batch_buffer(len(images))
+            for index, image in enumerate(images):
+                batch[index] = np.asarray(image)
+            batch *= 1.0 / 255.0
+            return self._forward(batch).copy()
+
+    def predict(self, items: Sequence[ImageInput]) -> List[Tuple[str, float]]:
+        """Top-1 (метка, уверенность) для каждого изображения батча."""
+        probabilities = self.predict_proba(items)
+        indices = probabilities.argmax(axis=1)
+        return [(self.label_for(int(i)), float(row[i])) for row, i in zip(probabilities, indices)]
+
+    def predict_prepared(self, batch: np.ndarray) -> List[Tuple[str, float]]:
+        """Top-1 для уже подготовленного тензора из preprocess(); его можно делить между моделями."""
+        if self.model is None:
+            raise RuntimeError("Модель не загружена")
+        with self._lock:
+            probabilities = self._forward(batch)
+        indices = probabilities.argmax(axis=1)
+        return [(self.label_for(int(i)), float(row[i])) for row, i in zip(probabilities, indices)]
+
+    def top_k(self, item: ImageInput, k: int = 3) -> List[Tuple[str, float]]:
+        """k самых вероятных классов одного изображения по убыванию уверенности."""
+        probabilities = self.predict_proba([item])[0]
+        k = min(k, probabilities.shape[0])
+        indices = np.argpartition(probabilities, -k)[-k:]
+        indices = indices[np.argsort(probabilities[indices])[::-1]]
+        return [(self.label_for(int(i)), float(probabilities[i])) for i in indices]
+
+    def warmup(self) -> None:
+        """Прогон нулевого батча: строит граф и выделяет входной буфер."""
+        if self.model is None:
+            return
+        with self._lock:
+            batch = self._batch_buffer(1)
+            batch.fill(0.0)
+            self._forward(batch)
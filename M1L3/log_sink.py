@@ -0,0 +1,191 @@
+"""Общий неблокирующий лог-синк для всех модулей бота.
+
+Записи кладутся в очередь, а отдельный поток пишет их в bot.log пачками,
+поэтому вызов log_message из event loop или из executor-потоков не
+делает синхронного I/O и строки разных потоков не перемешиваются.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+import threading
+import atexit
+import queue
+import time
+import os
+
+LEVELS: Dict[str, int] = {
+    "DEBUG": 10,
+    "INFO": 20,
+    "WARNING": 30,
+    "ERROR": 40,
+}
+
+LOG_FILE: str = os.getenv("BOT_LOG_FILE", "bot.log")
+LOG_LEVEL: str = os.getenv("BOT_LOG_LEVEL", "INFO").upper()
+LOG_MAX_BYTES: int = int(os.getenv("BOT_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT: int = int(os.getenv("BOT_LOG_BACKUP_COUNT", "3"))
+LOG_FLUSH_INTERVAL: float = float(os.getenv("BOT_LOG_FLUSH_INTERVAL", "0.5"))
+LOG_BATCH_SIZE: int = int(os.getenv("BOT_LOG_BATCH_SIZE", "256"))
+LOG_QUEUE_SIZE: int = int(os.getenv("BOT_LOG_QUEUE_SIZE", "10000"))
+
+_STOP = object()
+
+
+class LogSink:
+    """Очередь + фоновый писатель с пакетной записью и ротацией по размеру."""
+
+    def __init__(
+        self,
+        path: str = LOG_FILE,
+        level: str = LOG_LEVEL,
+        max_bytes: int = LOG_MAX_BYTES,
+        backup_count: int = LOG_BACKUP_COUNT,
+        flush_interval: float = LOG_FLUSH_INTERVAL,
+        batch_size: int = LOG_BATCH_SIZE,
+        queue_size: int = LOG_QUEUE_SIZE,
+    ):
+        self.path = path
+        self.level = LEVELS.get(level.upper(), LEVELS["INFO"])
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        # emit вызывается из многих потоков, запись — из фонового; счётчики общие
+        self._stats_lock = threading.Lock()
+        self._file: Optional[Any] = None
+        self._size = 0
+        self.stats: Dict[str, Any] = {
+            'written': 0,
+            'dropped': 0,
+            'batches': 0,
+            'rotations': 0,
+            'write_time_total': 0.0,
+            'write_time_max': 0.0,
+        }
+
+    def _ensure_started(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-sink", daemon=True)
+                self._thread.start()
+
+    def emit(self, text: str, level: str = "INFO", prefix: Optional[str] = None, echo: bool = True) -> None:
+        """Ставит запись в очередь. Никогда не блокирует вызывающий код."""
+        if LEVELS.get(level, LEVELS["INFO"]) < self.level:
+            return
+        self._ensure_started()
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        message = f"{timestamp} - {prefix} - {text}" if prefix else f"{timestamp} - {text}"
+        try:
+            self._queue.put_nowait((message, echo))
+        except queue.Full:
+            with self._stats_lock:
+                self.stats['dropped'] += 1
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._size = self._file.tell()
+
+    def _rotate(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for index in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{index}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        with self._stats_lock:
+            self.stats['rotations'] += 1
+        self._open()
+
+    def _write_batch(self, batch: List[Tuple[str, bool]]) -> None:
+        started = time.perf_counter()
+        if self._file is None:
+            self._open()
+        assert self._file is not None
+        data = ''.join(f"{message}\n" for message, _ in batch)
+        for message, echo in batch:
+            if echo:
+                print(message)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data.encode('utf-8'))
+        if self.max_bytes > 0 and self._size >= self.max_bytes:
+            self._rotate()
+        elapsed = time.perf_counter() - started
+        with self._stats_lock:
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['write_time_total'] += elapsed
+            self.stats['write_time_max'] = max(self.stats['write_time_max'], elapsed)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            batch: List[Tuple[str, bool]] = []
+            stop = item is _STOP
+            if not stop:
+                batch.append(item)
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except Exception as e:
+                    print(f"Ошибка записи лога: {e}")
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Дописывает очередь и останавливает фоновый поток."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._queue.put(_STOP)
+        thread.join(timeout)
+        if thread.is_alive():
+            # Поток ещё пишет: второй писатель на тот же файл и очередь запускать нельзя
+            print(f"⚠️ Поток записи лога не остановился за {timeout:.0f} с")
+            return
+        self._thread = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика записи: количество строк, пачек и время записи."""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        batches = stats['batches']
+        stats['write_time_avg'] = stats['write_time_total'] / batches if batches else 0.0
+        stats['queued'] = self._queue.qsize()
+        return stats
+
+
+sink = LogSink()
+atexit.register(sink.close)
+
+
+def log_message(text: str, prefix: Optional[str] = None, level: str = "INFO", echo: bool = True) -> None:
+    """Логирование сообщений через общий синк"""
+    sink.emit(text, level=level, prefix=prefix, echo=echo)
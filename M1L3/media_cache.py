@@ -0,0 +1,194 @@
+"""Кеш file_id исходящих медиа: повторная отправка без загрузки байтов.
+
+Ключ — хеш локального файла или URL, значение — file_id, который Telegram
+вернул при первой отправке. file_id привязан к боту, поэтому у каждого
+токена должен быть свой файл кеша.
+"""
+from typing import Any, Dict, Optional, Tuple, Union
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile, InputFile, Message
+from collections import OrderedDict
+import threading
+import hashlib
+import asyncio
+import logging
+import sqlite3
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_DB: str = os.getenv("MEDIA_CACHE_DB", "data/media_cache.sqlite")
+MEDIA_CACHE_MAX_ENTRIES: int = int(os.getenv("MEDIA_CACHE_MAX_ENTRIES", "5000"))
+
+
+class MediaCache:
+    """Постоянное отображение ключ → Telegram file_id с LRU-вытеснением."""
+
+    def __init__(self, db_path: str = MEDIA_CACHE_DB, max_entries: int = MEDIA_CACHE_MAX_ENTRIES):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._file_hashes: Dict[str, Tuple[int, float, str]] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'invalidations': 0,
+        }
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS media ("
+            "key TEXT PRIMARY KEY, file_id TEXT, last_used REAL)"
+        )
+        return db
+
+    def _ensure_loaded(self) -> None:
+        if self._loaded:
+            return
+        with self._lock:
+            if self._loaded:
+                return
+            if os.path.exists(self.db_path):
+                db = self._connect()
+                try:
+                    for key, file_id in db.execute("SELECT key, file_id FROM media ORDER BY last_used"):
+                        self._entries[key] = file_id
+                finally:
+                    db.close()
+            self._loaded = True
+
+    async def aensure_loaded(self) -> None:
+        """Первое чтение базы — синхронный SQLite, поэтому вне event loop."""
+        if not self._loaded:
+            await asyncio.to_thread(self._ensure_loaded)
+
+    @staticmethod
+    def key_for_url(url: str) -> str:
+        return f"url:{url}"
+
+    def key_for_file(self, path: str) -> str:
+        """Ключ по SHA-256 содержимого; хеш пересчитывается только при изменении файла."""
+        stat = os.stat(path)
+        cached = self._file_hashes.get(path)
+        if cached is not None and cached[0] == stat.st_size and cached[1] == stat.st_mtime:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        key = f"file:{digest.hexdigest()}"
+        self._file_hashes[path] = (stat.st_size, stat.st_mtime, key)
+        return key
+
+    def get(self, key: str) -> Optional[str]:
+        self._ensure_loaded()
+        with self._lock:
+            file_id = self._entries.get(key)
+            if file_id is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return file_id
+
+    def touch(self, key: str) -> None:
+        """Сохраняет время использования, чтобы порядок LRU пережил перезапуск."""
+        with self._lock:
+            db = self._connect()
+            try:
+                db.execute("UPDATE media SET last_used = ? WHERE key = ?", (time.time(), key))
+                db.commit()
+            finally:
+                db.close()
+
+    def set(self, key: str, file_id: str) -> None:
+        self._ensure_loaded()
+        with self._lock:
+            self._entries[key] = file_id
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+                self.stats['evictions'] += 1
+            db = self._connect()
+            try:
+                db.execute(
+                    "INSERT OR REPLACE INTO media (key, file_id, last_used) VALUES (?, ?, ?)",
+                    (key, file_id, time.time()),
+                )
+                db.executemany("DELETE FROM media WHERE key = ?", [(k,) for k in evicted])
+                db.commit()
+            finally:
+                db.close()
+
+    def invalidate(self, key: str) -> None:
+        """Удаляет запись, например если Telegram перестал принимать file_id."""
+        self._ensure_loaded()
+        with self._lock:
+            self._entries.pop(key, None)
+            self.stats['invalidations'] += 1
+            db = self._connect()
+            try:
+                db.execute("DELETE FROM media WHERE key = ?", (key,))
+                db.commit()
+            finally:
+                db.close()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._file_hashes.clear()
+            db = self._connect()
+            try:
+                db.execute("DELETE FROM media")
+                db.commit()
+            finally:
+                db.close()
+
+
+media_cache = MediaCache()
+
+
+async def answer_photo_cached(
+    message: Message,
+    key: str,
+    photo: Union[InputFile, str],
+    **kwargs: Any,
+) -> Message:
+    """Отправляет фото, подставляя закешированный file_id вместо загрузки.
+
+    photo используется при промахе или если Telegram отклонил старый file_id.
+    """
+    await media_cache.aensure_loaded()
+    file_id = media_cache.get(key)
+    if file_id is not None:
+        try:
+            sent = await message.answer_photo(file_id, **kwargs)
+            await asyncio.to_thread(media_cache.touch, key)
+            return sent
+        except TelegramBadRequest as e:
+            logger.warning(f"file_id для {key} отклонён, отправляю заново: {e}")
+            await asyncio.to_thread(media_cache.invalidate, key)
+    sent = await message.answer_photo(photo, **kwargs)
+    if sent.photo:
+        await asyncio.to_thread(media_cache.set, key, sent.photo[-1].file_id)
+    return sent
+
+
+async def answer_photo_url_cached(message: Message, url: str, **kwargs: Any) -> Message:
+    """answer_photo по URL с кешированием file_id."""
+    return await answer_photo_cached(message, MediaCache.key_for_url(url), url, **kwargs)
+
+
+async def answer_photo_file_cached(message: Message, path: str, **kwargs: Any) -> Message:
+    """answer_photo локального файла с кешированием file_id по хешу содержимого."""
+    key = await asyncio.to_thread(media_cache.key_for_file, path)
+    return await answer_photo_cached(message, key, FSInputFile(path), **kwargs)
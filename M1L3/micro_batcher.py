@@ -0,0 +1,105 @@
+"""Микробатчинг: объединяет одновременные запросы инференса в один вызов модели."""
+from typing import Any, Callable, Dict, Generic, Hashable, List, Optional, Set, Tuple, TypeVar
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+BatchRunner = Callable[[Hashable, List[T]], List[Any]]
+
+
+class MicroBatcher(Generic[T, R]):
+    """Копит запросы с одинаковым ключом в течение окна или до max_batch и
+    выполняет их одним вызовом run_batch в executor.
+
+    run_batch(key, items) возвращает список той же длины; элемент-исключение
+    отдаётся только своему запросу, остальные получают результат.
+    """
+
+    def __init__(
+        self,
+        run_batch: BatchRunner[T],
+        window: float = 0.02,
+        max_batch: int = 8,
+        executor: Optional[Any] = None,
+        name: str = "batcher",
+    ):
+        self.run_batch = run_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = executor
+        self.name = name
+        self._pending: Dict[Hashable, List[Tuple[T, "asyncio.Future[R]", float]]] = {}
+        self._timers: Dict[Hashable, asyncio.TimerHandle] = {}
+        self._running: Set["asyncio.Task[None]"] = set()
+        self.stats: Dict[str, Any] = {
+            'requests': 0,
+            'batches': 0,
+            'max_batch_size': 0,
+            'wait_total': 0.0,
+            'wait_max': 0.0,
+        }
+
+    async def submit(self, key: Hashable, item: T) -> R:
+        """Ставит запрос в текущий батч и ждёт его результат."""
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[R]" = loop.create_future()
+        pending = self._pending.setdefault(key, [])
+        pending.append((item, future, time.perf_counter()))
+        self.stats['requests'] += 1
+        if len(pending) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.window, self._flush, key)
+        return await future
+
+    def _flush(self, key: Hashable) -> None:
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if not batch:
+            return
+        task = asyncio.create_task(self._run(key, batch))
+        self._running.add(task)
+        task.add_done_callback(self._running.discard)
+
+    async def _run(self, key: Hashable, batch: List[Tuple[T, "asyncio.Future[R]", float]]) -> None:
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            wait = started - enqueued
+            self.stats['wait_total'] += wait
+            self.stats['wait_max'] = max(self.stats['wait_max'], wait)
+        self.stats['batches'] += 1
+        self.stats['max_batch_size'] = max(self.stats['max_batch_size'], len(batch))
+
+        items = [item for item, _, _ in batch]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor, self.run_batch, key, items)
+        except Exception as e:
+            logger.error(f"{self.name}: ошибка батча из {len(batch)}: {e}")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Размеры батчей и время ожидания в очереди."""
+        stats = dict(self.stats)
+        stats['avg_batch_size'] = stats['requests'] / stats['batches'] if stats['batches'] else 0.0
+        stats['avg_wait'] = stats['wait_total'] / stats['requests'] if stats['requests'] else 0.0
+        stats['queued'] = sum(len(items) for items in self._pending.values())
+        return stats
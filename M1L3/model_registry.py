@@ -0,0 +1,223 @@
+"""Реестр тяжёлых моделей: ленивая загрузка, фоновый прогрев и состояния готовности."""
+from typing import Any, Callable, Dict, Iterable, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from log_sink import log_message
+from enum import Enum
+import threading
+import asyncio
+import logging
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+STARTUP_WORKERS: int = int(os.getenv("STARTUP_WORKERS", "4"))
+STARTUP_REPORT_PATH: str = os.getenv("STARTUP_REPORT_PATH", "data/startup_report.json")
+
+
+def rss_bytes() -> Optional[int]:
+    """Текущий RSS процесса: psutil, иначе /proc/self/statm; None, если узнать нельзя.
+
+    Пиковый RSS (resource.ru_maxrss) не подходит: разность пиков — не прирост памяти.
+    """
+    try:
+        import psutil
+        return int(psutil.Process().memory_info().rss)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ModelState(str, Enum):
+    COLD = "cold"
+    LOADING = "loading"
+    READY = "ready"
+    FAILED = "failed"
+
+
+class ModelEntry:
+    """Описание модели в реестре и её текущее состояние."""
+
+    def __init__(self, name: str, loader: Callable[[], Any], title: str, warmup: Optional[Callable[[Any], Any]] = None):
+        self.name = name
+        self.loader = loader
+        self.title = title
+        self.warmup = warmup
+        self.state = ModelState.COLD
+        self.instance: Optional[Any] = None
+        self.error: Optional[str] = None
+        self.load_time: Optional[float] = None
+        self.warmup_time: Optional[float] = None
+        self.memory_delta: Optional[int] = None
+        # Во время загрузки грузились и другие модели: прирост RSS включает и их память
+        self.memory_shared = False
+        self.task: Optional["asyncio.Task[Any]"] = None
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'state': self.state.value,
+            'load_s': round(self.load_time, 3) if self.load_time is not None else None,
+            'warmup_s': round(self.warmup_time, 3) if self.warmup_time is not None else None,
+            'memory_delta_mb': round(self.memory_delta / 2**20, 1) if self.memory_delta is not None else None,
+            'memory_shared': self.memory_shared,
+            'error': self.error,
+        }
+
+
+class ModelRegistry:
+    """Модели объявляются заранее, а создаются при первом обращении или прогреве."""
+
+    def __init__(self, max_workers: int = STARTUP_WORKERS):
+        self._entries: Dict[str, ModelEntry] = {}
+        self.max_workers = max_workers
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._loading = 0
+        self._loading_lock = threading.Lock()
+
+    def register(
+        self,
+        name: str,
+        loader: Callable[[], Any],
+        title: Optional[str] = None,
+        warmup: Optional[Callable[[Any], Any]] = None,
+    ) -> None:
+        """Объявляет модель. loader выполняется в отдельном потоке и возвращает готовый объект,
+        warmup делает пробный инференс, чтобы заранее скомпилировать граф и выделить память."""
+        self._entries[name] = ModelEntry(name, loader, title or name, warmup)
+
+    def entry(self, name: str) -> ModelEntry:
+        return self._entries[name]
+
+    def state(self, name: str) -> ModelState:
+        return self._entries[name].state
+
+    def get(self, name: str) -> Optional[Any]:
+        """Готовый объект модели или None, если она ещё не загружена."""
+        entry = self._entries[name]
+        return entry.instance if entry.state is ModelState.READY else None
+
+    def _load_sync(self, entry: ModelEntry) -> Any:
+        with self._loading_lock:
+            self._loading += 1
+            entry.memory_shared = self._loading > 1
+        try:
+            return self._load_measured(entry)
+        finally:
+            with self._loading_lock:
+                self._loading -= 1
+
+    def _load_measured(self, entry: ModelEntry) -> Any:
+        rss_before = rss_bytes()
+        started = time.perf_counter()
+        instance = entry.loader()
+        entry.load_time = time.perf_counter() - started
+        if entry.warmup is not None:
+            started = time.perf_counter()
+            try:
+                entry.warmup(instance)
+            except Exception as e:
+                log_message(f"⚠️ Прогрев {entry.title} не удался: {e}", level="WARNING")
+            entry.warmup_time = time.perf_counter() - started
+        rss_after = rss_bytes()
+        with self._loading_lock:
+            entry.memory_shared = entry.memory_shared or self._loading > 1
+        if rss_before is not None and rss_after is not None:
+            entry.memory_delta = rss_after - rss_before
+        return instance
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="model-load")
+        return self._executor
+
+    async def _load(self, entry: ModelEntry) -> Any:
+        entry.state = ModelState.LOADING
+        log_message(f"Загрузка модели {entry.title}...")
+        try:
+            loop = asyncio.get_running_loop()
+            instance = await loop.run_in_executor(self._get_executor(), self._load_sync, entry)
+        except Exception as e:
+            entry.state = ModelState.FAILED
+            entry.error = str(e)
+            log_message(f"❌ Модель {entry.title} не загружена: {e}", level="ERROR")
+            raise
+        entry.instance = instance
+        entry.error = None
+        entry.state = ModelState.READY
+        log_message(f"✅ Модель {entry.title} готова за {entry.load_time:.1f} с")
+        return instance
+
+    def start_loading(self, name: str) -> "asyncio.Task[Any]":
+        """Запускает загрузку в фоне, если она ещё не идёт. Повторный вызов возвращает ту же задачу."""
+        entry = self._entries[name]
+        if entry.task is None or (entry.task.done() and entry.state is not ModelState.READY):
+            entry.task = asyncio.create_task(self._load(entry))
+            entry.task.add_done_callback(self._consume_error)
+        return entry.task
+
+    @staticmethod
+    def _consume_error(task: "asyncio.Task[Any]") -> None:
+        if not task.cancelled():
+            task.exception()
+
+    async def ensure(self, name: str) -> Any:
+        """Ждёт загрузки модели и возвращает её объект."""
+        entry = self._entries[name]
+        if entry.state is ModelState.READY:
+            return entry.instance
+        return await asyncio.shield(self.start_loading(name))
+
+    def warmup_in_background(self, names: Optional[Iterable[str]] = None) -> None:
+        """Ставит в фоновую загрузку все (или перечисленные) холодные модели."""
+        for name in names or list(self._entries):
+            if self._entries[name].state is ModelState.COLD:
+                self.start_loading(name)
+
+    async def warmup_all(self, names: Optional[Iterable[str]] = None, report_path: Optional[str] = STARTUP_REPORT_PATH) -> Dict[str, Any]:
+        """Параллельно загружает и прогревает модели, возвращает отчёт по компонентам.
+
+        Прирост памяти меряется по текущему RSS всего процесса, поэтому у моделей,
+        грузившихся одновременно, он пересекается — такие помечены memory_shared.
+        """
+        selected = list(names or self._entries)
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(self.ensure(name) for name in selected if self._entries[name].state is not ModelState.FAILED),
+            return_exceptions=True,
+        )
+        components: List[Dict[str, Any]] = [self._entries[name].report() for name in selected]
+        report: Dict[str, Any] = {
+            'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'workers': self.max_workers,
+            'total_s': round(time.perf_counter() - started, 3),
+            'components': components,
+        }
+        log_message(f"Отчёт прогрева: {json.dumps(report, ensure_ascii=False)}")
+        if report_path:
+            try:
+                directory = os.path.dirname(report_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(report_path, 'w', encoding='utf-8') as f:
+                    json.dump(report, f, ensure_ascii=False, indent=2)
+            except Exception as e:
+                logger.warning(f"Не удалось сохранить отчёт прогрева: {e}")
+        return report
+
+    def status(self) -> Dict[str, str]:
+        return {name: entry.state.value for name, entry in self._entries.items()}
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+models = ModelRegistry()
@@ -0,0 +1,92 @@
+"""Общая загрузка фото из Telegram для всех команд с картинками.
+
+Telegram хранит каждое фото в нескольких размерах. Берём самый маленький,
+которого хватает потребителю (классификатору нужно 224, детектору — imgsz,
+GIF — 400), скачиваем потоком с ограничением размера и декодируем JPEG
+сразу в уменьшенном виде через draft-режим.
+"""
+from typing import Optional, Sequence, Tuple
+from aiogram.types import PhotoSize
+from aiogram import Bot
+from PIL import Image
+import logging
+import io
+import os
+
+logger = logging.getLogger(__name__)
+
+PHOTO_MAX_BYTES: int = int(os.getenv("PHOTO_MAX_BYTES", str(10 * 1024 * 1024)))
+PHOTO_CHUNK_SIZE: int = int(os.getenv("PHOTO_CHUNK_SIZE", str(64 * 1024)))
+PHOTO_DOWNLOAD_TIMEOUT: int = int(os.getenv("PHOTO_DOWNLOAD_TIMEOUT", "30"))
+
+
+class PhotoDownloadError(RuntimeError):
+    """Фото не удалось получить; текст ошибки можно показать пользователю."""
+
+
+def pick_photo_size(sizes: Sequence[PhotoSize], min_side: int = 0, max_side: int = 0) -> PhotoSize:
+    """Самый маленький вариант, у которого короткая сторона ≥ min_side и длинная ≥ max_side.
+
+    min_side — для моделей, растягивающих кадр в квадрат (224×224),
+    max_side — для letterbox и уменьшения по длинной стороне.
+    Если ни один вариант не дотягивает, возвращается самый большой.
+    """
+    if not sizes:
+        raise PhotoDownloadError("В сообщении нет фото")
+    ordered = sorted(sizes, key=lambda size: size.width * size.height)
+    for size in ordered:
+        if min(size.width, size.height) >= min_side and max(size.width, size.height) >= max_side:
+            return size
+    return ordered[-1]
+
+
+async def download_photo(bot: Bot, photo: PhotoSize, max_bytes: int = PHOTO_MAX_BYTES) -> bytes:
+    """Скачивает фото потоком в буфер и обрывает загрузку, если оно больше max_bytes."""
+    if photo.file_size is not None and photo.file_size > max_bytes:
+        raise PhotoDownloadError(f"Фото слишком большое ({photo.file_size // 1024} КБ)")
+    file = await bot.get_file(photo.file_id)
+    if file.file_path is None:
+        raise PhotoDownloadError("Путь к файлу отсутствует")
+    if file.file_size is not None and file.file_size > max_bytes:
+        raise PhotoDownloadError(f"Фото слишком большое ({file.file_size // 1024} КБ)")
+
+    if bot.session.api.is_local:
+        with open(file.file_path, 'rb') as f:
+            data = f.read(max_bytes + 1)
+        if len(data) > max_bytes:
+            raise PhotoDownloadError("Фото слишком большое")
+        return data
+
+    buffer = io.BytesIO()
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(
+        url=url, timeout=PHOTO_DOWNLOAD_TIMEOUT, chunk_size=PHOTO_CHUNK_SIZE, raise_for_status=True,
+    ):
+        buffer.write(chunk)
+        if buffer.tell() > max_bytes:
+            raise PhotoDownloadError("Фото слишком большое")
+    if buffer.tell() == 0:
+        raise PhotoDownloadError("Не удалось скачать файл")
+    return buffer.getvalue()
+
+
+async def fetch_photo(
+    bot: Bot,
+    sizes: Sequence[PhotoSize],
+    min_side: int = 0,
+    max_side: int = 0,
+    max_bytes: int = PHOTO_MAX_BYTES,
+) -> bytes:
+    """Выбирает подходящий размер фото и скачивает его."""
+    photo = pick_photo_size(sizes, min_side=min_side, max_side=max_side)
+    logger.debug(f"Выбран вариант фото {photo.width}×{photo.height} из {len(sizes)}")
+    return await download_photo(bot, photo, max_bytes=max_bytes)
+
+
+def decode_photo(data: bytes, target: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """Декодирует фото в RGB. Для JPEG с target декодер сразу уменьшает кадр
+    в 2/4/8 раз, но не меньше target, — это дешевле полного декодирования и resize."""
+    image = Image.open(io.BytesIO(data))
+    if target is not None and image.format == "JPEG":
+        image.draft("RGB", target)
+    return image.convert("RGB")
@@ -0,0 +1,259 @@
+"""Локальный Pokédex: компактный SQLite-снимок PokeAPI с нечётким поиском по имени.
+
+Сборка снимка:
+    python pokedex.py --dump ./api-data/data/api/v2/pokemon
+    python pokedex.py --fetch 1 1025
+"""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import threading
+import argparse
+import difflib
+import asyncio
+import logging
+import sqlite3
+import random
+import json
+import os
+
+logger = logging.getLogger(__name__)
+
+POKEDEX_DB: str = os.getenv("POKEDEX_DB", "data/pokedex.sqlite")
+POKEDEX_FUZZY_CUTOFF: float = float(os.getenv("POKEDEX_FUZZY_CUTOFF", "0.75"))
+POKEDEX_FETCH_CONCURRENCY: int = int(os.getenv("POKEDEX_FETCH_CONCURRENCY", "8"))
+# Последний номер, который бот запрашивает; снимок полон, когда в нём есть все 1..POKEDEX_MAX_ID
+POKEDEX_MAX_ID: int = int(os.getenv("POKEDEX_MAX_ID", "1010"))
+
+
+def normalize_name(name: str) -> str:
+    """Приводит имя к виду PokeAPI: нижний регистр, дефисы вместо пробелов."""
+    return '-'.join(name.strip().lower().replace('_', ' ').split())
+
+
+def slim_pokemon(data: Dict[str, Any]) -> Dict[str, Any]:
+    """Оставляет из ответа PokeAPI только поля, нужные format_pokemon_result."""
+    artwork = (
+        data.get('sprites', {}).get('other', {}).get('official-artwork', {}).get('front_default')
+    )
+    return {
+        'id': data['id'],
+        'name': data['name'],
+        'height': data['height'],
+        'weight': data['weight'],
+        'types': [t['type']['name'] for t in data.get('types', [])],
+        'abilities': [a['ability']['name'] for a in data.get('abilities', [])],
+        'stats': {s['stat']['name']: s['base_stat'] for s in data.get('stats', [])},
+        'artwork': artwork,
+    }
+
+
+def expand_pokemon(record: Dict[str, Any]) -> Dict[str, Any]:
+    """Восстанавливает структуру ответа PokeAPI из компактной записи."""
+    return {
+        'id': record['id'],
+        'name': record['name'],
+        'height': record['height'],
+        'weight': record['weight'],
+        'types': [{'type': {'name': name}} for name in record['types']],
+        'abilities': [{'ability': {'name': name}} for name in record['abilities']],
+        'stats': [{'stat': {'name': name}, 'base_stat': value} for name, value in record['stats'].items()],
+        'sprites': {'other': {'official-artwork': {'front_default': record['artwork']}}},
+    }
+
+
+class PokedexStore:
+    """Снимок в SQLite, индексы по имени и номеру держатся в памяти."""
+
+    def __init__(self, db_path: str = POKEDEX_DB):
+        self.db_path = db_path
+        self._by_id: Dict[int, Dict[str, Any]] = {}
+        self._by_name: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._loaded = False
+        # Результаты is_complete по last; сбрасываются, когда в индексе появляется новый номер
+        self._complete: Dict[int, bool] = {}
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS pokemon ("
+            "id INTEGER PRIMARY KEY, name TEXT UNIQUE, record TEXT)"
+        )
+        return db
+
+    def load(self) -> int:
+        """Загружает снимок с диска в память. Возвращает число записей."""
+        with self._lock:
+            if self._loaded:
+                return len(self._by_id)
+            if not os.path.exists(self.db_path):
+                self._loaded = True
+                return 0
+            db = self._connect()
+            try:
+                for row in db.execute("SELECT record FROM pokemon"):
+                    self._index(json.loads(row[0]))
+            finally:
+                db.close()
+            self._loaded = True
+            logger.info(f"Pokédex загружен: {len(self._by_id)} покемонов")
+            return len(self._by_id)
+
+    def _ensure_loaded(self) -> None:
+        if not self._loaded:
+            self.load()
+
+    async def aensure_loaded(self) -> None:
+        """Первая загрузка снимка — чтение всей базы, поэтому вне event loop."""
+        if not self._loaded:
+            await asyncio.to_thread(self.load)
+
+    def is_complete(self, last: int = POKEDEX_MAX_ID) -> bool:
+        """Есть ли в снимке все номера 1..last; полный обход — только после изменения индекса."""
+        self._ensure_loaded()
+        complete = self._complete.get(last)
+        if complete is None:
+            complete = len(self._by_id) >= last and all(pokemon_id in self._by_id for pokemon_id in range(1, last + 1))
+            self._complete[last] = complete
+        return complete
+
+    def _index(self, record: Dict[str, Any]) -> None:
+        if record['id'] not in self._by_id:
+            self._complete.clear()
+        self._by_id[record['id']] = record
+        self._by_name[record['name']] = record['id']
+
+    def add_many(self, records: Iterable[Dict[str, Any]]) -> int:
+        """Сохраняет компактные записи на диск и в индекс."""
+        records = list(records)
+        if not records:
+            return 0
+        with self._lock:
+            db = self._connect()
+            try:
+                db.executemany(
+                    "INSERT OR REPLACE INTO pokemon (id, name, record) VALUES (?, ?, ?)",
+                    [(r['id'], r['name'], json.dumps(r, ensure_ascii=False)) for r in records],
+                )
+                db.commit()
+            finally:
+                db.close()
+            for record in records:
+                self._index(record)
+        return len(records)
+
+    def add(self, data: Dict[str, Any]) -> None:
+        """Сохраняет полный ответ PokeAPI в компактном виде."""
+        self.add_many([slim_pokemon(data)])
+
+    def lookup(self, query: str, fuzzy: bool = True) -> Optional[Dict[str, Any]]:
+        """Ищет покемона по номеру, точному имени или с опечаткой.
+
+        Нечёткий поиск по неполному снимку находит соседа вместо нужного
+        (kabutops → kabuto), поэтому при fuzzy=False ищется только точное имя.
+        """
+        self._ensure_loaded()
+        name = normalize_name(query)
+        if name.isdigit():
+            record = self._by_id.get(int(name))
+        else:
+            pokemon_id = self._by_name.get(name)
+            if pokemon_id is None and fuzzy:
+                matches = difflib.get_close_matches(name, self._by_name.keys(), n=1, cutoff=POKEDEX_FUZZY_CUTOFF)
+                if matches:
+                    logger.info(f"Pokédex: '{query}' исправлено на '{matches[0]}'")
+                    pokemon_id = self._by_name[matches[0]]
+            record = self._by_id.get(pokemon_id) if pokemon_id is not None else None
+        return expand_pokemon(record) if record else None
+
+    def random(self, last: int = POKEDEX_MAX_ID) -> Tuple[int, Optional[Dict[str, Any]]]:
+        """Случайный номер из 1..last и его запись из снимка, если она есть.
+
+        Номер выбирается по всему диапазону, а не из снимка: иначе частично
+        заполненный снимок отдавал бы одних и тех же покемонов.
+        """
+        self._ensure_loaded()
+        pokemon_id = random.randint(1, last)
+        record = self._by_id.get(pokemon_id)
+        return pokemon_id, expand_pokemon(record) if record else None
+
+    def missing_ids(self, first: int, last: int) -> List[int]:
+        """Номера из диапазона, которых ещё нет в снимке."""
+        self._ensure_loaded()
+        return [pokemon_id for pokemon_id in range(first, last + 1) if pokemon_id not in self._by_id]
+
+    def __len__(self) -> int:
+        self._ensure_loaded()
+        return len(self._by_id)
+
+
+def import_dump(store: PokedexStore, path: str) -> int:
+    """Импортирует дамп PokeAPI: JSON-файл (объект или список) или папку с JSON-файлами."""
+    files: List[str] = []
+    if os.path.isdir(path):
+        for root, _, names in os.walk(path):
+            files.extend(os.path.join(root, name) for name in names if name.endswith('.json'))
+    else:
+        files.append(path)
+
+    records: List[Dict[str, Any]] = []
+    for file_path in files:
+        try:
+            with open(file_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except Exception as e:
+            logger.warning(f"Пропускаю {file_path}: {e}")
+            continue
+        items = payload if isinstance(payload, list) else [payload]
+        for item in items:
+            if isinstance(item, dict) and {'id', 'name', 'stats', 'types'} <= item.keys():
+                records.append(slim_pokemon(item))
+    return store.add_many(records)
+
+
+async def fetch_incremental(store: PokedexStore, first: int = 1, last: int = POKEDEX_MAX_ID) -> int:
+    """Догружает из PokeAPI номера, которых нет в снимке."""
+    from http_client import http_client
+
+    semaphore = asyncio.Semaphore(POKEDEX_FETCH_CONCURRENCY)
+    records: List[Dict[str, Any]] = []
+
+    async def fetch(pokemon_id: int) -> None:
+        async with semaphore:
+            try:
+                data = await http_client.get_json(f'https://pokeapi.co/api/v2/pokemon/{pokemon_id}', timeout=10)
+                records.append(slim_pokemon(data))
+            except Exception as e:
+                logger.warning(f"Не удалось получить покемона #{pokemon_id}: {e}")
+
+    try:
+        await asyncio.gather(*(fetch(pokemon_id) for pokemon_id in store.missing_ids(first, last)))
+    finally:
+        await http_client.close()
+    return store.add_many(records)
+
+
+pokedex = PokedexStore()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Сборка локального снимка Pokédex")
+    parser.add_argument("--db", default=POKEDEX_DB, help="путь к SQLite-файлу снимка")
+    parser.add_argument("--dump", help="JSON-файл или папка с дампом PokeAPI")
+    parser.add_argument("--fetch", nargs=2, type=int, metavar=("FIRST", "LAST"), help="догрузить диапазон номеров из PokeAPI")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    store = PokedexStore(args.db)
+    store.load()
+    if args.dump:
+        print(f"Импортировано из дампа: {import_dump(store, args.dump)}")
+    if args.fetch:
+        print(f"Загружено из PokeAPI: {asyncio.run(fetch_incremental(store, *args.fetch))}")
+    print(f"В снимке: {len(store)} покемонов")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""LRU-кеш эмбеддингов текстового энкодера CLIP для диффузии.
+
+Негативный промпт одинаков в каждом вызове, а популярные промпты
+повторяются, поэтому их prompt_embeds считаются один раз на модель и
+передаются в пайплайн напрямую, минуя текстовый энкодер. Кеш ограничен
+суммарным объёмом тензоров (PROMPT_EMBED_CACHE_MB, 0 — выключен).
+"""
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+from collections import OrderedDict
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+PROMPT_EMBED_CACHE_MB: int = int(os.getenv("PROMPT_EMBED_CACHE_MB", "64"))
+
+EmbeddingKey = Tuple[str, str]
+
+
+def tensor_bytes(tensor: Any) -> int:
+    return int(tensor.element_size() * tensor.nelement())
+
+
+class PromptEmbeddingCache:
+    """Отображение (модель, текст) → тензор эмбеддингов (1, L, D) с LRU-вытеснением по памяти."""
+
+    def __init__(self, max_bytes: int = PROMPT_EMBED_CACHE_MB * 1024 * 1024):
+        self.max_bytes = max(0, max_bytes)
+        self._entries: "OrderedDict[EmbeddingKey, Tuple[Any, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, model_id: str, text: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get((model_id, text))
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end((model_id, text))
+            self.stats['hits'] += 1
+            return entry[0]
+
+    def set(self, model_id: str, text: str, embeds: Any) -> None:
+        size = tensor_bytes(embeds)
+        if size > self.max_bytes:
+            return
+        key = (model_id, text)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.bytes -= previous[1]
+            self._entries[key] = (embeds, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+                self.stats['evictions'] += 1
+
+    def encode(self, model_id: str, texts: Sequence[str], encoder: Callable[[List[str]], Any]) -> Any:
+        """Эмбеддинги (N, L, D) для texts: попадания берутся из кеша, промахи
+        считаются одним вызовом encoder и кладутся в кеш по одному."""
+        import torch
+
+        found: Dict[str, Any] = {}
+        for text in dict.fromkeys(texts):
+            cached = self.get(model_id, text)
+            if cached is not None:
+                found[text] = cached
+        missing = [text for text in dict.fromkeys(texts) if text not in found]
+        if missing:
+            embeds = encoder(missing)
+            for index, text in enumerate(missing):
+                row = embeds[index:index + 1].detach()
+                found[text] = row
+                self.set(model_id, text, row)
+        return torch.cat([found[text] for text in texts], dim=0)
+
+    def clear(self, model_id: Optional[str] = None) -> None:
+        """Сбрасывает кеш целиком или только эмбеддинги одной модели."""
+        with self._lock:
+            for key in [key for key in self._entries if model_id is None or key[0] == model_id]:
+                self.bytes -= self._entries.pop(key)[1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        stats: Dict[str, Any] = dict(self.stats)
+        stats['entries'] = len(self._entries)
+        stats['size_mb'] = round(self.bytes / 2**20, 1)
+        return stats
+
+
+prompt_embeddings = PromptEmbeddingCache()
@@ -0,0 +1,162 @@
+"""TTL + LRU кеш ответов внешних API с необязательным SQLite-уровнем."""
+from typing import Any, Dict, Optional, Tuple
+from collections import OrderedDict
+import threading
+import asyncio
+import logging
+import sqlite3
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+KITSU_CACHE_SIZE: int = int(os.getenv("KITSU_CACHE_SIZE", "512"))
+KITSU_CACHE_TTL: float = float(os.getenv("KITSU_CACHE_TTL", str(6 * 3600)))
+KITSU_CACHE_DB: str = os.getenv("KITSU_CACHE_DB", "data/kitsu_cache.sqlite")
+# Как часто при записи удалять из SQLite просроченные ответы, секунды
+KITSU_CACHE_PRUNE_INTERVAL: float = float(os.getenv("KITSU_CACHE_PRUNE_INTERVAL", "600"))
+
+
+def normalize_query(query: str) -> str:
+    """Нормализует запрос для ключа кеша: регистр и лишние пробелы."""
+    return ' '.join(query.casefold().split())
+
+
+class ResponseCache:
+    """Ограниченный LRU в памяти + необязательный SQLite-уровень на диске."""
+
+    def __init__(self, max_size: int = KITSU_CACHE_SIZE, ttl: float = KITSU_CACHE_TTL, db_path: Optional[str] = KITSU_CACHE_DB):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path or None
+        self._memory: "OrderedDict[Tuple[str, str], Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._pruned_at = 0.0
+        self.stats: Dict[str, int] = {
+            'hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expired_rows': 0,
+        }
+
+    def _connect(self) -> Optional[sqlite3.Connection]:
+        if self.db_path is None:
+            return None
+        if self._db is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "category TEXT, query TEXT, stored_at REAL, payload TEXT, "
+                "PRIMARY KEY (category, query))"
+            )
+            self._db.commit()
+            self._prune(self._db, time.time())
+        return self._db
+
+    def _prune(self, db: sqlite3.Connection, now: float) -> None:
+        """Удаляет из SQLite просроченные ответы, иначе дисковый уровень растёт без предела."""
+        cursor = db.execute("DELETE FROM responses WHERE stored_at < ?", (now - self.ttl,))
+        db.commit()
+        self._pruned_at = now
+        self.stats['expired_rows'] += max(cursor.rowcount, 0)
+
+    def _remember(self, key: Tuple[str, str], stored_at: float, value: Any) -> None:
+        self._memory[key] = (stored_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def get(self, category: str, query: str) -> Optional[Any]:
+        """Возвращает закешированный ответ или None, если его нет или он устарел."""
+        key = (category, normalize_query(query))
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] <= self.ttl:
+                    self._memory.move_to_end(key)
+                    self.stats['hits'] += 1
+                    return entry[1]
+                del self._memory[key]
+            try:
+                db = self._connect()
+                if db is not None:
+                    row = db.execute(
+                        "SELECT stored_at, payload FROM responses WHERE category = ? AND query = ?",
+                        key,
+                    ).fetchone()
+                    if row is not None and now - row[0] <= self.ttl:
+                        value = json.loads(row[1])
+                        self._remember(key, row[0], value)
+                        self.stats['disk_hits'] += 1
+                        return value
+            except Exception as e:
+                logger.warning(f"Ошибка чтения дискового кеша: {e}")
+            self.stats['misses'] += 1
+            return None
+
+    def set(self, category: str, query: str, value: Any) -> None:
+        """Сохраняет ответ в памяти и, если включено, на диске."""
+        key = (category, normalize_query(query))
+        stored_at = time.time()
+        with self._lock:
+            self._remember(key, stored_at, value)
+            try:
+                db = self._connect()
+                if db is not None:
+                    db.execute(
+                        "INSERT OR REPLACE INTO responses (category, query, stored_at, payload) VALUES (?, ?, ?, ?)",
+                        (key[0], key[1], stored_at, json.dumps(value, ensure_ascii=False)),
+                    )
+                    db.commit()
+                    if stored_at - self._pruned_at >= KITSU_CACHE_PRUNE_INTERVAL:
+                        self._prune(db, stored_at)
+            except Exception as e:
+                logger.warning(f"Ошибка записи дискового кеша: {e}")
+
+    async def aget(self, category: str, query: str) -> Optional[Any]:
+        """Асинхронный get: дисковый уровень читается вне event loop."""
+        key = (category, normalize_query(query))
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[1]
+        if self.db_path is None:
+            return self.get(category, query)
+        return await asyncio.to_thread(self.get, category, query)
+
+    async def aset(self, category: str, query: str, value: Any) -> None:
+        """Асинхронный set: запись на диск выполняется вне event loop."""
+        if self.db_path is None:
+            self.set(category, query, value)
+            return
+        await asyncio.to_thread(self.set, category, query, value)
+
+    def clear(self) -> None:
+        """Очищает оба уровня кеша."""
+        with self._lock:
+            self._memory.clear()
+            db = self._connect()
+            if db is not None:
+                db.execute("DELETE FROM responses")
+                db.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Счётчики попаданий/промахов и размер кеша в памяти."""
+        stats: Dict[str, Any] = dict(self.stats)
+        total = stats['hits'] + stats['disk_hits'] + stats['misses']
+        stats['size'] = len(self._memory)
+        stats['hit_rate'] = (stats['hits'] + stats['disk_hits']) / total if total else 0.0
+        return stats
+
+
+kitsu_cache = ResponseCache()
@@ -0,0 +1,275 @@
+"""Экспорт классификаторов 224×224 в TFLite с опциональной квантизацией.
+
+Режимы: float (без квантизации), dynamic (веса int8) и int8 (веса и
+активации int8 с калибровкой по представительному набору картинок).
+Артефакт кешируется по хешу исходного архива и режиму.
+
+Сравнение с исходной Keras-моделью (задержка, память, совпадение top-1):
+    python tflite_export.py tm --images calib/ --modes dynamic int8
+"""
+from typing import Any, Callable, Dict, List, Sequence
+from archive_cache import ModelArchive, archive_digest
+from keras_classifier import KerasClassifier
+from model_registry import rss_bytes
+from log_sink import log_message
+import numpy as np
+import argparse
+import logging
+import zipfile
+import json
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+TFLITE_CACHE_DIR: str = os.getenv("TFLITE_CACHE_DIR", "data/tflite")
+# Пусто — обычный Keras; float / dynamic / int8 — обслуживать модель через TFLite
+CLASSIFIER_TFLITE: str = os.getenv("CLASSIFIER_TFLITE", "")
+TFLITE_THREADS: int = int(os.getenv("TFLITE_THREADS", "0"))
+CALIBRATION_DIR: str = os.getenv("CALIBRATION_DIR", "")
+CALIBRATION_LIMIT: int = int(os.getenv("CALIBRATION_LIMIT", "100"))
+TFLITE_REPORT_PATH: str = os.getenv("TFLITE_REPORT_PATH", "data/tflite_report.json")
+
+MODES = ("float", "dynamic", "int8")
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def _interpreter_class() -> Any:
+    """tflite_runtime, если установлен (лёгкий), иначе интерпретатор из TensorFlow."""
+    try:
+        from tflite_runtime.interpreter import Interpreter
+        return Interpreter
+    except ImportError:
+        import tensorflow as tf
+        return tf.lite.Interpreter
+
+
+class TFLiteModel:
+    """Интерпретатор TFLite с интерфейсом Keras-модели: model(x) и model.predict(x).
+
+    mode — режим, в котором артефакт действительно экспортирован (int8 без
+    калибровки превращается в dynamic).
+    """
+
+    def __init__(self, path: str, threads: int = TFLITE_THREADS, mode: str = ""):
+        self.path = path
+        self.mode = mode
+        self.interpreter = _interpreter_class()(model_path=path, num_threads=threads or None)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch = int(self._input['shape'][0])
+
+    def _resize(self, batch: int) -> None:
+        if batch == self._batch:
+            return
+        shape = list(self._input['shape'])
+        shape[0] = batch
+        self.interpreter.resize_tensor_input(self._input['index'], shape)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch = batch
+
+    def __call__(self, batch: np.ndarray, training: bool = False) -> np.ndarray:
+        self._resize(batch.shape[0])
+        dtype = self._input['dtype']
+        if dtype != np.float32:
+            scale, zero_point = self._input['quantization']
+            batch = np.clip(np.round(batch / scale + zero_point), np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+        self.interpreter.set_tensor(self._input['index'], batch)
+        self.interpreter.invoke()
+        output = self.interpreter.get_tensor(self._output['index'])
+        if self._output['dtype'] != np.float32:
+            scale, zero_point = self._output['quantization']
+            output = (output.astype(np.float32) - zero_point) * scale
+        return output
+
+    def predict(self, batch: np.ndarray, verbose: int = 0) -> np.ndarray:
+        return self(batch)
+
+
+def artifact_path(name: str, digest: str, mode: str, cache_dir: str = TFLITE_CACHE_DIR) -> str:
+    return os.path.join(cache_dir, f"{name}-{digest}-{mode}.tflite")
+
+
+def calibration_images(archive: ModelArchive, directory: str = CALIBRATION_DIR, limit: int = CALIBRATION_LIMIT) -> List[bytes]:
+    """Картинки для калибровки int8: из CALIBRATION_DIR, а если его нет — из самого архива
+    (проекты Teachable Machine хранят обучающие примеры рядом с моделью)."""
+    images: List[bytes] = []
+    if directory and os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                with open(os.path.join(directory, name), 'rb') as f:
+                    images.append(f.read())
+            if len(images) >= limit:
+                return images
+    with zipfile.ZipFile(archive.archive_path, 'r') as zf:
+        for name in zf.namelist():
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                images.append(zf.read(name))
+            if len(images) >= limit:
+                break
+    return images
+
+
+def convert(keras_model: Any, mode: str, calibration: Sequence[np.ndarray] = ()) -> bytes:
+    """Конвертирует Keras-модель в TFLite в заданном режиме квантизации."""
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    if mode in ("dynamic", "int8"):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    if mode == "int8":
+        if not calibration:
+            raise ValueError("Для int8 нужен калибровочный набор")
+
+        def representative_dataset() -> Any:
+            for sample in calibration:
+                yield [sample[None].astype(np.float32)]
+
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def load_or_export(
+    name: str,
+    archive: ModelArchive,
+    mode: str,
+    load_keras: Callable[[], Any],
+    runtime: KerasClassifier,
+) -> TFLiteModel:
+    """Готовый TFLite-артефакт из кеша; при промахе грузит Keras-модель и экспортирует её.
+
+    Для int8 без калибровочных картинок (нет CALIBRATION_DIR и примеров в архиве,
+    как у converted_keras.zip) экспортируется dynamic — с предупреждением, а не ошибкой;
+    фактический режим — в TFLiteModel.mode.
+    """
+    if mode not in MODES:
+        raise ValueError(f"Неизвестный режим TFLite: {mode}")
+    path = artifact_path(name, archive_digest(archive.archive_path), mode)
+    if not os.path.exists(path):
+        images: List[bytes] = calibration_images(archive) if mode == "int8" else []
+        if mode == "int8" and not images:
+            log_message(
+                f"⚠️ TFLite {name}: нет калибровочных картинок для int8 (CALIBRATION_DIR), экспортирую dynamic",
+                level="WARNING",
+            )
+            return load_or_export(name, archive, "dynamic", load_keras, runtime)
+        keras_model = load_keras()
+        if keras_model is None:
+            raise RuntimeError(f"Keras-модель {name} не загружена, экспорт невозможен")
+        calibration: List[np.ndarray] = list(runtime.preprocess(images)) if images else []
+        started = time.perf_counter()
+        data = convert(keras_model, mode, calibration)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        log_message(
+            f"TFLite {name} ({mode}) экспортирован за {time.perf_counter() - started:.1f} с, "
+            f"{len(data) / 2**20:.1f} МБ"
+        )
+    return TFLiteModel(path, mode=mode)
+
+
+def _measure(model: Any, batches: Sequence[np.ndarray]) -> Dict[str, Any]:
+    latencies: List[float] = []
+    predictions: List[int] = []
+    for sample in batches:
+        started = time.perf_counter()
+        output = np.asarray(model(sample[None], training=False))
+        latencies.append(time.perf_counter() - started)
+        predictions.append(int(output[0].argmax()))
+    latencies.sort()
+    return {
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 2),
+        'top1': predictions,
+    }
+
+
+def compare(
+    name: str,
+    archive: ModelArchive,
+    keras_model: Any,
+    runtime: KerasClassifier,
+    images: Sequence[bytes],
+    modes: Sequence[str],
+) -> Dict[str, Any]:
+    """Задержка, память и совпадение top-1 TFLite-вариантов с исходной Keras-моделью."""
+    samples = list(runtime.preprocess(images))
+    if not samples:
+        raise ValueError("Нет изображений для сравнения")
+    keras_model(samples[0][None], training=False)
+    reference = _measure(keras_model, samples)
+    rows: List[Dict[str, Any]] = [{
+        'mode': 'keras',
+        'mean_ms': reference['mean_ms'],
+        'p95_ms': reference['p95_ms'],
+        'size_mb': None,
+        'memory_delta_mb': None,
+        'top1_agreement': 1.0,
+    }]
+    for mode in modes:
+        rss_before = rss_bytes()
+        model = load_or_export(name, archive, mode, lambda: keras_model, runtime)
+        rss_after = rss_bytes()
+        model(samples[0][None])
+        measured = _measure(model, samples)
+        agreement = sum(a == b for a, b in zip(reference['top1'], measured['top1'])) / len(samples)
+        rows.append({
+            'mode': model.mode,
+            'requested_mode': mode,
+            'mean_ms': measured['mean_ms'],
+            'p95_ms': measured['p95_ms'],
+            'size_mb': round(os.path.getsize(model.path) / 2**20, 2),
+            'memory_delta_mb': round((rss_after - rss_before) / 2**20, 1) if rss_before is not None and rss_after is not None else None,
+            'top1_agreement': round(agreement, 4),
+        })
+    return {
+        'model': name,
+        'images': len(samples),
+        'timestamp': time.strftime("%Y-%m-%d %H:%M:%S"),
+        'results': rows,
+    }
+
+
+def _load_source(name: str) -> Any:
+    """Исходная Keras-модель и её обёртка из бота, без TFLite."""
+    if name == "tm":
+        from tm import TeachableMachineRuntime
+        wrapper: Any = TeachableMachineRuntime("project2.tm", tflite_mode="")
+        if not wrapper.load_project():
+            raise RuntimeError("Проект Teachable Machine не загружен")
+        return wrapper, wrapper.archive, wrapper.runtime
+    from ideogram import IdeogramModel
+    wrapper = IdeogramModel("converted_keras.zip", tflite_mode="")
+    if not wrapper.load():
+        raise RuntimeError("Ideogram модель не загружена")
+    return wrapper, wrapper.archive, wrapper.runtime
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Экспорт классификаторов в TFLite и сравнение с Keras")
+    parser.add_argument("model", choices=("tm", "ideogram"))
+    parser.add_argument("--images", default=CALIBRATION_DIR, help="папка с тестовыми картинками")
+    parser.add_argument("--modes", nargs="+", default=list(MODES), choices=MODES)
+    parser.add_argument("--limit", type=int, default=CALIBRATION_LIMIT)
+    parser.add_argument("--report", default=TFLITE_REPORT_PATH)
+    args = parser.parse_args()
+
+    _, source_archive, source_runtime = _load_source(args.model)
+    test_images = calibration_images(source_archive, args.images, args.limit)
+    report = compare(args.model, source_archive, source_runtime.model, source_runtime, test_images, args.modes)
+    for row in report['results']:
+        print(
+            f"{row['mode']:>8}: {row['mean_ms']} мс (p95 {row['p95_ms']}), "
+            f"размер {row['size_mb']} МБ, память {row['memory_delta_mb']} МБ, top-1 {row['top1_agreement']:.1%}"
+        )
+    if args.report:
+        os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,272 @@
+"""CPU-бэкенды для YOLO: экспорт в ONNX/OpenVINO и собственная сессия ONNX Runtime.
+
+Экспорт выполняется один раз: артефакт кладётся рядом с .pt, а в имени
+хранится хеш весов, так что после замены .pt модель переэкспортируется.
+
+Запуск как скрипта сравнивает задержку и пропускную способность бэкендов:
+    python yolo_backends.py test.jpg --runs 20
+"""
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+from log_sink import log_message
+from PIL import Image, ImageDraw
+import numpy as np
+import argparse
+import hashlib
+import logging
+import shutil
+import time
+import ast
+import os
+
+logger = logging.getLogger(__name__)
+
+YOLO_IMGSZ: int = int(os.getenv("YOLO_IMGSZ", "640"))
+ORT_INTRA_OP_THREADS: int = int(os.getenv("ORT_INTRA_OP_THREADS", "0"))
+ORT_INTER_OP_THREADS: int = int(os.getenv("ORT_INTER_OP_THREADS", "0"))
+ORT_EXECUTION_MODE: str = os.getenv("ORT_EXECUTION_MODE", "sequential")
+
+BACKENDS: Tuple[str, ...] = ("torch", "onnx", "openvino")
+
+
+def file_hash(path: str, length: int = 12) -> str:
+    """Короткий sha256 файла весов."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:length]
+
+
+def artifact_path(pt_path: str, backend: str) -> str:
+    """Путь к экспортированной модели для данных весов и бэкенда."""
+    stem, _ = os.path.splitext(pt_path)
+    tag = f"{stem}-{file_hash(pt_path)}"
+    if backend == "onnx":
+        return f"{tag}.onnx"
+    if backend == "openvino":
+        return f"{tag}_openvino_model"
+    raise ValueError(f"Неизвестный бэкенд экспорта: {backend}")
+
+
+def export_artifact(pt_path: str, backend: str, imgsz: int = YOLO_IMGSZ) -> str:
+    """Экспортирует .pt в ONNX или OpenVINO, если артефакта для этого хеша ещё нет."""
+    target = artifact_path(pt_path, backend)
+    if os.path.exists(target):
+        return target
+
+    from ultralytics import YOLO
+
+    started = time.perf_counter()
+    log_message(f"Экспорт {pt_path} в {backend} (imgsz={imgsz})...")
+    exported = YOLO(pt_path).export(format=backend, imgsz=imgsz, dynamic=backend == "onnx", simplify=backend == "onnx")
+    exported = str(exported)
+    if os.path.abspath(exported) != os.path.abspath(target):
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        elif os.path.exists(target):
+            os.remove(target)
+        os.replace(exported, target)
+    log_message(f"Экспорт {backend} готов за {time.perf_counter() - started:.1f} с: {target}")
+    return target
+
+
+def letterbox(image: Image.Image, size: int = YOLO_IMGSZ) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """Масштабирует с сохранением пропорций и дополняет до квадрата size×size серым (114)."""
+    width, height = image.size
+    ratio = min(size / width, size / height)
+    new_w, new_h = max(1, round(width * ratio)), max(1, round(height * ratio))
+    pad_x, pad_y = (size - new_w) / 2, (size - new_h) / 2
+    canvas = Image.new("RGB", (size, size), (114, 114, 114))
+    canvas.paste(image.resize((new_w, new_h), Image.Resampling.BILINEAR), (int(round(pad_x - 0.1)), int(round(pad_y - 0.1))))
+    tensor = np.asarray(canvas, dtype=np.float32).transpose(2, 0, 1) / 255.0
+    return tensor, ratio, (pad_x, pad_y)
+
+
+def _nms(boxes: np.ndarray, scores: np.ndarray, iou: float) -> List[int]:
+    order = scores.argsort()[::-1]
+    keep: List[int] = []
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    while order.size:
+        i = int(order[0])
+        keep.append(i)
+        xx1 = np.maximum(boxes[i, 0], boxes[order[1:], 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[order[1:], 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[order[1:], 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[order[1:], 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        overlap = inter / (areas[i] + areas[order[1:]] - inter + 1e-9)
+        order = order[1:][overlap <= iou]
+    return keep
+
+
+class OnnxBox:
+    """Один бокс в форме, совместимой с ultralytics Boxes при итерации."""
+
+    def __init__(self, xyxy: np.ndarray, conf: float, cls: int):
+        self.xyxy = xyxy.reshape(1, 4)
+        self.conf = np.array([conf], dtype=np.float32)
+        self.cls = np.array([cls], dtype=np.float32)
+
+
+class OnnxResult:
+    """Результат ORT-инференса с теми же полями, что читает YOLODetector: boxes, names, plot()."""
+
+    def __init__(self, image: Image.Image, boxes: List[OnnxBox], names: Dict[int, str]):
+        self.orig_img = image
+        self.boxes = boxes
+        self.names = names
+
+    def plot(self) -> np.ndarray:
+        """Рисует рамки и подписи, возвращает BGR-массив как ultralytics."""
+        canvas = self.orig_img.copy()
+        draw = ImageDraw.Draw(canvas)
+        line = max(2, round(sum(canvas.size) / 600))
+        for box in self.boxes:
+            x1, y1, x2, y2 = box.xyxy[0].tolist()
+            class_id = int(box.cls[0])
+            draw.rectangle((x1, y1, x2, y2), outline=(255, 56, 56), width=line)
+            draw.text((x1 + line, max(0, y1 - 12)), f"{self.names.get(class_id, class_id)} {float(box.conf[0]):.2f}", fill=(255, 56, 56))
+        return np.asarray(canvas)[..., ::-1]
+
+
+class OnnxYOLO:
+    """YOLO поверх собственной сессии ONNX Runtime с настраиваемыми потоками.
+
+    Поддерживает выход YOLOv10 (N, 300, 6) без NMS и классический
+    выход YOLOv8 (N, 4 + классы, якоря) с NMS на numpy.
+    """
+
+    def __init__(
+        self,
+        onnx_path: str,
+        intra_op_threads: int = ORT_INTRA_OP_THREADS,
+        inter_op_threads: int = ORT_INTER_OP_THREADS,
+        execution_mode: str = ORT_EXECUTION_MODE,
+    ):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.execution_mode = (
+            ort.ExecutionMode.ORT_PARALLEL if execution_mode == "parallel" else ort.ExecutionMode.ORT_SEQUENTIAL
+        )
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input = self.session.get_inputs()[0]
+        shape = self.input.shape
+        self.imgsz = shape[2] if isinstance(shape[2], int) else YOLO_IMGSZ
+        self.dynamic_batch = not isinstance(shape[0], int)
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(metadata['names']) if 'names' in metadata else {}
+        log_message(
+            f"ONNX Runtime: {os.path.basename(onnx_path)}, intra={intra_op_threads or 'auto'}, "
+            f"inter={inter_op_threads or 'auto'}, батч {'динамический' if self.dynamic_batch else '1'}"
+        )
+
+    def _parse(
+        self,
+        output: np.ndarray,
+        image: Image.Image,
+        ratio: float,
+        pad: Tuple[float, float],
+        conf: float,
+        iou: float,
+        classes: Optional[Sequence[int]],
+    ) -> OnnxResult:
+        nms_free = output.shape[-1] == 6
+        if nms_free:
+            boxes, scores, class_ids = output[:, :4], output[:, 4], output[:, 5].astype(int)
+        else:
+            predictions = output.T
+            boxes_xywh, class_scores = predictions[:, :4], predictions[:, 4:]
+            class_ids = class_scores.argmax(axis=1)
+            scores = class_scores.max(axis=1)
+            boxes = np.empty_like(boxes_xywh)
+            boxes[:, :2] = boxes_xywh[:, :2] - boxes_xywh[:, 2:] / 2
+            boxes[:, 2:] = boxes_xywh[:, :2] + boxes_xywh[:, 2:] / 2
+
+        mask = scores >= conf
+        if classes is not None:
+            mask &= np.isin(class_ids, list(classes))
+        keep = np.flatnonzero(mask)
+        if not nms_free and keep.size:
+            keep = keep[_nms(boxes[keep], scores[keep], iou)]
+
+        width, height = image.size
+        result: List[OnnxBox] = []
+        for i in keep:
+            x1, y1, x2, y2 = boxes[i]
+            xyxy = np.array([
+                np.clip((x1 - pad[0]) / ratio, 0, width),
+                np.clip((y1 - pad[1]) / ratio, 0, height),
+                np.clip((x2 - pad[0]) / ratio, 0, width),
+                np.clip((y2 - pad[1]) / ratio, 0, height),
+            ], dtype=np.float32)
+            result.append(OnnxBox(xyxy, float(scores[i]), int(class_ids[i])))
+        return OnnxResult(image, result, self.names)
+
+    def predict(
+        self,
+        source: Union[Image.Image, List[Image.Image]],
+        conf: float = 0.25,
+        iou: float = 0.7,
+        classes: Optional[Sequence[int]] = None,
+        **_: Any,
+    ) -> List[OnnxResult]:
+        """Та же сигнатура, что у ultralytics YOLO.predict (device/verbose игнорируются)."""
+        images = source if isinstance(source, list) else [source]
+        prepared = [letterbox(image.convert("RGB"), self.imgsz) for image in images]
+        if self.dynamic_batch:
+            outputs = self.session.run(None, {self.input.name: np.stack([p[0] for p in prepared])})[0]
+        else:
+            outputs = np.concatenate([
+                self.session.run(None, {self.input.name: p[0][None]})[0] for p in prepared
+            ])
+        return [
+            self._parse(output, image, ratio, pad, conf, iou, classes)
+            for output, image, (_, ratio, pad) in zip(outputs, images, prepared)
+        ]
+
+
+def benchmark(image_path: str, backends: Sequence[str], runs: int, batch: int) -> List[Dict[str, Any]]:
+    """Меряет задержку одиночного запроса и пропускную способность батча для каждого бэкенда."""
+    from cv import YOLODetector
+
+    image = Image.open(image_path).convert("RGB")
+    report: List[Dict[str, Any]] = []
+    for backend in backends:
+        detector = YOLODetector(backend=backend)
+        assert detector.model is not None
+        detector.model.predict(source=image, verbose=False)
+        latencies: List[float] = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            detector.model.predict(source=image, verbose=False)
+            latencies.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        for _ in range(max(1, runs // batch)):
+            detector.model.predict(source=[image] * batch, verbose=False)
+        elapsed = time.perf_counter() - started
+        latencies.sort()
+        report.append({
+            'backend': backend,
+            'p50_ms': round(latencies[len(latencies) // 2] * 1000, 1),
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+            'throughput_ips': round(max(1, runs // batch) * batch / elapsed, 2),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение бэкендов YOLO на CPU")
+    parser.add_argument("image", help="тестовое изображение")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--batch", type=int, default=4)
+    args = parser.parse_args()
+    for row in benchmark(args.image, args.backends, args.runs, args.batch):
+        print(
+            f"{row['backend']:>9}: p50 {row['p50_ms']} мс, p95 {row['p95_ms']} мс, "
+            f"{row['throughput_ips']} изобр/с"
+        )
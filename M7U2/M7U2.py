@@ -1,11 +1,14 @@
 from aiogram.types import BotCommand, BotCommandScopeDefault, Message
 from M1L3.tm import TeachableMachineRuntime
 from aiogram import Bot, Dispatcher, types
-from typing import Any, Coroutine, cast
-from M1L3.ideogram import IdeogramModel
+from typing import Any, Coroutine, Dict, cast
+from M1L3.ideogram import IMG_SIZE as IDEOGRAM_INPUT_SIZE, IdeogramModel
 from aiogram.filters import Command
 from dotenv import load_dotenv
-from M1L3.cv import detector
+from M1L3.model_registry import ModelRegistry
+from M1L3.cv import YOLODetector, detector
+from M1L3.photo_ingest import fetch_photo
+from M1L3.yolo_backends import YOLO_IMGSZ
 import logging
 import asyncio
 import time
@@ -23,7 +26,22 @@ bot = Bot(token=TOKEN)
 dp = Dispatcher()
 tm_model = TeachableMachineRuntime("project2.tm")
 ideogram_model = IdeogramModel("converted_keras.zip")
-tm_model.load_project()
+models = ModelRegistry()
+warmup_task: "asyncio.Task[Dict[str, Any]] | None" = None
+
+def load_tm_model() -> TeachableMachineRuntime:
+    if not tm_model.load_project():
+        raise RuntimeError("Проект Teachable Machine не загружен")
+    return tm_model
+
+def load_ideogram_model() -> IdeogramModel:
+    if not ideogram_model.load():
+        raise RuntimeError("Ideogram модель не загружена")
+    return ideogram_model
+
+models.register("detector", detector.load, "YOLO", warmup=YOLODetector.warmup)
+models.register("tm", load_tm_model, "Teachable Machine", warmup=TeachableMachineRuntime.warmup)
+models.register("ideogram", load_ideogram_model, "Ideogram", warmup=IdeogramModel.warmup)
 
 def log_message(text: str) -> None:
     timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
@@ -78,20 +96,9 @@ async def detect_command(message: types.Message) -> None:
             return
         user_id: int = message.from_user.id
 
-        photo = source_message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        if file.file_path is None:
-            await message.answer("❌ Ошибка: путь к файлу отсутствует")
-            return
-        image_bytes = await bot.download_file(file.file_path)
-        if image_bytes is None:
-            await message.answer("❌ Ошибка: не удалось скачать файл")
-            return
-        if isinstance(image_bytes, (bytes, bytearray)):
-            payload: bytes = bytes(image_bytes)
-        else:
-            payload = image_bytes.read()
-        photo_file, caption = await detector.detect_and_format_telegram(payload, user_id)
+        payload = await fetch_photo(bot, source_message.photo, max_side=YOLO_IMGSZ)
+        detector_model: YOLODetector = await models.ensure("detector")
+        photo_file, caption = await detector_model.detect_and_format_telegram(payload, user_id)
         await message.answer_photo(photo_file, caption=caption)
     except Exception as e:
         logger.error(f"Ошибка детекции: {e}")
@@ -118,20 +125,9 @@ async def ideogram_handler(message: types.Message) -> None:
             await message.answer("❌ Ошибка: не удалось определить пользователя")
             return
 
-        photo = source_message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        if file.file_path is None:
-            await message.answer("❌ Ошибка: путь к файлу отсутствует")
-            return
-        image_bytes = await bot.download_file(file.file_path)
-        if image_bytes is None:
-            await message.answer("❌ Ошибка: не удалось скачать файл")
-            return
-        if isinstance(image_bytes, (bytes, bytearray)):
-            payload: bytes = bytes(image_bytes)
-        else:
-            payload = image_bytes.read()
+        payload = await fetch_photo(bot, source_message.photo, min_side=IDEOGRAM_INPUT_SIZE)
 
+        await models.ensure("ideogram")
         class_name, confidence = await ideogram_model.predict(payload)
         
         await message.answer(
@@ -158,22 +154,11 @@ async def detect_with_tm_command(message: types.Message) -> None:
             await message.answer("❌ Ошибка: не удалось определить пользователя")
             return
 
-        # Скачиваем фото из Telegram
-        photo = message.reply_to_message.photo[-1]
-        file = await bot.get_file(photo.file_id)
-        if file.file_path is None:
-            await message.answer("❌ Ошибка: путь к файлу отсутствует")
-            return
-        image_bytes = await bot.download_file(file.file_path)
-        if image_bytes is None:
-            await message.answer("❌ Ошибка: не удалось скачать файл")
-            return
-        if isinstance(image_bytes, (bytes, bytearray)):
-            image_payload: bytes = bytes(image_bytes)
-        else:
-            image_payload = image_bytes.read()
+        # Скачиваем самый маленький вариант фото, которого хватает модели
+        image_payload = await fetch_photo(bot, message.reply_to_message.photo, min_side=min(tm_model.input_shape))
 
         # Предсказание
+        await models.ensure("tm")
         class_name, confidence = await tm_model.predict_image(image_payload)
         
         # Отправляем результат
@@ -189,10 +174,20 @@ async def detect_with_tm_command(message: types.Message) -> None:
 
 async def shutdown(bot: Bot, dp: Dispatcher) -> None:
     print("\nЗавершение работы бота...")
+    if warmup_task is not None and not warmup_task.done():
+        warmup_task.cancel()
+    models.shutdown()
     await asyncio.gather(
         return_exceptions=True
     )
 
+@dp.startup()
+async def warmup_models() -> None:
+    """Параллельный прогрев моделей в фоне после старта поллинга"""
+    global warmup_task
+    log_message("Фоновый прогрев моделей...")
+    warmup_task = asyncio.create_task(models.warmup_all())
+
 async def main() -> None:
     log_message("Бот запускается...")
     print("Бот запускается...")
@@ -204,10 +199,6 @@ async def main() -> None:
         start_polling_method = getattr(dp, "start_polling")
         poll_task: Coroutine[Any, Any, None] = cast(Coroutine[Any, Any, None], start_polling_method(bot))
         await poll_task
-        if ideogram_model.load():
-            log_message("Ideogram модель загружена")
-        else:
-            log_message("⚠️ Ideogram модель не загружена")
     except (KeyboardInterrupt, asyncio.CancelledError):
         log_message("Бот остановлен по прерыванию")
         print("\nБот остановлен")